@@ -78,18 +78,74 @@ CELERY_ACCEPT_CONTENT = ["application/json"]
 CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULTS_SERIALIZER = "json"
 CELERY_TIMEZONE = MY_TIME_ZONE
+
+# Active users are synced with Wanikani once per interval. Their syncs are
+# spread across it, with at most SCHEDULED_SYNC_MAX_IN_FLIGHT running at once.
+SCHEDULED_SYNC_INTERVAL_HOURS = env.int(
+    "SCHEDULED_SYNC_INTERVAL_HOURS", default=12
+)
+SCHEDULED_SYNC_MAX_IN_FLIGHT = env.int(
+    "SCHEDULED_SYNC_MAX_IN_FLIGHT", default=10
+)
+
 CELERY_BEAT_SCHEDULE = {
-    "all_user_srs_every_hour": {
+    "flag_due_reviews_every_minute": {
+        "task": "kw_webapp.srs.flag_due_reviews",
+        "schedule": timedelta(minutes=1),
+    },
+    # Full sweep, as a safety net for anything the due windows missed.
+    "all_user_srs_every_day": {
         "task": "kw_webapp.srs.all_srs",
-        "schedule": crontab(minute="1"),
+        "schedule": crontab(minute="1", hour="4"),
     },
     "update_users_unlocked_vocab": {
         "task": "kw_webapp.tasks.sync_all_users_to_wk",
-        "schedule": timedelta(hours=12),
+        "schedule": timedelta(hours=SCHEDULED_SYNC_INTERVAL_HOURS),
         "options": {"queue": "long_running_sync"},
     },
+    "dispatch_scheduled_syncs_every_minute": {
+        "task": "kw_webapp.tasks.dispatch_scheduled_syncs",
+        "schedule": timedelta(minutes=1),
+    },
+    # Concurrent writes of the same review can leave the review counters off,
+    # see repair_review_counter_drift.
+    "repair_review_counters_every_day": {
+        "task": "kw_webapp.tasks.repair_review_counters",
+        "schedule": crontab(minute="31", hour="4"),
+    },
 }
 
+# "flag": reviews are due once an SRS run has set their needs_review flag.
+# "read_time": reviews are also due as soon as their next_review_date has
+# passed, no SRS run needed.
+REVIEW_DUE_MODE = env("REVIEW_DUE_MODE", default="flag")
+
+# Wanikani API access. Syncs in every worker share the rate limits below
+# through Redis.
+WANIKANI_API_ROOT = env(
+    "WANIKANI_API_ROOT", default="https://api.wanikani.com/v2/"
+)
+WANIKANI_REQUESTS_PER_MINUTE_PER_KEY = env.int(
+    "WANIKANI_REQUESTS_PER_MINUTE_PER_KEY", default=60
+)
+WANIKANI_REQUESTS_PER_SECOND = env.int(
+    "WANIKANI_REQUESTS_PER_SECOND", default=20
+)
+# Requests in flight at once, across every worker.
+WANIKANI_MAX_CONCURRENT_REQUESTS = env.int(
+    "WANIKANI_MAX_CONCURRENT_REQUESTS", default=10
+)
+WANIKANI_REQUEST_TIMEOUT = env.float("WANIKANI_REQUEST_TIMEOUT", default=30)
+WANIKANI_MAX_RETRIES = env.int("WANIKANI_MAX_RETRIES", default=5)
+WANIKANI_BACKOFF_SECONDS = env.float("WANIKANI_BACKOFF_SECONDS", default=1)
+WANIKANI_MAX_BACKOFF_SECONDS = env.float(
+    "WANIKANI_MAX_BACKOFF_SECONDS", default=60
+)
+# How long the result of checking an API key with Wanikani is trusted for.
+WANIKANI_API_KEY_VALIDATION_TTL = env.int(
+    "WANIKANI_API_KEY_VALIDATION_TTL", default=60 * 60
+)
+
 SECRET_KEY = env("SECRET_KEY")
 DEBUG = env("DEBUG")
 
@@ -172,6 +228,10 @@ ROOT_URLCONF = "KW.urls"
 
 WSGI_APPLICATION = "KW.wsgi.application"
 
+# The benchmarks under kw_webapp/tests/benchmarks only run with `manage.py test
+# --tag benchmark`.
+TEST_RUNNER = "KW.test_runner.BenchmarkExcludingRunner"
+
 # EMAIL BACKEND SETTINGS
 EMAIL_CONFIG = env.email_url("EMAIL_URL", default="dummymail://")
 vars().update(EMAIL_CONFIG)
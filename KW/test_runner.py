@@ -0,0 +1,16 @@
+from django.test.runner import DiscoverRunner
+
+BENCHMARK_TAG = "benchmark"
+
+
+class BenchmarkExcludingRunner(DiscoverRunner):
+    """
+    Leaves the benchmarks out of test runs, as they seed thousands of rows
+    each. Run them with `--tag benchmark`.
+    """
+
+    def __init__(self, tags=None, exclude_tags=None, **kwargs):
+        exclude_tags = set(exclude_tags or [])
+        if BENCHMARK_TAG not in (tags or []):
+            exclude_tags.add(BENCHMARK_TAG)
+        super().__init__(tags=tags, exclude_tags=exclude_tags, **kwargs)
@@ -0,0 +1,102 @@
+import hashlib
+
+from django.core.cache import cache
+from django.http import HttpResponseNotModified
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from kw_webapp.constants import RESPONSE_CACHE_TIMEOUT_SECONDS
+from kw_webapp.tasks import get_catalogue_version
+
+
+def compute_etag(data):
+    return f'"{hashlib.md5(JSONRenderer().render(data)).hexdigest()}"'
+
+
+class CatalogueCacheMixin:
+    """
+    Serves the read actions of a catalogue endpoint from a response cache,
+    keyed on the catalogue version and the full request URL. Any change to the
+    catalogue moves it on to a new version, see
+    kw_webapp.tasks.invalidate_catalogue, so a cached response is never stale.
+    Responses carry an ETag, and a request whose If-None-Match matches it gets
+    an empty 304.
+
+    Fields which depend on the requesting user are listed in `personal_fields`.
+    They are left out of the cached response, and filled back in per request by
+    `get_personal_data`.
+    """
+
+    cached_actions = ("list", "retrieve")
+    personal_fields = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if (
+            cls.personal_fields
+            and cls.get_personal_data is CatalogueCacheMixin.get_personal_data
+        ):
+            raise TypeError(
+                f"{cls.__name__} sets personal_fields, so it has to override "
+                "get_personal_data."
+            )
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, view, request, *args, **kwargs):
+        if self.action not in self.cached_actions:
+            return view(request, *args, **kwargs)
+
+        key = self.get_response_cache_key(request)
+        entry = cache.get(key)
+        personal_data = None
+        if entry is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200 or not hasattr(response, "data"):
+                # Failed and streamed responses are passed through uncached.
+                return response
+            data = response.data
+            if self.personal_fields:
+                personal_data = {
+                    field: data.pop(field, None)
+                    for field in self.personal_fields
+                }
+            entry = {"data": data, "etag": compute_etag(data)}
+            cache.set(key, entry, RESPONSE_CACHE_TIMEOUT_SECONDS)
+        elif self.personal_fields:
+            personal_data = self.get_personal_data(entry["data"])
+
+        etag = entry["etag"]
+        data = entry["data"]
+        if personal_data is not None:
+            etag = compute_etag([etag, personal_data])
+            data = dict(data, **personal_data)
+
+        if self._if_none_match(request) & {etag, "*"}:
+            response = HttpResponseNotModified()
+        else:
+            response = Response(data)
+        response["ETag"] = etag
+        return response
+
+    def get_response_cache_key(self, request):
+        url_hash = hashlib.sha1(
+            request.build_absolute_uri().encode()
+        ).hexdigest()
+        return f"kw:response:{get_catalogue_version()}:{url_hash}"
+
+    def get_personal_data(self, data):
+        """
+        :param data: The cached, shared part of the response.
+        :return: A dict of the `personal_fields` for the requesting user.
+        """
+        return {}
+
+    @staticmethod
+    def _if_none_match(request):
+        header = request.META.get("HTTP_IF_NONE_MATCH", "")
+        return {tag.strip() for tag in header.split(",") if tag.strip()}
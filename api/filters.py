@@ -1,12 +1,23 @@
 import re
 
-from django.db.models import Q
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+)
+from django.db import connection
+from django.db.models import F, Q
 from django_filters import rest_framework as filters
 
-from kw_webapp.models import Vocabulary, UserSpecific
+from kw_webapp.models import MeaningSynonym, Vocabulary, UserSpecific
 
 import KW.settings
 
+# Meanings are matched as whole words, so they are searched without stemming or
+# stop words. The GIN indexes on meanings and meaning synonyms are built over
+# the same configuration, and are only used by queries which match it.
+MEANING_SEARCH_CONFIG = "simple"
+
 
 def whole_word_regex(value):
     # Gross hack to handle this until I fix it:
@@ -17,6 +28,34 @@ def whole_word_regex(value):
         return r"\y" + re.escape(value) + r"\y"
 
 
+def uses_full_text_search():
+    return connection.vendor == "postgresql"
+
+
+def meaning_document(field):
+    return SearchVector(field, config=MEANING_SEARCH_CONFIG)
+
+
+def meaning_query(value):
+    return SearchQuery(
+        value, config=MEANING_SEARCH_CONFIG, search_type="phrase"
+    )
+
+
+def search_meaning(queryset, field, value):
+    """
+    Filters the queryset down to rows whose `field` contains `value` as whole
+    words, ignoring case. On Postgres this is an indexed full text phrase
+    search, elsewhere (e.g. SQLite) it falls back to matching a word boundary
+    regex.
+    """
+    if not uses_full_text_search():
+        return queryset.filter(**{f"{field}__iregex": whole_word_regex(value)})
+    return queryset.annotate(meaning_document=meaning_document(field)).filter(
+        meaning_document=meaning_query(value)
+    )
+
+
 def filter_level_for_vocab(queryset, name, value):
     if value:
         return queryset.filter(readings__level=value).distinct()
@@ -29,25 +68,46 @@ def filter_level_for_review(queryset, name, value):
 
 def filter_meaning_contains(queryset, name, value):
     if value:
-        return queryset.filter(meaning__iregex=whole_word_regex(value))
+        return search_meaning(queryset, "meaning", value)
 
 
 # This filter awkwardly shoehorned in with the FilterSet filters,
 # but used for direct filtering from the ViewSet
 def filter_user_meaning_contains(meaning_contains, user_id):
-    baseline = Vocabulary.objects.filter(meaning__iregex=whole_word_regex(meaning_contains))
-    user_synonyms = UserSpecific.objects.select_related('vocabulary').filter(
-        Q(user_id=user_id) & Q(meaning_synonyms__text__iregex=whole_word_regex(meaning_contains))
+    """
+    Finds the vocabulary whose meaning, or one of the user's own meaning
+    synonyms for it, contains the search as whole words. On Postgres, the
+    results are ranked by how well their meaning matches, so that vocabulary
+    only found through a synonym comes last.
+    """
+    # Fetched up front, so that both halves of the search can be served by an
+    # index scan.
+    synonyms_vocab_ids = list(
+        search_meaning(
+            MeaningSynonym.objects.filter(review__user_id=user_id),
+            "text",
+            meaning_contains,
+        ).values_list("review__vocabulary_id", flat=True)
+    )
+    if not uses_full_text_search():
+        baseline = search_meaning(
+            Vocabulary.objects.all(), "meaning", meaning_contains
+        )
+        return baseline | Vocabulary.objects.filter(id__in=synonyms_vocab_ids)
+
+    query = meaning_query(meaning_contains)
+    return (
+        Vocabulary.objects.annotate(
+            meaning_document=meaning_document("meaning")
+        )
+        .filter(Q(meaning_document=query) | Q(id__in=synonyms_vocab_ids))
+        .annotate(search_rank=SearchRank(F("meaning_document"), query))
+        .order_by("-search_rank", "id")
     )
-    synonyms_vocab_ids = user_synonyms.values_list('vocabulary', flat=True)
-    synonyms_vocab = Vocabulary.objects.filter(id__in=list(synonyms_vocab_ids))
-    return baseline | synonyms_vocab
 
 def filter_meaning_contains_for_review(queryset, name, value):
     if value:
-        return queryset.filter(
-            vocabulary__meaning__iregex=whole_word_regex(value)
-        )
+        return search_meaning(queryset, "vocabulary__meaning", value)
 
 
 def filter_vocabulary_parts_of_speech(queryset, name, value):
@@ -0,0 +1,98 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(LimitOffsetPagination):
+    """
+    Limit/offset pagination, with an opt-in keyset mode for paging deep into
+    large lists.
+
+    Pass `pagination=keyset` to get the first page in keyset mode. Instead of
+    an offset, each page links to the next through an opaque `cursor`, which
+    holds the id of the last row on the page. The next page is then found by
+    seeking past that id through the primary key index, rather than by scanning
+    and discarding every row before it, and no `count` is run, so a deep page
+    costs the same as the first.
+
+    Keyset pages are always ordered by `id`, whatever the view orders its list
+    by otherwise. Any other order, e.g. by the vocabulary level of a review,
+    lives on another table than the id, so no index could serve the seek.
+    """
+
+    mode_query_param = "pagination"
+    keyset_mode = "keyset"
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor."
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.is_keyset_requested(request)
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.limit = self.get_limit(request)
+        queryset = queryset.order_by("id")
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            queryset = queryset.filter(id__gt=cursor)
+
+        # One extra row tells us whether there is a next page, without a count.
+        results = list(queryset[: self.limit + 1])
+        self.has_next = len(results) > self.limit
+        results = results[: self.limit]
+        self.next_cursor = results[-1].id if self.has_next else None
+        return results
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response(
+            OrderedDict([("next", self.get_next_link()), ("results", data)])
+        )
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.offset_query_param)
+        url = replace_query_param(url, self.mode_query_param, self.keyset_mode)
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.next_cursor)
+        )
+
+    def is_keyset_requested(self, request):
+        return (
+            request.query_params.get(self.mode_query_param) == self.keyset_mode
+            or self.cursor_query_param in request.query_params
+        )
+
+    def encode_cursor(self, last_id):
+        return base64.urlsafe_b64encode(json.dumps(last_id).encode()).decode()
+
+    def decode_cursor(self, request):
+        """
+        :return: The id held by the cursor in the request, or None when asking
+        for the first page.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            last_id = json.loads(
+                base64.urlsafe_b64decode(encoded.encode()).decode()
+            )
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        # bool is a subclass of int, but no id.
+        if not isinstance(last_id, int) or isinstance(last_id, bool):
+            raise NotFound(self.invalid_cursor_message)
+        return last_id
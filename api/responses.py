@@ -1,5 +1,10 @@
+from django.db.models import prefetch_related_objects
+from django.http import StreamingHttpResponse
 from rest_framework.response import Response
 
+from kw_webapp.constants import STREAMING_CHUNK_SIZE
+from kw_webapp.renderers import StreamingJSONRenderer
+
 
 class InvalidWanikaniAPIKeyResponse(Response):
     def __init__(self):
@@ -8,3 +13,52 @@ class InvalidWanikaniAPIKeyResponse(Response):
         self.data = {
             "error": "This Wanikani API Key is invalid! Check your settings page."
         }
+
+
+class StreamingListResponse(StreamingHttpResponse):
+    """
+    Streams a queryset as a JSON array. Rows are read over a server-side cursor
+    and serialized a chunk at a time, so memory use stays flat however large
+    the result is.
+
+    :param queryset: The rows to stream. Its prefetch_related lookups are
+    applied to each chunk.
+    :param serializer_class: The serializer for a single row.
+    :param serializer_context: The context to pass to the serializer.
+    :param chunk_size: How many rows to fetch, serialize and render at a time.
+    """
+
+    def __init__(
+        self,
+        queryset,
+        serializer_class,
+        serializer_context=None,
+        chunk_size=STREAMING_CHUNK_SIZE,
+    ):
+        self.queryset = queryset
+        self.serializer_class = serializer_class
+        self.serializer_context = serializer_context or {}
+        self.chunk_size = chunk_size
+        super().__init__(
+            StreamingJSONRenderer().render_chunks(self._serialized_chunks()),
+            content_type="application/json",
+        )
+
+    def _serialized_chunks(self):
+        # iterator() skips prefetch_related, so the lookups are run against
+        # each chunk instead.
+        prefetch_lookups = self.queryset._prefetch_related_lookups
+        chunk = []
+        for instance in self.queryset.iterator(chunk_size=self.chunk_size):
+            chunk.append(instance)
+            if len(chunk) == self.chunk_size:
+                yield self._serialize(chunk, prefetch_lookups)
+                chunk = []
+        if chunk:
+            yield self._serialize(chunk, prefetch_lookups)
+
+    def _serialize(self, chunk, prefetch_lookups):
+        prefetch_related_objects(chunk, *prefetch_lookups)
+        return self.serializer_class(
+            chunk, many=True, context=self.serializer_context
+        ).data
@@ -9,12 +9,15 @@ from django.db.models.functions import TruncHour, TruncDate
 from rest_framework import serializers
 
 from api import serializer_fields
-from api.validators import WanikaniApiKeyValidatorV2
+from api.validators import (
+    WanikaniApiKeyValidatorV2,
+    get_validated_wanikani_user,
+)
 from kw_webapp.constants import (
     KwSrsLevel,
-    KANIWANI_SRS_LEVELS,
     STREAK_TO_SRS_LEVEL_MAP_KW,
 )
+from kw_webapp.counters import get_review_counts
 from kw_webapp.models import (
     Profile,
     Vocabulary,
@@ -27,12 +30,11 @@ from kw_webapp.models import (
     Announcement,
     Report,
     MeaningSynonym,
+    reviews_are_due_at_read_time,
 )
 from kw_webapp.tasks import (
-    get_users_lessons,
-    get_users_current_reviews,
-    get_users_future_reviews,
     get_users_reviews,
+    get_user_dashboard_stats,
     build_upcoming_srs_for_user,
 )
 
@@ -54,24 +56,6 @@ class ReportCountSerializer(serializers.BaseSerializer):
         )
 
 
-class SrsCountSerializer(serializers.BaseSerializer):
-    """
-    Serializer for simply showing SRS counts, e.g., how many apprentice items a user has,
-    how many guru, etc.
-    """
-
-    def to_representation(self, user):
-        all_reviews = get_users_reviews(user)
-        ordered_srs_counts = OrderedDict.fromkeys(
-            [level.name.lower() for level in KwSrsLevel]
-        )
-        for level in KwSrsLevel:
-            ordered_srs_counts[level.name.lower()] = all_reviews.filter(
-                streak__in=KANIWANI_SRS_LEVELS[level.name]
-            ).count()
-        return ordered_srs_counts
-
-
 class SimpleUpcomingReviewSerializer(serializers.BaseSerializer):
     """
     Serializer containing information about upcoming reviews, without any relevant srs information.
@@ -127,18 +111,26 @@ class DetailedUpcomingReviewCountSerializer(serializers.BaseSerializer):
 
 
 class ReviewCountSerializer(serializers.BaseSerializer):
+    """
+    Serializer for the current review and lesson counts, read from the user's
+    materialized review counters. When reviews are due at read time, the
+    counters can't know which reviews have fallen due, so reviews are counted
+    directly.
+    """
+
     def to_representation(self, user):
+        if reviews_are_due_at_read_time():
+            stats = get_user_dashboard_stats(user)
+            return {
+                "reviews_count": stats["reviews_count"],
+                "lessons_count": stats["lessons_count"],
+            }
+        review_counts = get_review_counts(user)
         return {
-            "reviews_count": self.get_reviews_count(user),
-            "lessons_count": self.get_lessons_count(user),
+            "reviews_count": review_counts["reviews"],
+            "lessons_count": review_counts["lessons"],
         }
 
-    def get_reviews_count(self, obj):
-        return get_users_current_reviews(obj).count()
-
-    def get_lessons_count(self, obj):
-        return get_users_lessons(obj).count()
-
 
 class ProfileSerializer(serializers.ModelSerializer):
     name = serializers.ReadOnlyField(source="user.username")
@@ -146,7 +138,7 @@ class ProfileSerializer(serializers.ModelSerializer):
     unlocked_levels = serializers.StringRelatedField(many=True, read_only=True)
     reviews_within_hour_count = serializers.SerializerMethodField()
     reviews_within_day_count = serializers.SerializerMethodField()
-    srs_counts = SrsCountSerializer(source="user", many=False, read_only=True)
+    srs_counts = serializers.SerializerMethodField()
     # upcoming_reviews = DetailedUpcomingReviewCountSerializer(source='user', many=False, read_only=True)
     upcoming_reviews = SimpleUpcomingReviewSerializer(
         source="user", many=False, read_only=True
@@ -191,6 +183,7 @@ class ProfileSerializer(serializers.ModelSerializer):
             "info_detail_level_on_failure",
             "order_reviews_by_level",
             "burn_reviews",
+            "onboarding_status",
         )
 
         read_only_fields = (
@@ -205,7 +198,8 @@ class ProfileSerializer(serializers.ModelSerializer):
             "srs_counts",
             "next_review_date",
             "last_wanikani_sync_date",
-            "join_date"
+            "join_date",
+            "onboarding_status",
         )
 
     def get_join_date(self, obj):
@@ -218,26 +212,32 @@ class ProfileSerializer(serializers.ModelSerializer):
     def save(self, **kwargs):
         return super().save(**kwargs)
 
+    def _get_dashboard_stats(self, obj):
+        """
+        The dashboard fields all come from one aggregation, so it is run once
+        per profile and shared between them.
+        """
+        if not hasattr(self, "_dashboard_stats"):
+            self._dashboard_stats = {}
+        if obj.pk not in self._dashboard_stats:
+            self._dashboard_stats[obj.pk] = get_user_dashboard_stats(obj.user)
+        return self._dashboard_stats[obj.pk]
+
     def get_next_review_date(self, obj):
-        user = obj.user
         if self.get_reviews_count(obj) == 0:
-            reviews = get_users_future_reviews(user)
-            if reviews:
-                next_review_date = reviews[0].next_review_date
-                return next_review_date
+            return self._get_dashboard_stats(obj)["next_review_at"]
 
     def get_reviews_count(self, obj):
-        return get_users_current_reviews(obj.user).count()
+        return self._get_dashboard_stats(obj)["reviews_count"]
+
+    def get_srs_counts(self, obj):
+        return self._get_dashboard_stats(obj)["srs_counts"]
 
     def get_reviews_within_hour_count(self, obj):
-        return get_users_future_reviews(
-            obj.user, time_limit=datetime.timedelta(hours=1)
-        ).count()
+        return self._get_dashboard_stats(obj)["reviews_within_hour_count"]
 
     def get_reviews_within_day_count(self, obj):
-        return get_users_future_reviews(
-            obj.user, time_limit=datetime.timedelta(hours=24)
-        ).count()
+        return self._get_dashboard_stats(obj)["reviews_within_day_count"]
 
 
 class RegistrationSerializer(serializers.ModelSerializer):
@@ -291,11 +291,22 @@ class RegistrationSerializer(serializers.ModelSerializer):
         user = User.objects.create(**validated_data)
         user.set_password(validated_data.get("password"))
         user.save()
-        Profile.objects.create(
+        profile = Profile.objects.create(
             user=user, api_key_v2=api_key_v2, level=1
         )
+        self._seed_profile_from_wanikani(profile, api_key_v2)
         return user
 
+    def _seed_profile_from_wanikani(self, profile, api_key_v2):
+        # The Wanikani user was fetched while validating the key, so the
+        # profile can start out at the right level.
+        wanikani_user = get_validated_wanikani_user(api_key_v2)
+        if wanikani_user is None:
+            return
+        profile.level = wanikani_user["level"]
+        profile.join_date = wanikani_user["started_at"]
+        profile.save(update_fields=["level", "join_date"])
+
 
 class UserSerializer(serializers.ModelSerializer):
     profile = ProfileSerializer(many=False, read_only=True)
@@ -416,6 +427,8 @@ class VocabularySerializer(serializers.ModelSerializer):
 
     # Grab the ID of the related review for this particular user.
     def get_review(self, obj):
+        if hasattr(obj, "user_review_id"):
+            return obj.user_review_id
         if "request" in self.context:
             try:
                 return UserSpecific.objects.get(
@@ -426,6 +439,8 @@ class VocabularySerializer(serializers.ModelSerializer):
         return None
 
     def get_is_reviewable(self, obj):
+        if hasattr(obj, "user_review_is_reviewable"):
+            return obj.user_review_is_reviewable
         if "request" in self.context:
             try:
                 minimum_level_to_review = self.context[
@@ -511,6 +526,7 @@ class ReviewSerializer(serializers.ModelSerializer):
     )
     reading_synonyms = ReadingSynonymSerializer(many=True, read_only=True)
     meaning_synonyms = MeaningSynonymSerializer(many=True, read_only=True)
+    needs_review = serializers.SerializerMethodField()
 
     class Meta:
         model = UserSpecific
@@ -535,6 +551,23 @@ class ReviewSerializer(serializers.ModelSerializer):
             "critical",
         )
 
+    def get_needs_review(self, obj):
+        request = self.context.get("request")
+        on_vacation = None
+        if request is not None and request.user.id == obj.user_id:
+            on_vacation = request.user.profile.on_vacation
+        return obj.is_due(on_vacation=on_vacation)
+
+
+class ReviewAnswerSerializer(serializers.Serializer):
+    """
+    A single answer within a batch submission to the review answers endpoint.
+    """
+
+    id = serializers.IntegerField()
+    correct = serializers.BooleanField()
+    wrong_before = serializers.BooleanField(default=False)
+
 
 class StubbedReviewSerializer(ReviewSerializer):
     class Meta(ReviewSerializer.Meta):
@@ -0,0 +1,168 @@
+import logging
+from collections import Counter, OrderedDict, defaultdict
+
+from django.db import transaction
+
+from kw_webapp.models import SUBJECT_FIELDS, PartOfSpeech, Reading, Vocabulary
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogueImporter:
+    """
+    Reconciles the local vocabulary catalogue against Wanikani vocabulary
+    subjects. The local vocabulary, readings and parts of speech are loaded
+    once, diffed in memory, and the changes are written with bulk queries in a
+    single transaction. The result matches running Vocabulary.reconcile on
+    every out of date subject.
+    """
+
+    def __init__(self):
+        self.changes = OrderedDict(
+            created=Counter(), updated=Counter(), deleted=Counter()
+        )
+
+    def import_subjects(self, subjects):
+        """
+        :param subjects: An iterable of Wanikani vocabulary subjects.
+        :return: An OrderedDict of `created`, `updated` and `deleted`, each a
+        Counter of rows by kind: `vocabulary`, `readings` and `parts_of_speech`
+        (links between a vocabulary and a part of speech).
+        """
+        subjects = list(subjects)
+        local_vocabulary = {
+            vocabulary.wk_subject_id: vocabulary
+            for vocabulary in Vocabulary.objects.filter(
+                wk_subject_id__in=[subject.id for subject in subjects]
+            )
+        }
+
+        new_vocabulary = []
+        out_of_date_vocabulary = []
+        for subject in subjects:
+            vocabulary = local_vocabulary.get(subject.id)
+            if vocabulary is None:
+                vocabulary = Vocabulary(wk_subject_id=subject.id)
+                new_vocabulary.append((vocabulary, subject))
+            elif vocabulary.is_out_of_date(subject):
+                out_of_date_vocabulary.append((vocabulary, subject))
+            else:
+                continue
+            vocabulary.apply_subject(subject)
+
+        if not new_vocabulary and not out_of_date_vocabulary:
+            return self.changes
+
+        with transaction.atomic():
+            Vocabulary.objects.bulk_create(
+                [vocabulary for vocabulary, _ in new_vocabulary]
+            )
+            Vocabulary.objects.bulk_update(
+                [vocabulary for vocabulary, _ in out_of_date_vocabulary],
+                SUBJECT_FIELDS,
+                batch_size=500,
+            )
+            self.changes["created"]["vocabulary"] += len(new_vocabulary)
+            self.changes["updated"]["vocabulary"] += len(
+                out_of_date_vocabulary
+            )
+
+            changed_vocabulary = new_vocabulary + out_of_date_vocabulary
+            self._reconcile_readings(changed_vocabulary)
+            self._reconcile_parts_of_speech(changed_vocabulary)
+
+        # Readings were bulk created, which skips the signals that keep the
+        # catalogue caches fresh.
+        from kw_webapp.tasks import invalidate_catalogue
+
+        transaction.on_commit(invalidate_catalogue)
+        return self.changes
+
+    def _reconcile_readings(self, changed_vocabulary):
+        local_readings = defaultdict(list)
+        for reading in Reading.objects.filter(
+            vocabulary_id__in=[
+                vocabulary.id for vocabulary, _ in changed_vocabulary
+            ]
+        ).only("id", "vocabulary_id", "kana", "character"):
+            local_readings[reading.vocabulary_id].append(reading)
+
+        reading_ids_to_delete = []
+        readings_to_create = []
+        for vocabulary, subject in changed_vocabulary:
+            remote_kanas = [reading.reading for reading in subject.readings]
+            kept_kanas = set()
+            for reading in local_readings[vocabulary.id]:
+                if (
+                    reading.kana not in remote_kanas
+                    or reading.character != subject.characters
+                ):
+                    reading_ids_to_delete.append(reading.id)
+                else:
+                    kept_kanas.add(reading.kana)
+
+            for kana in remote_kanas:
+                if kana not in kept_kanas:
+                    kept_kanas.add(kana)
+                    readings_to_create.append(
+                        Reading(
+                            vocabulary=vocabulary,
+                            kana=kana,
+                            character=subject.characters,
+                            level=subject.level,
+                        )
+                    )
+
+        if reading_ids_to_delete:
+            Reading.objects.filter(id__in=reading_ids_to_delete).delete()
+        Reading.objects.bulk_create(readings_to_create)
+        self.changes["deleted"]["readings"] += len(reading_ids_to_delete)
+        self.changes["created"]["readings"] += len(readings_to_create)
+
+    def _reconcile_parts_of_speech(self, changed_vocabulary):
+        parts_of_speech = {}
+        for part_of_speech in PartOfSpeech.objects.order_by("id"):
+            parts_of_speech.setdefault(part_of_speech.part, part_of_speech)
+        missing_parts = {
+            part
+            for _, subject in changed_vocabulary
+            for part in subject.parts_of_speech
+            if part not in parts_of_speech
+        }
+        for part_of_speech in PartOfSpeech.objects.bulk_create(
+            [PartOfSpeech(part=part) for part in sorted(missing_parts)]
+        ):
+            parts_of_speech[part_of_speech.part] = part_of_speech
+
+        Link = Vocabulary.parts_of_speech.through
+        vocabulary_ids = [
+            vocabulary.id for vocabulary, _ in changed_vocabulary
+        ]
+        local_links = {
+            (link.vocabulary_id, link.partofspeech_id): link.id
+            for link in Link.objects.filter(vocabulary_id__in=vocabulary_ids)
+        }
+        remote_links = {
+            (vocabulary.id, parts_of_speech[part].id)
+            for vocabulary, subject in changed_vocabulary
+            for part in subject.parts_of_speech
+        }
+
+        link_ids_to_delete = [
+            link_id
+            for key, link_id in local_links.items()
+            if key not in remote_links
+        ]
+        if link_ids_to_delete:
+            Link.objects.filter(id__in=link_ids_to_delete).delete()
+        links_to_create = [
+            Link(
+                vocabulary_id=vocabulary_id, partofspeech_id=part_of_speech_id
+            )
+            for vocabulary_id, part_of_speech_id in sorted(
+                remote_links - set(local_links)
+            )
+        ]
+        Link.objects.bulk_create(links_to_create)
+        self.changes["deleted"]["parts_of_speech"] += len(link_ids_to_delete)
+        self.changes["created"]["parts_of_speech"] += len(links_to_create)
@@ -0,0 +1,165 @@
+import logging
+
+import redis
+from redis.exceptions import LockError
+
+from api.sync.WanikaniClient import get_redis
+from kw_webapp.constants import SYNC_LOCK_TIMEOUT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+SYNC_METRICS_KEY = "kw:sync:metrics"
+SYNC_FLAGS = ("full_sync", "resync")
+
+
+def get_sync_metrics():
+    """
+    :return: dict of how many syncs were `started`, `skipped` because the sync
+    in flight already covered them, and `merged` into a follow-up of the sync
+    in flight, across all users.
+    """
+    counts = get_redis().hgetall(SYNC_METRICS_KEY)
+    return {
+        metric: int(counts.get(metric.encode(), 0))
+        for metric in ("started", "skipped", "merged")
+    }
+
+
+def _covers(ran, requested):
+    return all(ran[flag] or not requested[flag] for flag in SYNC_FLAGS)
+
+
+class SyncCoordinator:
+    """
+    Makes sure only one sync runs per user at a time, using a lock in Redis
+    shared by every worker.
+
+    A sync requested while another is in flight never runs alongside it. If the
+    sync in flight already covers it, it is skipped. Otherwise, for instance
+    when a full sync is requested during a recent-only one, it is merged into a
+    pending request, which the sync in flight runs as soon as it is done. Any
+    number of requests coalesce into that one follow-up sync, with a full sync
+    or resync taking precedence.
+
+    :param user_id: The user whose syncs are coordinated.
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.lock_key = f"kw:sync:lock:{user_id}"
+        self.running_key = f"kw:sync:running:{user_id}"
+        self.pending_key = f"kw:sync:pending:{user_id}"
+
+    def run(self, sync, full_sync=False, resync=False):
+        """
+        :param sync: A callable taking `full_sync` and `resync`, which performs
+        the sync.
+        :return: The result of the last sync run, or None if the request was
+        skipped or merged into the sync in flight.
+        """
+        requested = {"full_sync": full_sync, "resync": resync}
+        try:
+            connection = get_redis()
+            lock = connection.lock(
+                self.lock_key, timeout=SYNC_LOCK_TIMEOUT_SECONDS
+            )
+            acquired = lock.acquire(blocking=False)
+        except redis.RedisError as e:
+            logger.warning(
+                f"Could not reach the sync lock, syncing user {self.user_id} "
+                f"regardless: {e}"
+            )
+            return sync(**requested)
+
+        result = None
+        while True:
+            if acquired:
+                try:
+                    result = self._run_pending(connection, sync, requested)
+                finally:
+                    self._release(connection, lock)
+                # A request may have been left between our last look at the
+                # pending requests and releasing the lock.
+                requested = self._pop_pending(connection)
+            elif self._hand_over(connection, requested):
+                # The holder may have released the lock, and looked at the
+                # pending requests for the last time, before ours was left.
+                # Nobody would run it then, so take it back if the lock has
+                # come free.
+                if not lock.acquire(blocking=False):
+                    return result
+                requested = self._pop_pending(connection)
+                if requested is None:
+                    self._release(connection, lock)
+                    return result
+                acquired = True
+                continue
+            else:
+                return result
+
+            if requested is None:
+                return result
+            acquired = lock.acquire(blocking=False)
+
+    def _run_pending(self, connection, sync, requested):
+        while requested is not None:
+            connection.hincrby(SYNC_METRICS_KEY, "started")
+            connection.pipeline().hmset(
+                self.running_key,
+                {flag: int(requested[flag]) for flag in SYNC_FLAGS},
+            ).expire(self.running_key, SYNC_LOCK_TIMEOUT_SECONDS).execute()
+            result = sync(**requested)
+            requested = self._pop_pending(connection)
+        return result
+
+    def _hand_over(self, connection, requested):
+        """
+        :return: True if the request was left pending for the sync in flight,
+        False if it was skipped.
+        """
+        running = self._read_flags(connection.hgetall(self.running_key))
+        if running is not None and _covers(running, requested):
+            connection.hincrby(SYNC_METRICS_KEY, "skipped")
+            logger.info(
+                f"Skipped a sync for user {self.user_id}, the one in flight "
+                "covers it."
+            )
+            return False
+
+        pipeline = connection.pipeline()
+        pipeline.hsetnx(self.pending_key, "requested", 1)
+        for flag in SYNC_FLAGS:
+            if requested[flag]:
+                pipeline.hset(self.pending_key, flag, 1)
+        pipeline.expire(self.pending_key, SYNC_LOCK_TIMEOUT_SECONDS)
+        pipeline.hincrby(SYNC_METRICS_KEY, "merged")
+        pipeline.execute()
+        logger.info(
+            f"Merged a sync for user {self.user_id} into the one in flight."
+        )
+        return True
+
+    def _pop_pending(self, connection):
+        pending, _ = (
+            connection.pipeline()
+            .hgetall(self.pending_key)
+            .delete(self.pending_key)
+            .execute()
+        )
+        return self._read_flags(pending)
+
+    def _release(self, connection, lock):
+        connection.delete(self.running_key)
+        try:
+            lock.release()
+        except LockError:
+            logger.warning(
+                f"The sync lock of user {self.user_id} expired before the "
+                "sync finished."
+            )
+
+    @staticmethod
+    def _read_flags(stored):
+        if not stored:
+            return None
+        return {flag: stored.get(flag.encode()) == b"1" for flag in SYNC_FLAGS}
@@ -0,0 +1,96 @@
+import time
+
+from api.sync.WanikaniClient import get_redis
+from kw_webapp.constants import SYNC_LOCK_TIMEOUT_SECONDS
+
+
+class SyncScheduler:
+    """
+    A backlog of scheduled syncs kept in Redis. Each user is given a slot, the
+    slots being spread evenly across the interval in priority order. Users are
+    handed out once their slot is due, but never more than `max_in_flight` at a
+    time, so a backlog which falls behind drains at a bounded rate rather than
+    in a burst.
+
+    :param name: The keys the backlog is stored under.
+    :param max_in_flight: How many scheduled syncs may run at once.
+    """
+
+    def __init__(self, name, max_in_flight):
+        self.schedule_key = f"kw:sync:schedule:{name}"
+        self.in_flight_key = f"kw:sync:in_flight:{name}"
+        self.max_in_flight = max_in_flight
+
+    def schedule(self, user_ids, interval_seconds, now=None):
+        """
+        Replaces the backlog with the given users, spread across the interval.
+
+        :param user_ids: The users to sync, highest priority first.
+        :param interval_seconds: How long until the next schedule is made.
+        """
+        now = now or time.time()
+        spacing = interval_seconds / max(len(user_ids), 1)
+        pipeline = get_redis().pipeline()
+        pipeline.delete(self.schedule_key)
+        if user_ids:
+            pipeline.zadd(
+                self.schedule_key,
+                {
+                    user_id: now + index * spacing
+                    for index, user_id in enumerate(user_ids)
+                },
+            )
+        pipeline.execute()
+
+    def pop_due(self, now=None):
+        """
+        Takes the users whose slot is due off the backlog and marks them in
+        flight, as far as the bound allows.
+
+        :return: The ids of the users to sync now, in slot order.
+        """
+        now = now or time.time()
+        connection = get_redis()
+        # A sync which never reported back is given up on once its lock would
+        # have expired.
+        connection.zremrangebyscore(
+            self.in_flight_key, "-inf", now - SYNC_LOCK_TIMEOUT_SECONDS
+        )
+        free_slots = self.max_in_flight - connection.zcard(self.in_flight_key)
+        if free_slots <= 0:
+            return []
+
+        user_ids = [
+            int(user_id)
+            for user_id in connection.zrangebyscore(
+                self.schedule_key, "-inf", now, start=0, num=free_slots
+            )
+        ]
+        if user_ids:
+            pipeline = connection.pipeline()
+            pipeline.zrem(self.schedule_key, *user_ids)
+            pipeline.zadd(
+                self.in_flight_key, {user_id: now for user_id in user_ids}
+            )
+            pipeline.execute()
+        return user_ids
+
+    def finish(self, user_id):
+        get_redis().zrem(self.in_flight_key, user_id)
+
+    def backlog(self, now=None):
+        """
+        :return: dict of how many syncs are `scheduled` in total, how many of
+        those are `overdue`, and how many are `in_flight`.
+        """
+        now = now or time.time()
+        pipeline = get_redis().pipeline()
+        pipeline.zcard(self.schedule_key)
+        pipeline.zcount(self.schedule_key, "-inf", now)
+        pipeline.zcard(self.in_flight_key)
+        scheduled, overdue, in_flight = pipeline.execute()
+        return {
+            "scheduled": scheduled,
+            "overdue": overdue,
+            "in_flight": in_flight,
+        }
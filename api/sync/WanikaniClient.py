@@ -0,0 +1,330 @@
+import hashlib
+import logging
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import redis
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from wanikani_api import constants
+from wanikani_api.client import Client
+from wanikani_api.url_builder import UrlBuilder
+
+logger = logging.getLogger(__name__)
+
+_session = None
+_session_lock = threading.Lock()
+_redis = None
+
+# Atomically refills the bucket for the time elapsed since it was last used,
+# then takes a token if there is one. Returns the number of seconds to wait
+# before a token will be available, or 0 if one was taken.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "timestamp")
+local tokens = tonumber(bucket[1]) or capacity
+local timestamp = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - timestamp) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call("HMSET", KEYS[1], "tokens", tokens, "timestamp", now)
+redis.call("EXPIRE", KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+# Atomically drops leases held for longer than the lease time, as their holder
+# has died, then takes a new lease if fewer than the limit are held. Returns 1
+# if the lease was taken, 0 otherwise.
+CONCURRENCY_LIMIT_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local lease_seconds = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", now - lease_seconds)
+if redis.call("ZCARD", KEYS[1]) >= limit then
+    return 0
+end
+redis.call("ZADD", KEYS[1], now, ARGV[4])
+redis.call("EXPIRE", KEYS[1], math.ceil(lease_seconds) + 1)
+return 1
+"""
+
+
+class WanikaniRequestFailed(Exception):
+    pass
+
+
+def get_session():
+    """
+    One pooled session per process, so that every sync in a worker reuses its
+    connections to Wanikani.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            pool_size = settings.WANIKANI_MAX_CONCURRENT_REQUESTS
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+    return _session
+
+
+def get_redis():
+    global _redis
+    if _redis is None:
+        _redis = redis.StrictRedis.from_url(settings.REDIS_URL["LOCATION"])
+    return _redis
+
+
+class TokenBucket:
+    """
+    A token bucket kept in Redis, so that it is shared by every worker process.
+
+    :param name: The key the bucket is stored under.
+    :param capacity: How many requests can be made in a burst.
+    :param rate: How many tokens are added back per second.
+    """
+
+    def __init__(self, name, capacity, rate):
+        self.key = f"kw:wanikani:ratelimit:{name}"
+        self.capacity = capacity
+        self.rate = rate
+
+    def try_acquire(self):
+        """
+        :return: 0 if a token was taken, otherwise the number of seconds until
+        one will be available.
+        """
+        wait = get_redis().eval(
+            TOKEN_BUCKET_SCRIPT,
+            1,
+            self.key,
+            self.capacity,
+            self.rate,
+            time.time(),
+        )
+        return float(wait)
+
+    def acquire(self):
+        """
+        Blocks until a token is taken. If Redis can not be reached, requests
+        are let through rather than failing the sync.
+        """
+        while True:
+            try:
+                wait = self.try_acquire()
+            except redis.RedisError as e:
+                logger.warning(
+                    f"Could not reach the Wanikani rate limiter: {e}"
+                )
+                return
+            if not wait:
+                return
+            time.sleep(wait)
+
+
+class ConcurrencyLimit:
+    """
+    Bounds how many requests are in flight at once across every worker process,
+    with leases kept in Redis. A lease which is not given back, e.g. because
+    its worker died, is dropped once it is older than `lease_seconds`.
+
+    :param name: The key the leases are stored under.
+    :param limit: How many leases may be held at once.
+    :param lease_seconds: How long a lease is held for at most.
+    """
+
+    poll_seconds = 0.05
+
+    def __init__(self, name, limit, lease_seconds):
+        self.key = f"kw:wanikani:concurrency:{name}"
+        self.limit = limit
+        self.lease_seconds = lease_seconds
+
+    def try_acquire(self, lease):
+        """
+        :return: True if the lease was taken.
+        """
+        taken = get_redis().eval(
+            CONCURRENCY_LIMIT_SCRIPT,
+            1,
+            self.key,
+            self.limit,
+            self.lease_seconds,
+            time.time(),
+            lease,
+        )
+        return bool(int(taken))
+
+    def release(self, lease):
+        get_redis().zrem(self.key, lease)
+
+    @contextmanager
+    def slot(self):
+        """
+        Blocks until a lease is taken, and gives it back on exit. If Redis can
+        not be reached, requests are let through rather than failing the sync.
+        """
+        lease = uuid.uuid4().hex
+        while True:
+            try:
+                if self.try_acquire(lease):
+                    break
+            except redis.RedisError as e:
+                logger.warning(
+                    f"Could not reach the Wanikani concurrency limit: {e}"
+                )
+                yield
+                return
+            time.sleep(self.poll_seconds)
+        try:
+            yield
+        finally:
+            try:
+                self.release(lease)
+            except redis.RedisError as e:
+                logger.warning(
+                    f"Could not give back a Wanikani request slot: {e}"
+                )
+
+
+class RateLimitedClient(Client):
+    """
+    A Wanikani client which sends every request through a pooled session, and
+    waits for a token from both the shared bucket of all users and the bucket
+    of its own API key. Throttled, failed and unreachable requests are retried
+    with exponential backoff.
+
+    Only the endpoints which the syncer uses are overridden.
+    """
+
+    def __init__(self, v2_api_key, api_root=None):
+        super().__init__(v2_api_key)
+        self.url_builder = UrlBuilder(api_root or settings.WANIKANI_API_ROOT)
+        self.global_bucket = TokenBucket(
+            "global",
+            capacity=settings.WANIKANI_REQUESTS_PER_SECOND,
+            rate=settings.WANIKANI_REQUESTS_PER_SECOND,
+        )
+        key_hash = hashlib.sha256(str(v2_api_key).encode()).hexdigest()[:16]
+        self.key_bucket = TokenBucket(
+            f"key:{key_hash}",
+            capacity=settings.WANIKANI_REQUESTS_PER_MINUTE_PER_KEY,
+            rate=settings.WANIKANI_REQUESTS_PER_MINUTE_PER_KEY / 60,
+        )
+        self.request_slots = ConcurrencyLimit(
+            "global",
+            limit=settings.WANIKANI_MAX_CONCURRENT_REQUESTS,
+            # A request, connection and read included, is given up on well
+            # before this.
+            lease_seconds=settings.WANIKANI_REQUEST_TIMEOUT * 2,
+        )
+
+    def user_information(self):
+        return self._serialize_wanikani_response(
+            self._get(self.url_builder.build_wk_url(constants.USER_ENDPOINT))
+        )
+
+    def subjects(self, fetch_all=False, **parameters):
+        return self._fetch_collection(
+            constants.SUBJECT_ENDPOINT, parameters, fetch_all
+        )
+
+    def assignments(self, fetch_all=False, **parameters):
+        return self._fetch_collection(
+            constants.ASSIGNMENT_ENDPOINT, parameters, fetch_all
+        )
+
+    def study_materials(self, fetch_all=False, **parameters):
+        return self._fetch_collection(
+            constants.STUDY_MATERIALS_ENDPOINT, parameters, fetch_all
+        )
+
+    def build_authorized_requester(self, headers):
+        def _make_wanikani_api_request(url):
+            return self._serialize_wanikani_response(self._get(url))
+
+        return _make_wanikani_api_request
+
+    def _fetch_collection(self, endpoint, parameters, fetch_all):
+        url = self.url_builder.build_wk_url(endpoint, parameters=parameters)
+        return self._wrap_collection_in_iterator(
+            self._serialize_wanikani_response(self._get(url)), fetch_all
+        )
+
+    def _serialize_wanikani_response(self, response):
+        resource = super()._serialize_wanikani_response(response)
+        if resource is None:
+            raise WanikaniRequestFailed(
+                f"Failed to contact Wanikani: {response.status_code} "
+                f"{response.content}"
+            )
+        return resource
+
+    def _get(self, url):
+        """
+        Makes a GET request, retrying when Wanikani throttles us, fails, or can
+        not be reached.
+
+        :return: The final response. Once the retries run out, the last
+        response is returned as-is.
+        """
+        session = get_session()
+        max_retries = settings.WANIKANI_MAX_RETRIES
+        for attempt in range(max_retries + 1):
+            self.key_bucket.acquire()
+            self.global_bucket.acquire()
+            try:
+                with self.request_slots.slot():
+                    response = session.get(
+                        url,
+                        headers=self.headers,
+                        timeout=settings.WANIKANI_REQUEST_TIMEOUT,
+                    )
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == max_retries:
+                    raise
+                self._backoff(attempt, url)
+                continue
+
+            if response.status_code == 429 or response.status_code >= 500:
+                if attempt == max_retries:
+                    return response
+                self._backoff(attempt, url, response)
+                continue
+            return response
+
+    def _backoff(self, attempt, url, response=None):
+        delay = settings.WANIKANI_BACKOFF_SECONDS * 2**attempt
+        delay += random.uniform(0, settings.WANIKANI_BACKOFF_SECONDS)
+        reset = (
+            response.headers.get("RateLimit-Reset")
+            if response is not None
+            else None
+        )
+        if reset is not None:
+            # Wanikani tells us when the rate limit window for this key resets.
+            try:
+                delay = max(delay, float(reset) - time.time())
+            except ValueError:
+                pass
+        delay = min(delay, settings.WANIKANI_MAX_BACKOFF_SECONDS)
+        status = (
+            response.status_code if response is not None else "no response"
+        )
+        logger.warning(
+            f"Wanikani request to {url} failed ({status}), retrying in "
+            f"{delay:.2f}s."
+        )
+        time.sleep(delay)
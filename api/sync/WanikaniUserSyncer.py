@@ -11,7 +11,7 @@ class WanikaniUserSyncer(abc.ABC):
         pass
 
     @abc.abstractmethod
-    def sync_with_wk(self, full_sync=False):
+    def sync_with_wk(self, full_sync=False, resync=False):
         pass
 
     @abc.abstractmethod
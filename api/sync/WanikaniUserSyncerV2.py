@@ -1,38 +1,72 @@
 import logging
+from collections import OrderedDict, defaultdict
 
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F
 from django.utils import timezone
-from wanikani_api.client import Client as WkV2Client
 from wanikani_api.exceptions import InvalidWanikaniApiKeyException
 
+from api.sync.CatalogueImporter import CatalogueImporter
+from api.sync.WanikaniClient import RateLimitedClient
 from api.sync.WanikaniUserSyncer import WanikaniUserSyncer
-from kw_webapp.models import Vocabulary, UserSpecific
+from kw_webapp.counters import (
+    batched_review_counts,
+    record_created_reviews,
+    record_saved_reviews,
+)
+from kw_webapp.models import (
+    ASSIGNMENT_FIELDS,
+    STUDY_MATERIAL_FIELDS,
+    MeaningSynonym,
+    Profile,
+    UserSpecific,
+    Vocabulary,
+)
 
 
 logger = logging.getLogger(__name__)
 
 
+def as_wanikani_timestamp(value):
+    """
+    The client formats datetimes with isoformat(), and the `+00:00` offset of
+    an aware datetime does not survive in a query string. Wanikani treats
+    timestamps without an offset as UTC, so pass it a naive UTC datetime.
+    """
+    if value is None:
+        return None
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
 class WanikaniUserSyncerV2(WanikaniUserSyncer):
     def __init__(self, profile):
         if profile.api_key_v2 is None:
             logger.info(f"Skipping sync for user {profile.user.username}, as there is no API V2 key")
         self.profile = profile
         self.user = self.profile.user
-        self.client = WkV2Client(profile.api_key_v2)
+        self.client = RateLimitedClient(profile.api_key_v2)
+        # Subjects of the last assignments we could not apply, as they are
+        # missing from the catalogue.
+        self.missing_subject_ids = set()
 
-    def sync_with_wk(self, full_sync=False):
+    def sync_with_wk(self, full_sync=False, resync=False):
         """
         Takes a user. Checks the vocab list from WK for all levels. If anything new has been unlocked on the WK side,
         it also unlocks it here on Kaniwani and creates a new review for the user.
 
         :param user_id: id of the user to sync
         :param full_sync:
+        :param resync: If True, ignore the stored `updated_after` cursors and
+        fetch everything from Wanikani again.
         :return: None
         """
         # We split this into two seperate API calls as we do not necessarily know the current level until
         # For the love of god don't delete this next line
         user = User.objects.get(pk=self.user.id)
         logger.info(f"About to begin sync for user {user.username}.")
+        if resync:
+            self.reset_sync_cursors()
         profile_sync_succeeded = self.sync_user_profile_with_wk()
         if profile_sync_succeeded:
             if not full_sync:
@@ -48,7 +82,8 @@ class WanikaniUserSyncerV2(WanikaniUserSyncer):
             )
         else:
             logger.warning(
-                "Not attempting to sync, since API key is invalid, or user has indicated they do not want to be "
+                "Not attempting to sync, since API key is invalid, or user "
+                "has indicated they do not want to be "
                 "followed "
             )
             return profile_sync_succeeded, 0, 0
@@ -95,9 +130,14 @@ class WanikaniUserSyncerV2(WanikaniUserSyncer):
             ]
             if levels:
                 try:
+                    # Only a subset of levels is fetched here, so the cursor is
+                    # used but not advanced.
                     assignments = self.client.assignments(
                         subject_types="vocabulary",
                         levels=levels,
+                        updated_after=as_wanikani_timestamp(
+                            self.profile.assignments_updated_after
+                        ),
                         fetch_all=True,
                     )
                     new_review_count, total_unlocked, total_locked = self.process_vocabulary_response_for_user_v2(
@@ -109,164 +149,308 @@ class WanikaniUserSyncerV2(WanikaniUserSyncer):
                     self.user.profile.save()
                 except Exception as e:
                     logger.error(
-                        f"Could not sync recent vocab for {self.user.username}",
+                        "Could not sync recent vocab for "
+                        f"{self.user.username}",
                         e,
                     )
         return 0, 0
 
-    def process_vocabulary_response_for_user_unlock_v2(self, assignments):
+    def process_vocabulary_response_for_user_v2(self, assignments):
         """
         Given a response object from Requests.get(), iterate over the list of vocabulary, and synchronize the user.
         :param json_data:
         :param user:
         :return:
         """
-        new_review_count = 0
-        unlocked_count = 0
-        locked_count = 0
-        # Filter items the user has not unlocked.
-        for assignment in assignments:
-            # We don't port over stuff the user has never looked at
-            if assignment.started_at is None:
-                locked_count += 1
-                continue
-            # If the user is being
-            review, created = self.process_single_item_from_wanikani_v2(
-                assignment
+        if not self.profile.follow_me:
+            locked_count = sum(
+                1
+                for assignment in assignments
+                if assignment.started_at is None
             )
-
-            # If no review was created, it means we are missing the subject. We can deal with this later
-            if review is None:
-                logger.error(
-                    f"We somehow don't have a subject with id {assignment.subject_id}!!"
-                )
-                continue
-            if created:
-                new_review_count += 1
-            unlocked_count += 1
-            review.save()
+            logger.info(f"Synced Vocabulary for {self.user.username}")
+            return 0, 0, locked_count
+
+        (
+            new_review_count,
+            unlocked_count,
+            locked_count,
+        ) = self.bulk_reconcile_assignments(assignments)
         logger.info(f"Synced Vocabulary for {self.user.username}")
         return new_review_count, unlocked_count, locked_count
 
-    def process_vocabulary_response_for_user_v2(self, assignments):
+    def bulk_reconcile_assignments(self, assignments):
         """
-        Given a response object from Requests.get(), iterate over the list of vocabulary, and synchronize the user.
-        :param json_data:
-        :param user:
-        :return:
+        Synchronizes the user's reviews with many assignments at once. Resolves
+        all subjects in one query, loads the user's existing reviews in
+        another, creates the missing reviews with one bulk insert, and writes
+        back only the out of date assignments with one bulk update.
+
+        :param assignments: iterable of Wanikani assignments.
+        :return: tuple of (new review count, unlocked count, locked count)
         """
-        new_review_count = 0
-        unlocked_count = 0
+        started_assignments = []
         locked_count = 0
-        # Filter items the user has not unlocked.
         for assignment in assignments:
             # We don't port over stuff the user has never looked at
             if assignment.started_at is None:
                 locked_count += 1
-                continue
-            # If the user is being
-            if self.profile.follow_me:
-                review, created = self.process_single_item_from_wanikani_v2(
-                    assignment
-                )
+            else:
+                started_assignments.append(assignment)
+
+        with transaction.atomic():
+            # Syncs and level unlocks both reconcile a user's assignments, and
+            # would otherwise both find a review missing and insert it. Take
+            # turns on the user's profile row, so that each sees the reviews
+            # the other created.
+            list(
+                Profile.objects.select_for_update()
+                .filter(user=self.user)
+                .values_list("id", flat=True)
+            )
+            (
+                new_reviews,
+                out_of_date_reviews,
+                unlocked_count,
+            ) = self._reconcile_started_assignments(started_assignments)
 
-                # If no review was created, it means we are missing the subject. We can deal with this later
-                if review is None:
-                    logger.error(
-                        f"We somehow don't have a subject with id {assignment.subject_id}!!"
-                    )
-                    continue
-                if created:
-                    new_review_count += 1
-                unlocked_count += 1
-                review.save()
-        logger.info(f"Synced Vocabulary for {self.user.username}")
-        return new_review_count, unlocked_count, locked_count
+        if new_reviews:
+            # The study materials of new reviews may well be older than the
+            # cursor, which would skip them for good.
+            self._reset_cursor("study_materials_updated_after")
 
-    def process_single_item_from_wanikani_v2(self, assignment):
-        try:
-            vocab = Vocabulary.objects.get(wk_subject_id=assignment.subject_id)
-        except Vocabulary.DoesNotExist:
-            logger.error(
-                f"Attempted to add a UserSpecific for subject ID: {assignment.subject_id} but failed as we don't have it."
-            )
-            return None, False
-        review, created = self.get_or_create_review_for_user(vocab)
-        if review.is_assignment_out_of_date(assignment):
-            review.reconcile_assignment(assignment)
-        return (
-            review,
-            created,
-        )  # Note that synonym added count will need to be fixed.
-
-    def get_or_create_review_for_user(self, vocab):
-        """
-        takes a vocab, and creates a UserSpecific object for the user based on it. Returns the vocab object.
-        :param vocab: the vocabulary object to associate to the user.
-        :param user: The user.
-        :return: the vocabulary object after association to the user
-        """
-        try:
-            review, created = UserSpecific.objects.get_or_create(
-                vocabulary=vocab, user=self.user
+        logger.info(
+            f"Created {len(new_reviews)} and updated "
+            f"{len(out_of_date_reviews)} reviews for {self.user.username}"
+        )
+        return len(new_reviews), unlocked_count, locked_count
+
+    def _reconcile_started_assignments(self, started_assignments):
+        self.missing_subject_ids = set()
+        vocabulary_ids = dict(
+            Vocabulary.objects.filter(
+                wk_subject_id__in={
+                    assignment.subject_id for assignment in started_assignments
+                }
+            ).values_list("wk_subject_id", "id")
+        )
+        reviews = {
+            review.vocabulary_id: review
+            for review in UserSpecific.objects.filter(
+                user=self.user, vocabulary_id__in=vocabulary_ids.values()
             )
-            if created:
-                review.needs_review = True
-                review.next_review_date = timezone.now()
-                review.save()
-            return review, created
-
-        except UserSpecific.MultipleObjectsReturned:
-            us = UserSpecific.objects.filter(vocabulary=vocab, user=self.user)
-            for u in us:
+        }
+
+        now = timezone.now()
+        new_reviews = {}
+        out_of_date_reviews = {}
+        unlocked_count = 0
+        for assignment in started_assignments:
+            vocabulary_id = vocabulary_ids.get(assignment.subject_id)
+            # If we can't find the vocabulary, it means we are missing the
+            # subject. We can deal with this later
+            if vocabulary_id is None:
                 logger.error(
-                    f"during {self.user.username}'s WK sync, we received multiple UserSpecific objects. Details: {u}"
+                    "We somehow don't have a subject with id "
+                    f"{assignment.subject_id}!!"
+                )
+                self.missing_subject_ids.add(assignment.subject_id)
+                continue
+            unlocked_count += 1
+
+            review = reviews.get(vocabulary_id)
+            if review is None:
+                review = UserSpecific(
+                    user=self.user,
+                    vocabulary_id=vocabulary_id,
+                    needs_review=True,
+                    next_review_date=now,
                 )
-            return None, None
+                reviews[vocabulary_id] = new_reviews[vocabulary_id] = review
+            elif not review.is_assignment_out_of_date(assignment):
+                continue
+            elif vocabulary_id not in new_reviews:
+                out_of_date_reviews[vocabulary_id] = review
+            review.apply_assignment(assignment)
+
+        with batched_review_counts():
+            # Reviews created elsewhere in the meantime, e.g. by an admin, are
+            # left as they are.
+            UserSpecific.objects.bulk_create(
+                new_reviews.values(), ignore_conflicts=True
+            )
+            # Inserts which ignore conflicts don't hand back the new ids.
+            for review_id, vocabulary_id in UserSpecific.objects.filter(
+                user=self.user, vocabulary_id__in=new_reviews.keys()
+            ).values_list("id", "vocabulary_id"):
+                new_reviews[vocabulary_id].id = review_id
+            record_created_reviews(new_reviews.values())
+            UserSpecific.objects.bulk_update(
+                out_of_date_reviews.values(), ASSIGNMENT_FIELDS, batch_size=500
+            )
+            record_saved_reviews(out_of_date_reviews.values())
+
+        return new_reviews, out_of_date_reviews, unlocked_count
 
     def sync_study_materials(self):
         logger.info(
             f"About to synchronize all synonyms for {self.user.username}"
         )
-        study_materials = self.client.study_materials(
-            subject_types="vocabulary", fetch_all=True
+        study_materials = list(
+            self.client.study_materials(
+                subject_types="vocabulary",
+                updated_after=as_wanikani_timestamp(
+                    self.profile.study_materials_updated_after
+                ),
+                fetch_all=True,
+            )
         )
-        updated_synonym_count = 0
-        for study_material in study_materials:
-            try:
-                review = UserSpecific.objects.get(
-                    user=self.user,
-                    vocabulary__wk_subject_id=study_material.subject_id,
-                )
-            except UserSpecific.DoesNotExist:
-                pass
-            else:
-                if review.is_study_material_out_of_date(study_material):
-                    review.reconcile_study_material(study_material)
-                    updated_synonym_count += 1
+        updated_synonym_count = self.bulk_reconcile_study_materials(
+            study_materials
+        )
+        self._advance_cursor("study_materials_updated_after", study_materials)
 
         logger.info(
-            f"Updated {updated_synonym_count} synonyms for {self.user.username}"
+            f"Updated {updated_synonym_count} synonyms for "
+            f"{self.user.username}"
         )
         return updated_synonym_count
 
+    def reset_sync_cursors(self):
+        """
+        Forgets the `updated_after` cursors, so that the next sync fetches
+        everything from Wanikani again.
+        """
+        self.profile.assignments_updated_after = None
+        self.profile.study_materials_updated_after = None
+        self.profile.save(
+            update_fields=[
+                "assignments_updated_after",
+                "study_materials_updated_after",
+            ]
+        )
+
+    def _reset_cursor(self, cursor_field):
+        if getattr(self.profile, cursor_field) is not None:
+            setattr(self.profile, cursor_field, None)
+            self.profile.save(update_fields=[cursor_field])
+
+    def _advance_cursor(self, cursor_field, resources):
+        """
+        Moves a cursor up to the most recent `data_updated_at` of the resources
+        we have just processed.
+        """
+        latest = max(
+            (resource.data_updated_at for resource in resources), default=None
+        )
+        current = getattr(self.profile, cursor_field)
+        if latest is not None and (current is None or latest > current):
+            setattr(self.profile, cursor_field, latest)
+            self.profile.save(update_fields=[cursor_field])
+
+    def bulk_reconcile_study_materials(self, study_materials):
+        """
+        Set-based version of UserSpecific.reconcile_study_material for many
+        study materials at once. The user's reviews and their meaning synonyms
+        are loaded up front, synonyms are diffed in memory so that only the
+        changed ones are deleted or created, and the notes are written with one
+        bulk update.
+
+        :param study_materials: iterable of Wanikani study materials.
+        :return: the number of reviews whose study materials were updated.
+        """
+        study_materials = list(study_materials)
+        reviews = {
+            review.wk_subject_id: review
+            for review in UserSpecific.objects.filter(
+                user=self.user,
+                vocabulary__wk_subject_id__in={
+                    study_material.subject_id
+                    for study_material in study_materials
+                },
+            ).annotate(wk_subject_id=F("vocabulary__wk_subject_id"))
+        }
+
+        out_of_date_reviews = {}
+        remote_synonyms = {}
+        for study_material in study_materials:
+            review = reviews.get(study_material.subject_id)
+            if review is None or not review.is_study_material_out_of_date(
+                study_material
+            ):
+                continue
+            review.apply_study_material(study_material)
+            out_of_date_reviews[review.id] = review
+            if study_material.meaning_synonyms is not None:
+                remote_synonyms[review.id] = list(
+                    OrderedDict.fromkeys(study_material.meaning_synonyms)
+                )
+
+        synonym_ids_to_delete = []
+        synonyms_to_create = []
+        local_synonyms = defaultdict(dict)
+        for synonym_id, review_id, text in MeaningSynonym.objects.filter(
+            review_id__in=list(remote_synonyms)
+        ).values_list("id", "review_id", "text"):
+            local_synonyms[review_id][text] = synonym_id
+        for review_id, texts in remote_synonyms.items():
+            existing = local_synonyms[review_id]
+            synonym_ids_to_delete.extend(
+                synonym_id
+                for text, synonym_id in existing.items()
+                if text not in texts
+            )
+            synonyms_to_create.extend(
+                MeaningSynonym(review_id=review_id, text=text)
+                for text in texts
+                if text not in existing
+            )
+
+        with transaction.atomic():
+            if synonym_ids_to_delete:
+                MeaningSynonym.objects.filter(
+                    id__in=synonym_ids_to_delete
+                ).delete()
+            MeaningSynonym.objects.bulk_create(synonyms_to_create)
+            UserSpecific.objects.bulk_update(
+                out_of_date_reviews.values(),
+                STUDY_MATERIAL_FIELDS,
+                batch_size=500,
+            )
+        return len(out_of_date_reviews)
+
     def sync_unlocked_vocab(self):
         if self.profile.unlocked_levels_list():
             new_review_count = 0
 
             logger.info(
-                f"Creating sync string for user {self.user.username}: {self.profile.api_key_v2}"
+                f"Creating sync string for user {self.user.username}: "
+                f"{self.profile.api_key_v2}"
             )
             try:
-                assignments = self.client.assignments(
-                    subject_types="vocabulary",
-                    levels=self.profile.unlocked_levels_list(),
-                    fetch_all=True,
+                assignments = list(
+                    self.client.assignments(
+                        subject_types="vocabulary",
+                        levels=self.profile.unlocked_levels_list(),
+                        updated_after=as_wanikani_timestamp(
+                            self.profile.assignments_updated_after
+                        ),
+                        fetch_all=True,
+                    )
                 )
 
-                new_review_count, total_unlocked, total_locked = self.process_vocabulary_response_for_user_v2(
-                    assignments
-                )
+                (
+                    new_review_count,
+                    total_unlocked,
+                    total_locked,
+                ) = self.process_vocabulary_response_for_user_v2(assignments)
+                # Assignments which were not applied have to be fetched again,
+                # so the cursor only moves past batches which were applied in
+                # full.
+                if self.profile.follow_me and not self.missing_subject_ids:
+                    self._advance_cursor(
+                        "assignments_updated_after", assignments
+                    )
             except InvalidWanikaniApiKeyException:
                 self.profile.api_valid = False
                 self.profile.save()
@@ -278,50 +462,49 @@ class WanikaniUserSyncerV2(WanikaniUserSyncer):
     def sync_top_level_vocabulary(self):
         logger.info(f"Beginning top-level Subject Sync from WK API")
         try:
-            updated_vocabulary_count = 0
-            created_vocabulary_count = 0
             vocabulary = self.client.subjects(
                 types="vocabulary", fetch_all=True
             )
-            for remote_vocabulary in vocabulary:
-                try:
-                    logger.info(
-                        f"About to attempt to reconcile remote vocabulary: {remote_vocabulary}"
-                    )
-                    local_vocabulary = Vocabulary.objects.get(
-                        wk_subject_id=remote_vocabulary.id
-                    )
-                    logger.info(
-                        f"Found a local equivalent with Subject ID attached! {local_vocabulary.id}"
-                    )
-                    if local_vocabulary.is_out_of_date(remote_vocabulary):
-                        logger.info(
-                            "Looks like our local info is out of date. Reconciling."
-                        )
-                        local_vocabulary.reconcile(remote_vocabulary)
-                        updated_vocabulary_count += 1
-                except Vocabulary.DoesNotExist:
-                    logger.info(
-                        f"Couldn't find a Vocabulary with remote id: {remote_vocabulary.id}"
-                    )
-                    local_vocabulary = Vocabulary.objects.create(
-                        wk_subject_id=remote_vocabulary.id
-                    )
-                    local_vocabulary.reconcile(remote_vocabulary)
-                    created_vocabulary_count += 1
+            changes = CatalogueImporter().import_subjects(vocabulary)
             logger.info(
-                f"Managed to update {updated_vocabulary_count} vocabulary from V2 API."
+                "Managed to reconcile vocabulary from V2 API. Created: "
+                f"{dict(changes['created'])}, updated: "
+                f"{dict(changes['updated'])}, deleted: "
+                f"{dict(changes['deleted'])}."
             )
-            return updated_vocabulary_count
+            if changes["created"]["vocabulary"]:
+                # Assignments of the new subjects could not be applied until
+                # now, so fetch everything again.
+                Profile.objects.filter(
+                    assignments_updated_after__isnull=False
+                ).update(assignments_updated_after=None)
+            return changes["updated"]["vocabulary"]
         except InvalidWanikaniApiKeyException:
             logger.error(
-                "Couldn't synchronize vocabulary, as the API key is out of date."
+                "Couldn't synchronize vocabulary, as the API key is out of "
+                "date."
             )
             return 0
 
     def unlock_vocab(self, levels):
-        new_assignments = self.client.assignments(subject_types="vocabulary", levels=levels)
-        return self.process_vocabulary_response_for_user_unlock_v2(new_assignments)
+        """
+        Unlocks the given levels for the user, whether or not they follow
+        Wanikani, creating reviews for every vocabulary they have started
+        there.
+
+        :param levels: A level, or a list of levels.
+        :return: tuple of (new review count, unlocked count, locked count)
+        """
+        assignments = self.client.assignments(
+            subject_types="vocabulary", levels=levels, fetch_all=True
+        )
+        (
+            new_review_count,
+            unlocked_count,
+            locked_count,
+        ) = self.bulk_reconcile_assignments(assignments)
+        logger.info(f"Unlocked levels {levels} for {self.user.username}")
+        return new_review_count, unlocked_count, locked_count
 
     def get_wanikani_level(self):
         user_info = self.client.user_information()
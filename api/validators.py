@@ -1,24 +1,101 @@
+import hashlib
+
 import requests
+from django.conf import settings
+from django.core.cache import cache
 from rest_framework import serializers
 from wanikani_api.client import Client as WkV2Client
 from wanikani_api.exceptions import InvalidWanikaniApiKeyException
 import logging
 
+from kw_webapp.constants import WANIKANI_API_KEY_VALIDATION_CACHE_PREFIX
+
 logger = logging.getLogger(__name__)
 
+# Cached in place of the user payload for keys which Wanikani rejected.
+INVALID_API_KEY = "invalid"
+
+
+def _validation_cache_key(api_key):
+    key_hash = hashlib.sha256(str(api_key).encode()).hexdigest()
+    return f"{WANIKANI_API_KEY_VALIDATION_CACHE_PREFIX}:{key_hash}"
+
+
+def get_validated_wanikani_user(api_key):
+    """
+    :return: The Wanikani user payload (`username`, `level` and `started_at`)
+    fetched when the key was last validated, or None if it has not been
+    validated recently.
+    """
+    payload = cache.get(_validation_cache_key(api_key))
+    return None if payload == INVALID_API_KEY else payload
+
+
 class WanikaniApiKeyValidatorV2(object):
+    """
+    Checks a V2 API key against Wanikani. The result is cached by a hash of the
+    key for WANIKANI_API_KEY_VALIDATION_TTL seconds, and a key which equals the
+    one already stored for the instance being updated is not checked at all.
+    """
+
+    requires_context = True
+
     def __init__(self):
         self.failure_message = "This V2 API key appears to be invalid"
 
-    def __call__(self, value):
+    def __call__(self, value, serializer_field):
         logger.debug(f"We are validating API V2 Key {value}")
         if not value or value == "None":
             return None
-        client = WkV2Client(value)
-        try:
-            client.user_information()
-            logger.debug(f"We have validated API V2 Key {value}")
+        if value == self._stored_api_key(serializer_field.parent.instance):
             return value
-        except InvalidWanikaniApiKeyException:
+
+        cache_key = _validation_cache_key(value)
+        payload = cache.get(cache_key)
+        if payload is None:
+            payload = self._fetch_user(value)
+            if payload is None:
+                return value
+            cache.set(
+                cache_key, payload, settings.WANIKANI_API_KEY_VALIDATION_TTL
+            )
+
+        if payload == INVALID_API_KEY:
             logger.debug(f"We failed to validate API V2 Key {value}")
             raise serializers.ValidationError(self.failure_message)
+        logger.debug(f"We have validated API V2 Key {value}")
+        return value
+
+    def _fetch_user(self, value):
+        """
+        :return: The user payload, INVALID_API_KEY, or None if Wanikani could
+        not be reached. Keys are let through uncached in that case, rather than
+        blocking users on an outage.
+        """
+        try:
+            user = WkV2Client(value).user_information()
+        except InvalidWanikaniApiKeyException:
+            return INVALID_API_KEY
+        except requests.RequestException as e:
+            logger.warning(
+                f"Could not validate an API V2 Key with Wanikani: {e}"
+            )
+            return None
+        if user is None:
+            logger.warning("Could not validate an API V2 Key with Wanikani.")
+            return None
+        return {
+            "username": user.username,
+            "level": user.level,
+            "started_at": user.started_at,
+        }
+
+    @staticmethod
+    def _stored_api_key(instance):
+        if instance is None:
+            return None
+        if hasattr(instance, "api_key_v2"):
+            return instance.api_key_v2
+        if hasattr(instance, "profile"):
+            return instance.profile.api_key_v2
+        return None
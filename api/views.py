@@ -1,4 +1,5 @@
 from django.contrib.auth.models import User
+from django.db.models import Exists, OuterRef, Subquery
 from django.http import HttpResponseForbidden, HttpResponseBadRequest, Http404
 from rest_framework import generics, filters
 from rest_framework import mixins
@@ -11,8 +12,15 @@ from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.reverse import reverse_lazy
 
+from api.caching import CatalogueCacheMixin
 from api.decorators import checks_wanikani
-from api.filters import VocabularyFilter, ReviewFilter, filter_user_meaning_contains
+from api.filters import (
+    VocabularyFilter,
+    ReviewFilter,
+    filter_user_meaning_contains,
+)
+from api.pagination import KeysetPagination
+from api.responses import StreamingListResponse
 from api.permissions import (
     IsAdminOrReadOnly,
     IsAuthenticatedOrCreating,
@@ -36,6 +44,7 @@ from api.serializers import (
     ReportListSerializer,
     MeaningSynonymSerializer,
     ReviewCountSerializer,
+    ReviewAnswerSerializer,
 )
 from api.sync.SyncerFactory import Syncer
 from kw_webapp import constants
@@ -55,7 +64,7 @@ from kw_webapp.models import (
 
 import logging
 
-from kw_webapp.srs import all_srs
+from kw_webapp.srs import all_srs, apply_review_answers
 from kw_webapp.tasks import (
     get_users_lessons,
     get_users_current_reviews,
@@ -65,6 +74,7 @@ from kw_webapp.tasks import (
     sync_with_wk,
     lock_level_for_user,
     start_following_wanikani,
+    get_level_vocabulary_counts,
 )
 
 logger = logging.getLogger(__name__)
@@ -84,13 +94,30 @@ class ListRetrieveUpdateViewSet(
     pass
 
 
-class ReadingViewSet(viewsets.ReadOnlyModelViewSet):
+class StreamingListMixin:
+    """
+    Lets a list endpoint stream its full, unpaginated result set when
+    `stream=true` is passed.
+    """
+
+    def should_stream(self):
+        return self.request.query_params.get("stream", "false") == "true"
+
+    def get_streaming_response(self, queryset, serializer_class):
+        return StreamingListResponse(
+            queryset, serializer_class, self.get_serializer_context()
+        )
+
+
+class ReadingViewSet(CatalogueCacheMixin, viewsets.ReadOnlyModelViewSet):
     """
-    For internal use fetching readings specifically.
+    For internal use fetching readings specifically. Pass `pagination=keyset`
+    to page through them by cursor.
     """
 
     queryset = Reading.objects.all()
     serializer_class = ReadingSerializer
+    pagination_class = KeysetPagination
 
 
 class ReadingSynonymViewSet(viewsets.ModelViewSet):
@@ -128,23 +155,20 @@ class LevelViewSet(viewsets.ReadOnlyModelViewSet):
 
     def get_object(self):
         level = int(self.kwargs["pk"])
-        return self._serialize_level(level, self.request)
-
-    def _serialize_level(self, level, request):
-        unlocked = (
-            True
-            if level in request.user.profile.unlocked_levels_list()
-            else False
+        return self._serialize_level(
+            level,
+            self.request,
+            set(self.request.user.profile.unlocked_levels_list()),
+            get_level_vocabulary_counts(),
         )
 
+    def _serialize_level(
+        self, level, request, unlocked_levels, vocabulary_counts
+    ):
         pre_serialized_dict = {
             "level": level,
-            "unlocked": unlocked,
-            "vocabulary_count": Vocabulary.objects.filter(
-                readings__level=level
-            )
-            .distinct()
-            .count(),
+            "unlocked": level in unlocked_levels,
+            "vocabulary_count": vocabulary_counts.get(level, 0),
             "vocabulary_url": level,
         }
         if level <= request.user.profile.level:
@@ -154,9 +178,15 @@ class LevelViewSet(viewsets.ReadOnlyModelViewSet):
         return pre_serialized_dict
 
     def list(self, request, *args, **kwargs):
+        unlocked_levels = set(request.user.profile.unlocked_levels_list())
+        vocabulary_counts = get_level_vocabulary_counts()
         level_dicts = []
         for level in range(constants.LEVEL_MIN, constants.LEVEL_MAX + 1):
-            level_dicts.append(self._serialize_level(level, request))
+            level_dicts.append(
+                self._serialize_level(
+                    level, request, unlocked_levels, vocabulary_counts
+                )
+            )
 
         serializer = LevelSerializer(
             level_dicts, many=True, context={"request": request}
@@ -201,13 +231,21 @@ class LevelViewSet(viewsets.ReadOnlyModelViewSet):
         return Response({"locked": removed_count})
 
 
-class VocabularyViewSet(viewsets.ReadOnlyModelViewSet):
+class VocabularyViewSet(
+    CatalogueCacheMixin, StreamingListMixin, viewsets.ReadOnlyModelViewSet
+):
     """
-    Endpoint for fetching specific vocabulary. You can pass parameter `hyperlink=true` to receive the vocabulary with
-    hyperlinked readings (for increased performance), or else they will be inline
+    Endpoint for fetching specific vocabulary. You can pass parameter
+    `hyperlink=true` to receive the vocabulary with hyperlinked readings (for
+    increased performance), or else they will be inline. Pass `stream=true` to
+    receive the whole list unpaginated, as a streamed JSON array, or
+    `pagination=keyset` to page through it by cursor.
     """
 
     filterset_class = VocabularyFilter
+    pagination_class = KeysetPagination
+    cached_actions = ("retrieve",)
+    personal_fields = ("review", "is_reviewable")
 
     def get_queryset(self):
         meaning_contains = self.request.query_params.get("meaning_contains")
@@ -216,8 +254,68 @@ class VocabularyViewSet(viewsets.ReadOnlyModelViewSet):
         if meaning_contains:
             user_id = self.request.user.id
             self.filterset_class = None
-            return filter_user_meaning_contains(meaning_contains, user_id)
-        return Vocabulary.objects.all()
+            queryset = filter_user_meaning_contains(meaning_contains, user_id)
+        else:
+            queryset = Vocabulary.objects.all()
+        queryset = queryset.prefetch_related(
+            "readings", "readings__parts_of_speech"
+        )
+        return self._annotate_user_review(queryset)
+
+    def _annotate_user_review(self, queryset):
+        """
+        Annotates each vocabulary with the id of the requesting user's review
+        of it, and whether that review falls in the user's reviewable WK SRS
+        range, so the serializer doesn't need to query per row.
+        """
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset
+
+        users_review = UserSpecific.objects.filter(
+            user=user, vocabulary=OuterRef("pk")
+        )
+        return queryset.annotate(
+            user_review_id=Subquery(users_review.values("id")[:1]),
+            user_review_is_reviewable=Exists(
+                users_review.filter(
+                    wanikani_srs_numeric__range=(
+                        user.profile.get_minimum_wk_srs_threshold_for_review(),
+                        user.profile.get_maximum_wk_srs_threshold_for_review(),
+                    )
+                )
+            ),
+        )
+
+    def get_personal_data(self, data):
+        user = self.request.user
+        if not user.is_authenticated:
+            return {"review": None, "is_reviewable": None}
+
+        review = (
+            UserSpecific.objects.filter(
+                user=user, vocabulary_id=self.kwargs["pk"]
+            )
+            .select_related("user__profile")
+            .first()
+        )
+        if review is None:
+            return {"review": None, "is_reviewable": False}
+        profile = review.user.profile
+        return {
+            "review": review.id,
+            "is_reviewable": profile.get_minimum_wk_srs_threshold_for_review()
+            <= review.wanikani_srs_numeric
+            <= profile.get_maximum_wk_srs_threshold_for_review(),
+        }
+
+    def list(self, request, *args, **kwargs):
+        if self.should_stream():
+            return self.get_streaming_response(
+                self.filter_queryset(self.get_queryset()),
+                self.get_serializer_class(),
+            )
+        return super().list(request, *args, **kwargs)
 
     def get_serializer_class(self):
         if self.request.query_params.get("hyperlink", "false") == "true":
@@ -252,7 +350,8 @@ class ReportViewSet(viewsets.ModelViewSet):
                 reading__id=reading_id, created_by=request.user
             )
             logger.info(
-                f"User {request.user.username} is updating their report on reading {request.data['reading']}"
+                f"User {request.user.username} is updating their report on "
+                f"reading {request.data['reading']}"
             )
             serializer = ReportSerializer(
                 existing_report, data=request.data, partial=True
@@ -262,7 +361,8 @@ class ReportViewSet(viewsets.ModelViewSet):
             return Response(serializer.data)
         except Report.DoesNotExist:
             logger.info(
-                f"User {request.user.username} is creating report on reading {request.data['reading']}"
+                f"User {request.user.username} is creating report on reading "
+                f"{request.data['reading']}"
             )
             serializer = ReportSerializer(data=request.data)
             serializer.is_valid(raise_exception=True)
@@ -278,13 +378,17 @@ class ReportViewSet(viewsets.ModelViewSet):
         return super().destroy(request, *args, **kwargs)
 
 
-class ReviewViewSet(ListRetrieveUpdateViewSet):
+class ReviewViewSet(StreamingListMixin, ListRetrieveUpdateViewSet):
     """
-    lesson:
-    Get all of user's lessons.
+    list: Get all of user's reviews. Pass `pagination=keyset` to page through
+    them by cursor, in id order even if the user orders their reviews by level.
+    The same goes for `lesson` and `current`.
 
-    current:
-    Get all of user's reviews which currently need to be done.
+    lesson: Get all of user's lessons. Pass `stream=true` to receive them all
+    unpaginated, as a streamed JSON array.
+
+    current: Get all of user's reviews which currently need to be done. Pass
+    `stream=true` to receive them all unpaginated, as a streamed JSON array.
 
     critical:
     Return a list of *critical* items, which the user has often gotten incorrect.
@@ -295,6 +399,9 @@ class ReviewViewSet(ListRetrieveUpdateViewSet):
     incorrect:
     POSTing here will indicate that the user has incorrectly answered the review.
 
+    answers: POST a list of `{id, correct, wrong_before}` objects to submit
+    many answers at once. Returns a compact result per answer.
+
     hide:
     No longer include this item in the SRS algorithm and review queue.
 
@@ -308,6 +415,7 @@ class ReviewViewSet(ListRetrieveUpdateViewSet):
     serializer_class = ReviewSerializer
     filterset_class = ReviewFilter
     permission_classes = (IsAuthenticated,)
+    pagination_class = KeysetPagination
 
     @action(detail=False)
     def lesson(self, request):
@@ -321,6 +429,11 @@ class ReviewViewSet(ListRetrieveUpdateViewSet):
                 "vocabulary__readings__parts_of_speech",
             )
         )
+        if self.should_stream():
+            return self.get_streaming_response(
+                lessons, StubbedReviewSerializer
+            )
+
         page = self.paginate_queryset(lessons)
         if page is not None:
             serializer = StubbedReviewSerializer(page, many=True)
@@ -342,8 +455,14 @@ class ReviewViewSet(ListRetrieveUpdateViewSet):
                 "vocabulary__readings__parts_of_speech",
             )
         )
+        if self.should_stream():
+            return self.get_streaming_response(
+                reviews, StubbedReviewSerializer
+            )
+
         logger.debug(
-            f"Fetched current reviews for: {request.user.username}. Paginating.."
+            f"Fetched current reviews for: {request.user.username}. "
+            "Paginating.."
         )
         page = self.paginate_queryset(reviews)
         logger.debug(f"Paginated reviews for {request.user.username}")
@@ -383,17 +502,18 @@ class ReviewViewSet(ListRetrieveUpdateViewSet):
 
         return False
 
-    @action(detail=True,methods=["POST"])
-    def correct(self, request, pk=None):
+    def _get_answerable_review(self, request, pk):
         review = get_object_or_404(UserSpecific, pk=pk)
-        if (
-            not review.can_be_managed_by(request.user)
-            or not review.needs_review
-        ):
+        if not review.can_be_managed_by(request.user) or not review.is_due():
             raise PermissionDenied(
-                "You can't review a review that doesn't need to be reviewed! ٩(ఠ益ఠ)۶"
+                "You can't review a review that doesn't need to be reviewed! "
+                "٩(ఠ益ఠ)۶"
             )
+        return review
 
+    @action(detail=True, methods=["POST"])
+    def correct(self, request, pk=None):
+        review = self._get_answerable_review(request, pk)
         was_correct_on_first_try = self._correct_on_first_try(request)
         review = review.answered_correctly(
             was_correct_on_first_try, request.user.profile.burn_reviews
@@ -403,19 +523,28 @@ class ReviewViewSet(ListRetrieveUpdateViewSet):
 
     @action(detail=True,methods=["POST"])
     def incorrect(self, request, pk=None):
-        review = get_object_or_404(UserSpecific, pk=pk)
-        if (
-            not review.can_be_managed_by(request.user)
-            or not review.needs_review
-        ):
-            raise PermissionDenied(
-                "You can't review a review that doesn't need to be reviewed! ٩(ఠ益ఠ)۶"
-            )
+        review = self._get_answerable_review(request, pk)
         review = review.answered_incorrectly()
         serializer = self.get_serializer(review, many=False)
         return Response(serializer.data)
 
-    @action(detail=True,methods=["POST"])
+    @action(detail=False, methods=["POST"])
+    def answers(self, request):
+        serializer = ReviewAnswerSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        if (
+            len(serializer.validated_data)
+            > constants.MAX_REVIEW_ANSWER_BATCH_SIZE
+        ):
+            return HttpResponseBadRequest(
+                "You can submit at most "
+                f"{constants.MAX_REVIEW_ANSWER_BATCH_SIZE} answers at once."
+            )
+
+        results = apply_review_answers(request.user, serializer.validated_data)
+        return Response(results)
+
+    @action(detail=True, methods=["POST"])
     def hide(self, request, pk=None):
         return self._set_hidden(request, True, pk)
 
@@ -448,7 +577,9 @@ class ReviewViewSet(ListRetrieveUpdateViewSet):
         return get_all_users_reviews(self.request.user)
 
 
-class FrequentlyAskedQuestionViewSet(viewsets.ModelViewSet):
+class FrequentlyAskedQuestionViewSet(
+    CatalogueCacheMixin, viewsets.ModelViewSet
+):
     """
     Frequently Asked Questions that uses will have read access to.
     """
@@ -458,7 +589,7 @@ class FrequentlyAskedQuestionViewSet(viewsets.ModelViewSet):
     queryset = FrequentlyAskedQuestion.objects.all()
 
 
-class AnnouncementViewSet(viewsets.ModelViewSet):
+class AnnouncementViewSet(CatalogueCacheMixin, viewsets.ModelViewSet):
     """
     Announcements that users will see upon entering the website.
     """
@@ -479,8 +610,12 @@ class UserViewSet(viewsets.GenericViewSet, generics.ListCreateAPIView):
     Standard endpoint to retrieve current user based on their authentication provided in the request. This is also where
     we PUT changes to the nested profile.
 
-    sync:
-    Force a sync to the Wanikani server.
+    sync: Force a sync to the Wanikani server. If a sync is already running for
+    the user, this returns 202 with `coalesced` set, and the running sync picks
+    the request up.
+
+    onboarding: The progress of setting up a newly registered user's account:
+    `queued`, `syncing`, `unlocking`, then `complete`, or `failed`.
 
     srs:
     Force an SRS run (typically runs every 15 minutes anyhow).
@@ -504,6 +639,10 @@ class UserViewSet(viewsets.GenericViewSet, generics.ListCreateAPIView):
         serializer = self.get_serializer(user, many=False)
         return Response(serializer.data)
 
+    @action(detail=False)
+    def onboarding(self, request):
+        return Response({"status": request.user.profile.onboarding_status})
+
     @action(detail=False, methods=["POST"])
     def sync(self, request):
         should_full_sync = False
@@ -514,9 +653,28 @@ class UserViewSet(viewsets.GenericViewSet, generics.ListCreateAPIView):
         if "full_sync" in request.data:
             should_full_sync = request.data["full_sync"] == "true"
 
-        profile_sync_succeeded, new_review_count, new_synonym_count = sync_with_wk(
-            request.user.id, should_full_sync
-        )
+        should_resync = False
+
+        if "resync" in request.query_params:
+            should_resync = request.query_params["resync"] == "true"
+
+        if "resync" in request.data:
+            should_resync = request.data["resync"] == "true"
+
+        result = sync_with_wk(request.user.id, should_full_sync, should_resync)
+        if result is None:
+            # A sync was already in flight, and will take care of this one.
+            return Response(
+                {
+                    "profile_sync_succeeded": True,
+                    "new_review_count": 0,
+                    "new_synonym_count": 0,
+                    "coalesced": True,
+                },
+                status=status.HTTP_202_ACCEPTED,
+            )
+
+        profile_sync_succeeded, new_review_count, new_synonym_count = result
         return Response(
             {
                 "profile_sync_succeeded": profile_sync_succeeded,
@@ -86,6 +86,63 @@ MIN_SVG_DRAW_SPEED = 1
 MAX_SVG_DRAW_SPEED = 10
 MAX_REVIEW_DETAIL_LEVEL = 2
 
+MAX_REVIEW_ANSWER_BATCH_SIZE = 500
+
+# How many rows are fetched, serialized and rendered at a time when streaming a
+# list response.
+STREAMING_CHUNK_SIZE = 500
+
+LEVEL_VOCABULARY_COUNTS_CACHE_KEY = "level_vocabulary_counts"
+SRS_DUE_WINDOW_CACHE_KEY = "srs_due_window_end"
+CATALOGUE_VERSION_CACHE_KEY = "catalogue_version"
+WANIKANI_API_KEY_VALIDATION_CACHE_PREFIX = "wanikani_api_key_validation"
+# Cached catalogue responses are dropped on the next catalogue change anyway,
+# this only bounds how long unused ones take up memory.
+RESPONSE_CACHE_TIMEOUT_SECONDS = 60 * 60 * 24
+
+# Progress of the onboarding task chain which runs after registration, see
+# kw_webapp.tasks.start_onboarding.
+ONBOARDING_QUEUED = "queued"
+ONBOARDING_SYNCING = "syncing"
+ONBOARDING_UNLOCKING = "unlocking"
+ONBOARDING_COMPLETE = "complete"
+ONBOARDING_FAILED = "failed"
+ONBOARDING_STATUS_CHOICES = [
+    (status, status)
+    for status in (
+        ONBOARDING_QUEUED,
+        ONBOARDING_SYNCING,
+        ONBOARDING_UNLOCKING,
+        ONBOARDING_COMPLETE,
+        ONBOARDING_FAILED,
+    )
+]
+# A login only queues a sync if the same user hasn't had one queued within this
+# many seconds.
+LOGIN_SYNC_DEDUPLICATION_SECONDS = 5 * 60
+LOGIN_SYNC_CACHE_PREFIX = "login_sync_queued"
+# How long a user's sync lock is held at most, should a sync never finish.
+SYNC_LOCK_TIMEOUT_SECONDS = 30 * 60
+# While another sync is in flight for a user being onboarded, their onboarding
+# sync is retried this often, for as long as a sync may hold the lock.
+ONBOARDING_SYNC_RETRY_SECONDS = 30
+ONBOARDING_SYNC_MAX_RETRIES = (
+    SYNC_LOCK_TIMEOUT_SECONDS // ONBOARDING_SYNC_RETRY_SECONDS
+)
+# How long users typically take to level up on Wanikani, for prioritizing
+# scheduled syncs.
+EXPECTED_LEVEL_UP_HOURS = 7 * 24
+
+# How a review is decided to be due, see settings.REVIEW_DUE_MODE.
+REVIEW_DUE_MODE_FLAG = "flag"
+REVIEW_DUE_MODE_READ_TIME = "read_time"
+# Each due window starts this many minutes before the previous one ended, to
+# pick up reviews committed late.
+SRS_DUE_WINDOW_OVERLAP_MINUTES = 5
+# How many reviews an SRS run flags per UPDATE, so that a full sweep never
+# builds an unbounded statement.
+SRS_FLAG_BATCH_SIZE = 1000
+
 MINIMUM_ATTEMPT_COUNT_FOR_CRITICALITY = 4
 CRITICALITY_THRESHOLD = 0.75
 # NOTE: we no longer display user's WK twitter/webpage bio info
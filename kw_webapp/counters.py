@@ -0,0 +1,348 @@
+import logging
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.contrib.auth.models import User
+from django.db import DatabaseError, transaction
+from django.db.models import Count, F, Q, Sum
+
+from kw_webapp.constants import (
+    KANIWANI_SRS_LEVELS,
+    STREAK_TO_SRS_LEVEL_MAP_KW,
+    WANIKANI_SRS_LEVELS,
+    KwSrsLevel,
+)
+from kw_webapp.models import ReviewCounter, UserSpecific
+
+logger = logging.getLogger(__name__)
+
+SRS_COUNTER_FIELDS = [level.name.lower() for level in KwSrsLevel]
+COUNTER_FIELDS = ["reviews", "lessons", "critical"] + SRS_COUNTER_FIELDS
+WANIKANI_SRS_BUCKETS = sorted(
+    {stage for stages in WANIKANI_SRS_LEVELS.values() for stage in stages}
+)
+
+_local = threading.local()
+
+
+def _counter_aggregates():
+    aggregates = {
+        "reviews": Count(
+            "id",
+            filter=Q(
+                needs_review=True,
+                burned=False,
+                streak__gte=KANIWANI_SRS_LEVELS[KwSrsLevel.APPRENTICE.name][0],
+            ),
+        ),
+        "lessons": Count(
+            "id",
+            filter=Q(
+                needs_review=True,
+                streak=KANIWANI_SRS_LEVELS[KwSrsLevel.UNTRAINED.name][0],
+            ),
+        ),
+        "critical": Count("id", filter=Q(critical=True)),
+    }
+    for level in KwSrsLevel:
+        aggregates[level.name.lower()] = Count(
+            "id", filter=Q(streak__in=KANIWANI_SRS_LEVELS[level.name])
+        )
+    return aggregates
+
+
+def _contributions(state):
+    """
+    Works out which counters a single review adds to, mirroring the filters in
+    get_users_current_reviews, get_users_lessons, get_users_critical_reviews
+    and the SRS level breakdown.
+
+    :param state: The counted fields of a review, as returned by
+    UserSpecific.counted_state().
+    :return: A Counter of counter field name -> 1.
+    """
+    contributions = Counter()
+    if state is None or state["hidden"]:
+        return contributions
+
+    srs_level = STREAK_TO_SRS_LEVEL_MAP_KW.get(state["streak"])
+    if srs_level is not None:
+        contributions[srs_level.name.lower()] += 1
+    if state["needs_review"]:
+        if (
+            state["streak"]
+            == KANIWANI_SRS_LEVELS[KwSrsLevel.UNTRAINED.name][0]
+        ):
+            contributions["lessons"] += 1
+        elif not state["burned"]:
+            contributions["reviews"] += 1
+    if state["critical"]:
+        contributions["critical"] += 1
+    return contributions
+
+
+class ReviewCounterDelta:
+    """
+    Accumulates counter changes for a group of review writes, so that they can
+    be applied with a single UPDATE per user and Wanikani SRS bucket.
+    """
+
+    def __init__(self):
+        self._changes = defaultdict(Counter)
+        self._stale_user_ids = set()
+
+    def track(self, user_id, before, after):
+        """
+        :param user_id: The owner of the review.
+        :param before: The counted state of the review as stored before the
+        write, or None if it did not exist.
+        :param after: The counted state of the review as stored after the
+        write, or None if it was deleted.
+        """
+        for state, sign in ((before, -1), (after, 1)):
+            if state is None:
+                continue
+            bucket = self._changes[(user_id, state["wanikani_srs_numeric"])]
+            for field, count in _contributions(state).items():
+                bucket[field] += sign * count
+
+    def track_delta(self, other):
+        for key, changes in other._changes.items():
+            self._changes[key].update(changes)
+        self._stale_user_ids |= other._stale_user_ids
+
+    def mark_stale(self, user_id):
+        self._stale_user_ids.add(user_id)
+
+    def user_ids(self):
+        return {user_id for user_id, _ in self._changes} | self._stale_user_ids
+
+    def apply(self):
+        stale_user_ids = set(self._stale_user_ids)
+        for (user_id, bucket), changes in self._changes.items():
+            changes = {
+                field: count for field, count in changes.items() if count
+            }
+            if not changes or user_id in stale_user_ids:
+                continue
+            updated = ReviewCounter.objects.filter(
+                user_id=user_id, wanikani_srs_numeric=bucket
+            ).update(
+                **{field: F(field) + count for field, count in changes.items()}
+            )
+            if not updated:
+                # Either the counters were never built for this user, or this
+                # bucket is missing.
+                stale_user_ids.add(user_id)
+
+        if stale_user_ids:
+            invalidate_review_counters(*stale_user_ids)
+        self._changes.clear()
+        self._stale_user_ids.clear()
+
+
+@contextmanager
+def batched_review_counts():
+    """
+    Context manager which collects every counter change made by review writes
+    inside of it, and applies them once the block exits. Use this around loops
+    or queryset deletes to avoid one counter UPDATE per review.
+    """
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    delta = ReviewCounterDelta()
+    stack.append(delta)
+    try:
+        yield delta
+    except Exception:
+        stack.pop()
+        try:
+            invalidate_review_counters(*delta.user_ids())
+        except DatabaseError:
+            logger.warning(
+                "Could not invalidate review counters for users "
+                f"{delta.user_ids()}"
+            )
+        raise
+    else:
+        stack.pop()
+        if stack:
+            # Nested batch: hand the changes to the outer one.
+            stack[-1].track_delta(delta)
+        else:
+            delta.apply()
+
+
+def record_review_change(user_id, before, after):
+    """
+    Records that a review went from `before` to `after`. Applied immediately,
+    unless inside batched_review_counts().
+    """
+    stack = getattr(_local, "stack", None)
+    if stack:
+        stack[-1].track(user_id, before, after)
+    else:
+        delta = ReviewCounterDelta()
+        delta.track(user_id, before, after)
+        delta.apply()
+
+
+def record_unknown_review_change(user_id):
+    """
+    Records that a review of this user changed in a way we can not calculate a
+    delta for. The user's counters are dropped and will be rebuilt on next
+    read.
+    """
+    stack = getattr(_local, "stack", None)
+    if stack:
+        stack[-1].mark_stale(user_id)
+    else:
+        invalidate_review_counters(user_id)
+
+
+def record_saved_reviews(reviews):
+    """
+    Updates counters for reviews which were written without signals, e.g. via
+    bulk_update(). Each review's snapshot is compared against its in-memory
+    state, and then reset.
+    """
+    for review in reviews:
+        after = review.counted_state()
+        if review._counted_state is None:
+            record_unknown_review_change(review.user_id)
+        else:
+            record_review_change(review.user_id, review._counted_state, after)
+        review._counted_state = after
+
+
+def record_created_reviews(reviews):
+    """
+    Updates counters for reviews which were inserted without signals, e.g. via
+    bulk_create().
+    """
+    for review in reviews:
+        review._counted_state = review.counted_state()
+        record_review_change(review.user_id, None, review._counted_state)
+
+
+def invalidate_review_counters(*user_ids):
+    ReviewCounter.objects.filter(user_id__in=user_ids).delete()
+
+
+def count_reviews_for_user(user):
+    """
+    Counts a user's reviews directly from the UserSpecific table, grouped by
+    Wanikani SRS bucket.
+
+    :param user: The user to count reviews for.
+    :return: dict of wanikani_srs_numeric -> dict of counter field -> count.
+    """
+    rows = (
+        UserSpecific.objects.filter(user=user, hidden=False)
+        .values("wanikani_srs_numeric")
+        .annotate(**_counter_aggregates())
+        .order_by()
+    )
+    return {row.pop("wanikani_srs_numeric"): row for row in rows}
+
+
+def rebuild_review_counters(user):
+    counts = count_reviews_for_user(user)
+    buckets = sorted(set(WANIKANI_SRS_BUCKETS) | set(counts))
+    with transaction.atomic():
+        ReviewCounter.objects.filter(user=user).delete()
+        ReviewCounter.objects.bulk_create(
+            [
+                ReviewCounter(
+                    user=user,
+                    wanikani_srs_numeric=bucket,
+                    **counts.get(bucket, {}),
+                )
+                for bucket in buckets
+            ],
+            ignore_conflicts=True,
+        )
+
+
+def get_review_counts(user):
+    """
+    Reads a user's review counters, restricted to their minimum/maximum
+    Wanikani SRS review settings. Counters are built on first read.
+
+    :param user: The user to fetch counts for.
+    :return: dict containing `reviews`, `lessons`, `critical`, and one count
+    per KaniWani SRS level.
+    """
+    in_range = Q(
+        wanikani_srs_numeric__range=(
+            user.profile.get_minimum_wk_srs_threshold_for_review(),
+            user.profile.get_maximum_wk_srs_threshold_for_review(),
+        )
+    )
+    aggregates = {"buckets": Count("id")}
+    aggregates.update(
+        {field: Sum(field, filter=in_range) for field in COUNTER_FIELDS}
+    )
+    counts = ReviewCounter.objects.filter(user=user).aggregate(**aggregates)
+    if not counts.pop("buckets"):
+        rebuild_review_counters(user)
+        counts = ReviewCounter.objects.filter(user=user).aggregate(
+            **aggregates
+        )
+        counts.pop("buckets")
+    return {field: counts[field] or 0 for field in COUNTER_FIELDS}
+
+
+def find_review_counter_drift(user):
+    """
+    Compares a user's stored counters against a fresh count of their reviews.
+
+    :param user: The user to verify.
+    :return: dict of wanikani_srs_numeric -> {field: (stored, actual)} for
+    every bucket which disagrees. Users whose counters have not been built yet
+    have no drift.
+    """
+    stored = {
+        counter.wanikani_srs_numeric: counter
+        for counter in ReviewCounter.objects.filter(user=user)
+    }
+    if not stored:
+        return {}
+
+    actual = count_reviews_for_user(user)
+    drift = {}
+    for bucket in sorted(set(stored) | set(actual)):
+        counter = stored.get(bucket)
+        for field in COUNTER_FIELDS:
+            stored_count = getattr(counter, field) if counter else 0
+            actual_count = actual.get(bucket, {}).get(field, 0)
+            if stored_count != actual_count:
+                drift.setdefault(bucket, {})[field] = (
+                    stored_count,
+                    actual_count,
+                )
+    return drift
+
+
+def repair_review_counter_drift():
+    """
+    Rebuilds the counters of every user whose counters no longer match their
+    reviews. Deltas are calculated from the state each review was loaded with,
+    rather than from the row being overwritten. Two writes of the same review
+    racing each other, e.g. answers from two tabs, both apply theirs, and the
+    counters drift until they are repaired here.
+
+    :return: The number of users whose counters were rebuilt.
+    """
+    repaired_count = 0
+    for user in (
+        User.objects.filter(review_counters__isnull=False)
+        .distinct()
+        .iterator()
+    ):
+        if find_review_counter_drift(user):
+            rebuild_review_counters(user)
+            repaired_count += 1
+    return repaired_count
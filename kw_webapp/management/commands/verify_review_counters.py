@@ -0,0 +1,49 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from kw_webapp.counters import (
+    find_review_counter_drift,
+    rebuild_review_counters,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares users' materialized review counters against their reviews, "
+        "and optionally repairs any drift."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--repair",
+            action="store_true",
+            help="Rebuild the counters of any user whose counters drifted.",
+        )
+        parser.add_argument(
+            "--username", help="Only verify the counters of this user."
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(review_counters__isnull=False).distinct()
+        if options["username"]:
+            users = users.filter(username=options["username"])
+
+        drifted_count = 0
+        for user in users.iterator():
+            drift = find_review_counter_drift(user)
+            if not drift:
+                continue
+            drifted_count += 1
+            for bucket, fields in drift.items():
+                differences = ", ".join(
+                    f"{field} stored={stored} actual={actual}"
+                    for field, (stored, actual) in fields.items()
+                )
+                self.stdout.write(
+                    f"{user.username} WK SRS {bucket}: {differences}"
+                )
+            if options["repair"]:
+                rebuild_review_counters(user)
+                self.stdout.write(f"Rebuilt counters for {user.username}")
+
+        self.stdout.write(f"{drifted_count} user(s) with drifted counters.")
@@ -0,0 +1,51 @@
+# Generated by Django 2.2.24 on 2026-10-17 07:15
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("kw_webapp", "0003_vocabulary_manual_reading_whitelist"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ReviewCounter",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("wanikani_srs_numeric", models.IntegerField()),
+                ("reviews", models.IntegerField(default=0)),
+                ("lessons", models.IntegerField(default=0)),
+                ("critical", models.IntegerField(default=0)),
+                ("untrained", models.IntegerField(default=0)),
+                ("apprentice", models.IntegerField(default=0)),
+                ("guru", models.IntegerField(default=0)),
+                ("master", models.IntegerField(default=0)),
+                ("enlightened", models.IntegerField(default=0)),
+                ("burned", models.IntegerField(default=0)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="review_counters",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("user", "wanikani_srs_numeric")},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.24 on 2026-10-17 07:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("kw_webapp", "0004_review_counter"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="profile",
+            name="assignments_updated_after",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="profile",
+            name="study_materials_updated_after",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
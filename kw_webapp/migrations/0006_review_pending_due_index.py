@@ -0,0 +1,21 @@
+# Generated by Django 2.2.24 on 2026-10-17 07:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("kw_webapp", "0005_profile_sync_cursors"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="userspecific",
+            index=models.Index(
+                condition=models.Q(needs_review=False),
+                fields=["next_review_date"],
+                name="kw_review_pending_due_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 2.2.24 on 2026-10-17 08:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("kw_webapp", "0006_review_pending_due_index"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="userspecific",
+            index=models.Index(
+                fields=["user", "next_review_date"],
+                name="kw_review_user_due_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 2.2.24 on 2026-10-17 08:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("kw_webapp", "0007_review_user_due_index"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="userspecific",
+            index=models.Index(
+                condition=models.Q(
+                    ("burned", False),
+                    ("hidden", False),
+                    ("needs_review", True),
+                    ("streak__gte", 1),
+                ),
+                fields=["user", "wanikani_srs_numeric"],
+                name="kw_review_current_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="userspecific",
+            index=models.Index(
+                condition=models.Q(
+                    ("hidden", False), ("needs_review", True), ("streak", 0)
+                ),
+                fields=["user", "wanikani_srs_numeric"],
+                name="kw_review_lesson_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="userspecific",
+            index=models.Index(
+                condition=models.Q(
+                    ("burned", False),
+                    ("hidden", False),
+                    ("needs_review", False),
+                    ("streak__gte", 1),
+                ),
+                fields=["user", "next_review_date"],
+                name="kw_review_upcoming_idx",
+            ),
+        ),
+    ]
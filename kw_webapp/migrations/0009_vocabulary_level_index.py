@@ -0,0 +1,46 @@
+# Generated by Django 2.2.24 on 2026-10-17 08:25
+
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import Min, OuterRef, Subquery
+
+
+def backfill_vocabulary_levels(apps, schema_editor):
+    # Vocabulary synced before levels were stored on it takes the level of its
+    # readings.
+    Vocabulary = apps.get_model("kw_webapp", "Vocabulary")
+    Reading = apps.get_model("kw_webapp", "Reading")
+    reading_level = (
+        Reading.objects.filter(vocabulary=OuterRef("pk"))
+        .values("vocabulary")
+        .annotate(level=Min("level"))
+        .values("level")
+    )
+    Vocabulary.objects.filter(level__isnull=True).update(
+        level=Subquery(reading_level)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("kw_webapp", "0008_review_queue_indexes"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="vocabulary",
+            name="level",
+            field=models.PositiveIntegerField(
+                db_index=True,
+                null=True,
+                validators=[
+                    django.core.validators.MinValueValidator(1),
+                    django.core.validators.MaxValueValidator(60),
+                ],
+            ),
+        ),
+        migrations.RunPython(
+            backfill_vocabulary_levels, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.24 on 2026-10-17 08:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("kw_webapp", "0009_vocabulary_level_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="profile",
+            name="onboarding_status",
+            field=models.CharField(
+                choices=[
+                    ("queued", "queued"),
+                    ("syncing", "syncing"),
+                    ("unlocking", "unlocking"),
+                    ("complete", "complete"),
+                    ("failed", "failed"),
+                ],
+                default="complete",
+                max_length=20,
+            ),
+        ),
+    ]
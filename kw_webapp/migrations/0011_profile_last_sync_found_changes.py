@@ -0,0 +1,18 @@
+# Generated by Django 2.2.24 on 2026-10-17 08:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("kw_webapp", "0010_profile_onboarding_status"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="profile",
+            name="last_sync_found_changes",
+            field=models.BooleanField(default=True),
+        ),
+    ]
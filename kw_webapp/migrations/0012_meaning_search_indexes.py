@@ -0,0 +1,41 @@
+from django.db import migrations
+
+# GIN indexes over the full text search documents of meanings and meaning
+# synonyms. The expressions have to match the ones api.filters.search_meaning
+# queries with exactly, or the indexes go unused.
+MEANING_SEARCH_INDEXES = [
+    ("kw_vocab_meaning_search_idx", "kw_webapp_vocabulary", "meaning"),
+    ("kw_synonym_text_search_idx", "kw_webapp_meaningsynonym", "text"),
+]
+
+
+def create_meaning_search_indexes(apps, schema_editor):
+    # Other databases fall back to searching meanings with a regex, which these
+    # indexes would not serve anyway.
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, table, column in MEANING_SEARCH_INDEXES:
+        schema_editor.execute(
+            f"CREATE INDEX {name} ON {table} USING gin "
+            f"(to_tsvector('simple'::regconfig, COALESCE({column}, '')))"
+        )
+
+
+def drop_meaning_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, _, _ in MEANING_SEARCH_INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("kw_webapp", "0011_profile_last_sync_found_changes"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            create_meaning_search_indexes, drop_meaning_search_indexes
+        ),
+    ]
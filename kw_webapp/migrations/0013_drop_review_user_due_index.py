@@ -0,0 +1,17 @@
+# Generated by Django 2.2.24 on 2026-10-17 10:25
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("kw_webapp", "0012_meaning_search_indexes"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="userspecific",
+            name="kw_review_user_due_idx",
+        ),
+    ]
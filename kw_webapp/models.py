@@ -3,11 +3,12 @@ from itertools import chain
 
 from datetime import timedelta
 
+from django.conf import settings
 from django.contrib.postgres.fields import JSONField
 from django.db import models
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.contrib.auth.models import User
-from django.db.models import F
+from django.db.models import F, Q
 from django.utils import timezone
 
 from kw_webapp import constants
@@ -69,6 +70,10 @@ class Profile(models.Model):
     last_wanikani_sync_date = models.DateTimeField(
         auto_now_add=True, null=True
     )
+    # High-water marks of the Wanikani data we have synced, passed as
+    # `updated_after` so only changes are fetched.
+    assignments_updated_after = models.DateTimeField(null=True, blank=True)
+    study_materials_updated_after = models.DateTimeField(null=True, blank=True)
     last_visit = models.DateTimeField(null=True, auto_now_add=True)
     level = models.PositiveIntegerField(
         null=True,
@@ -95,6 +100,19 @@ class Profile(models.Model):
 
     order_reviews_by_level = models.BooleanField(default=False)
 
+    # Whether the last sync with Wanikani brought in any new reviews or
+    # synonyms. Scheduled syncs skip users whose last sync found nothing, until
+    # they visit again.
+    last_sync_found_changes = models.BooleanField(default=True)
+
+    # Only newly registered users go through onboarding, everyone else starts
+    # out complete.
+    onboarding_status = models.CharField(
+        max_length=20,
+        choices=constants.ONBOARDING_STATUS_CHOICES,
+        default=constants.ONBOARDING_COMPLETE,
+    )
+
     burn_reviews = models.BooleanField(default=True)
 
     # General user-changeable settings
@@ -225,6 +243,15 @@ class PartOfSpeech(models.Model):
         return str(self.part)
 
 
+# The fields which are copied over from a Wanikani subject.
+SUBJECT_FIELDS = [
+    "wk_last_modified",
+    "level",
+    "meaning",
+    "auxiliary_meanings_whitelist",
+]
+
+
 class Vocabulary(models.Model):
     meaning = models.CharField(max_length=255)
     wk_subject_id = models.IntegerField(
@@ -233,8 +260,11 @@ class Vocabulary(models.Model):
     wk_last_modified = models.DateTimeField(null=True)
     parts_of_speech = models.ManyToManyField(PartOfSpeech)
     auxiliary_meanings_whitelist = models.CharField(max_length=500, null=True)
+    # Kept in sync with the Wanikani subject by catalogue reconciliation, and
+    # used to order queues by level without joining through the readings.
     level = models.PositiveIntegerField(
         null=True,
+        db_index=True,
         validators=[
             MinValueValidator(constants.LEVEL_MIN),
             MaxValueValidator(constants.LEVEL_MAX),
@@ -264,6 +294,23 @@ class Vocabulary(models.Model):
         )
 
     def reconcile(self, vocabulary):
+        self.apply_subject(vocabulary)
+
+        # Reconcile the difference in readings.
+        self._delete_stale_readings_based_on(vocabulary)
+        self._add_new_readings_based_on(vocabulary)
+        self._reconcile_parts_of_speech_based_on(vocabulary)
+
+        self.save()
+
+    def apply_subject(self, vocabulary):
+        """
+        Copies the top-level information of a Wanikani subject onto this
+        vocabulary, without saving. Readings and parts of speech are not
+        handled here.
+
+        :return: the list of fields which were modified.
+        """
         self.wk_last_modified = vocabulary.data_updated_at
         self.level = vocabulary.level
         # Set whatever is the new primary meaning.
@@ -277,13 +324,7 @@ class Vocabulary(models.Model):
                 if aux.type == "whitelist"
             ]
         )
-
-        # Reconcile the difference in readings.
-        self._delete_stale_readings_based_on(vocabulary)
-        self._add_new_readings_based_on(vocabulary)
-        self._reconcile_parts_of_speech_based_on(vocabulary)
-
-        self.save()
+        return SUBJECT_FIELDS
 
     def _reconcile_parts_of_speech_based_on(self, vocabulary):
         self.parts_of_speech.clear()
@@ -389,6 +430,37 @@ class ReviewManager(models.Manager):
         return super().get_queryset().filter(streak__gte=1)
 
 
+def reviews_are_due_at_read_time():
+    return settings.REVIEW_DUE_MODE == constants.REVIEW_DUE_MODE_READ_TIME
+
+
+# The fields which decide whether a review contributes to a user's review
+# counters.
+COUNTED_REVIEW_FIELDS = (
+    "wanikani_srs_numeric",
+    "hidden",
+    "needs_review",
+    "burned",
+    "streak",
+    "critical",
+)
+
+# The fields which are copied over from a Wanikani assignment.
+ASSIGNMENT_FIELDS = [
+    "wanikani_srs",
+    "wanikani_srs_numeric",
+    "wanikani_burned",
+    "wk_assignment_last_modified",
+]
+
+# The fields which are copied over from a Wanikani study material.
+STUDY_MATERIAL_FIELDS = [
+    "meaning_note",
+    "reading_note",
+    "wk_study_materials_last_modified",
+]
+
+
 class UserSpecific(models.Model):
     vocabulary = models.ForeignKey(Vocabulary, on_delete=models.PROTECT)
     user = models.ForeignKey(
@@ -419,8 +491,72 @@ class UserSpecific(models.Model):
 
     objects = models.Manager()
 
+    # Snapshot of the counted fields as they were last read from or written to
+    # the database. Counter deltas are taken against it, so a concurrent write
+    # of the same row in between goes unnoticed until the counters are
+    # repaired.
+    _counted_state = None
+
     class Meta:
         unique_together = ("vocabulary", "user")
+        indexes = [
+            # Only reviews which are waiting to fall due are indexed, so the
+            # SRS scheduler can find the ones due in its window without
+            # scanning the table.
+            models.Index(
+                fields=["next_review_date"],
+                name="kw_review_pending_due_idx",
+                condition=Q(needs_review=False),
+            ),
+            # The review queue predicates of get_users_current_reviews,
+            # get_users_lessons and get_users_future_reviews. Each is partial
+            # on its fixed flags, and ordered by the columns which vary. When
+            # reviews are due at read time, the current reviews combine
+            # kw_review_current_idx and kw_review_upcoming_idx.
+            models.Index(
+                fields=["user", "wanikani_srs_numeric"],
+                name="kw_review_current_idx",
+                condition=Q(
+                    needs_review=True,
+                    hidden=False,
+                    burned=False,
+                    streak__gte=1,
+                ),
+            ),
+            models.Index(
+                fields=["user", "wanikani_srs_numeric"],
+                name="kw_review_lesson_idx",
+                condition=Q(needs_review=True, hidden=False, streak=0),
+            ),
+            models.Index(
+                fields=["user", "next_review_date"],
+                name="kw_review_upcoming_idx",
+                condition=Q(
+                    needs_review=False,
+                    hidden=False,
+                    burned=False,
+                    streak__gte=1,
+                ),
+            ),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if not instance.get_deferred_fields().intersection(
+            COUNTED_REVIEW_FIELDS
+        ):
+            instance._counted_state = instance.counted_state()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        if fields is None or set(fields).intersection(COUNTED_REVIEW_FIELDS):
+            if self._counted_state is not None or fields is None:
+                self._counted_state = self.counted_state()
+
+    def counted_state(self):
+        return {field: getattr(self, field) for field in COUNTED_REVIEW_FIELDS}
 
     def is_assignment_out_of_date(self, assignment):
         return (
@@ -436,18 +572,38 @@ class UserSpecific(models.Model):
         )
 
     def reconcile_assignment(self, assignment):
+        self.apply_assignment(assignment)
+        self.save()
+
+    def apply_assignment(self, assignment):
+        """
+        Copies the Wanikani assignment information onto this review, without
+        saving.
+
+        :return: the list of fields which were modified.
+        """
         self.wanikani_srs = "unknown"
         self.wanikani_srs_numeric = assignment.srs_stage
         self.wanikani_burned = assignment.burned_at is not None
         self.wk_assignment_last_modified = assignment.data_updated_at
-        self.save()
+        return ASSIGNMENT_FIELDS
 
     def reconcile_study_material(self, study_material):
+        self.apply_study_material(study_material)
+        self._add_meaning_synonyms(study_material.meaning_synonyms)
+        self.save()
+
+    def apply_study_material(self, study_material):
+        """
+        Copies the notes of a Wanikani study material onto this review, without
+        saving. Meaning synonyms are not handled here.
+
+        :return: the list of fields which were modified.
+        """
         self.meaning_note = study_material.meaning_note
         self.reading_note = study_material.reading_note
-        self._add_meaning_synonyms(study_material.meaning_synonyms)
         self.wk_study_materials_last_modified = study_material.data_updated_at
-        self.save()
+        return STUDY_MATERIAL_FIELDS
 
     def _add_meaning_synonyms(self, meaning_synonyms):
         if meaning_synonyms is not None:
@@ -461,12 +617,49 @@ class UserSpecific(models.Model):
             self.meaning_synonyms.add(*meaning_synonyms_to_add, bulk=False)
 
     def answered_correctly(self, first_try, can_burn):
+        changed_fields = self.apply_correct_answer(first_try, can_burn)
+        self.save(update_fields=changed_fields)
+        return self
+
+    def answered_incorrectly(self):
+        """
+        Helper function to correctly decrement streak value and increase count
+        of incorrect. If user is nearing burned status, they get
+        doubly-decremented.
+        """
+        changed_fields = self.apply_incorrect_answer()
+        self.save(update_fields=changed_fields)
+        return self
+
+    def apply_correct_answer(self, first_try, can_burn, now=None):
+        """
+        Applies a correct answer to this review in memory. Streak, burn status,
+        next review date and criticality are all calculated here, nothing is
+        written to the database.
+
+        :param first_try: whether the user got the review right without getting
+        it wrong first.
+        :param can_burn: whether the user allows reviews to be burned.
+        :param now: the time of the answer, defaults to the current time.
+        :return: the list of field names which were written, suitable for
+        `save(update_fields=...)`.
+        """
+        now = now or timezone.now()
+        changed_fields = [
+            "streak",
+            "needs_review",
+            "last_studied",
+            "next_review_date",
+            "critical",
+        ]
+
         # This is a check to see if it is a "lesson" object.
         if self.streak == 0:
             self.streak += 1
         elif first_try:
             self.correct += 1
             self.streak += 1
+            changed_fields.append("correct")
             if (
                 self.streak
                 >= constants.KANIWANI_SRS_LEVELS[KwSrsLevel.BURNED.name][0]
@@ -474,22 +667,24 @@ class UserSpecific(models.Model):
                 # If can burn, do so. Otherwise, keep review at enlightened.
                 if can_burn:
                     self.burned = True
+                    changed_fields.append("burned")
                 else:
                     self.streak = constants.KANIWANI_SRS_LEVELS[
                         KwSrsLevel.ENLIGHTENED.name
                     ][0]
 
         self.needs_review = False
-        self.last_studied = timezone.now()
-        self.set_next_review_time()
-        self.set_criticality()
-        self.save()
-        return self
+        self.last_studied = now
+        self.next_review_date = self._calculate_next_review_date(now)
+        self.critical = self.is_critical()
+        return changed_fields
 
-    def answered_incorrectly(self):
+    def apply_incorrect_answer(self):
         """
-        Helper function to correctly decrement streak value and increase count of incorrect.
-        If user is nearing burned status, they get doubly-decremented.
+        In-memory counterpart of `answered_incorrectly`.
+
+        :return: the list of field names which were written, suitable for
+        `save(update_fields=...)`.
         """
         self.incorrect += 1
         # If user is about to burn, drop them two levels.
@@ -500,9 +695,16 @@ class UserSpecific(models.Model):
             self.streak -= 1
 
         self.streak = max(0, self.streak)
-        self.save()
-        self.set_criticality()
-        return self
+        self.critical = self.is_critical()
+        return ["incorrect", "streak", "critical"]
+
+    def _calculate_next_review_date(self, now):
+        if self.streak not in constants.SRS_TIMES.keys():
+            return None
+        next_review_date = now + timedelta(
+            hours=constants.SRS_TIMES[self.streak]
+        )
+        return next_review_date.replace(minute=0, second=1)
 
     def set_criticality(self):
         if self.is_critical():
@@ -533,8 +735,30 @@ class UserSpecific(models.Model):
             chain(self.vocabulary.readings.all(), self.reading_synonyms.all())
         )
 
+    def is_due(self, now=None, on_vacation=None):
+        """
+        Whether this review can be answered. When reviews are due at read time,
+        this does not wait on an SRS run to set needs_review, but as in
+        get_due_review_filter, reviews don't fall due while their owner is on
+        vacation.
+
+        :param on_vacation: Whether the owner is on vacation, if the caller
+        already knows. Read from their profile otherwise.
+        """
+        if self.needs_review:
+            return True
+        if not reviews_are_due_at_read_time() or self.next_review_date is None:
+            return False
+        if self.next_review_date > (now or timezone.now()):
+            return False
+        if on_vacation is None:
+            on_vacation = self.user.profile.on_vacation
+        return not on_vacation
+
     def can_be_managed_by(self, user):
-        return self.user == user or user.is_superuser
+        # Compare on the raw foreign key so the check doesn't need to load the
+        # owner.
+        return self.user_id == user.id or user.is_superuser
 
     def synonyms_list(self):
         return [synonym.text for synonym in self.meaning_synonyms.all()]
@@ -561,13 +785,9 @@ class UserSpecific(models.Model):
         return synonym, created
 
     def set_next_review_time(self):
-        if self.streak not in constants.SRS_TIMES.keys():
-            self.next_review_date = None
-        else:
-            self.next_review_date = timezone.now() + timedelta(
-                hours=constants.SRS_TIMES[self.streak]
-            )
-            self._round_next_review_date()
+        self.next_review_date = self._calculate_next_review_date(
+            timezone.now()
+        )
         self.save()
 
     def set_next_review_time_based_on_last_studied(self):
@@ -660,6 +880,37 @@ class UserSpecific(models.Model):
         )
 
 
+class ReviewCounter(models.Model):
+    """
+    Materialized review and lesson counts for a user. Counts are bucketed by
+    Wanikani SRS level, so that a user's minimum/maximum review settings can be
+    applied at read time by summing the relevant buckets.
+    """
+
+    user = models.ForeignKey(
+        User, related_name="review_counters", on_delete=models.CASCADE
+    )
+    wanikani_srs_numeric = models.IntegerField()
+    reviews = models.IntegerField(default=0)
+    lessons = models.IntegerField(default=0)
+    critical = models.IntegerField(default=0)
+    untrained = models.IntegerField(default=0)
+    apprentice = models.IntegerField(default=0)
+    guru = models.IntegerField(default=0)
+    master = models.IntegerField(default=0)
+    enlightened = models.IntegerField(default=0)
+    burned = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ("user", "wanikani_srs_numeric")
+
+    def __str__(self):
+        return (
+            f"{self.user_id} - WK SRS {self.wanikani_srs_numeric}: "
+            f"{self.reviews} reviews, {self.lessons} lessons"
+        )
+
+
 class AnswerSynonym(models.Model):
     character = models.CharField(max_length=255, null=True)
     kana = models.CharField(max_length=255, null=False)
@@ -11,3 +11,28 @@ class FallbackJSONRenderer(renderers.JSONRenderer):
         if data is None:
             data = {"detail": "none"}
         return super().render(data, accepted_media_type, renderer_context)
+
+
+class StreamingJSONRenderer(FallbackJSONRenderer):
+    """
+    Renders a list response one chunk at a time, so that the full list never
+    has to be held in memory.
+    """
+
+    def render_chunks(self, chunks, renderer_context=None):
+        """
+        :param chunks: An iterable of lists of serialized items.
+        :return: A generator of bytes which together form a single JSON array.
+        """
+        yield b"["
+        separator = b""
+        for chunk in chunks:
+            if not chunk:
+                continue
+            # Render each chunk as its own array, and strip the brackets to
+            # splice it into the outer one.
+            yield separator + super().render(
+                chunk, renderer_context=renderer_context
+            )[1:-1]
+            separator = b","
+        yield b"]"
@@ -1,11 +1,73 @@
 from django.contrib.auth.signals import user_logged_in
-from kw_webapp.tasks import sync_with_wk
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from kw_webapp.counters import (
+    record_review_change,
+    record_unknown_review_change,
+)
+from kw_webapp.models import (
+    COUNTED_REVIEW_FIELDS,
+    Announcement,
+    FrequentlyAskedQuestion,
+    Reading,
+    UserSpecific,
+    Vocabulary,
+)
+from kw_webapp.tasks import invalidate_catalogue, queue_login_sync
 
 
 def sync_unlocks_with_wk(sender, **kwargs):
     if kwargs["user"]:
-        user = kwargs["user"]
-        sync_with_wk.delay(user.id, full=user.profile.follow_me)
+        queue_login_sync(kwargs["user"])
+
+
+def update_review_counters_on_save(
+    sender, instance, created, raw, update_fields, **kwargs
+):
+    if raw:
+        return
+    before = None if created else instance._counted_state
+    if not created and before is None:
+        record_unknown_review_change(instance.user_id)
+        return
+
+    if update_fields is None or before is None:
+        after = instance.counted_state()
+    else:
+        after = {
+            field: getattr(instance, field)
+            if field in update_fields
+            else before[field]
+            for field in COUNTED_REVIEW_FIELDS
+        }
+    record_review_change(instance.user_id, before, after)
+    instance._counted_state = after
+
+
+def update_review_counters_on_delete(sender, instance, **kwargs):
+    if instance._counted_state is None:
+        record_unknown_review_change(instance.user_id)
+    else:
+        record_review_change(instance.user_id, instance._counted_state, None)
+
+
+def invalidate_catalogue_on_change(sender, **kwargs):
+    # Covers admin edits, as well as Vocabulary.reconcile saving the vocabulary
+    # and its readings during a sync. The version only moves on once the change
+    # is committed, or a request reading the old rows in between would cache
+    # them under the new version.
+    transaction.on_commit(invalidate_catalogue)
 
 
 user_logged_in.connect(sync_unlocks_with_wk)
+post_save.connect(update_review_counters_on_save, sender=UserSpecific)
+post_delete.connect(update_review_counters_on_delete, sender=UserSpecific)
+for catalogue_model in (
+    Vocabulary,
+    Reading,
+    FrequentlyAskedQuestion,
+    Announcement,
+):
+    post_save.connect(invalidate_catalogue_on_change, sender=catalogue_model)
+    post_delete.connect(invalidate_catalogue_on_change, sender=catalogue_model)
@@ -2,9 +2,21 @@ import logging
 from datetime import timedelta
 
 from celery import shared_task
+from django.core.cache import cache
+from django.db import transaction
 from django.utils import timezone
 
-from kw_webapp.models import UserSpecific
+from kw_webapp.constants import (
+    SRS_DUE_WINDOW_CACHE_KEY,
+    SRS_DUE_WINDOW_OVERLAP_MINUTES,
+    SRS_FLAG_BATCH_SIZE,
+)
+from kw_webapp.counters import batched_review_counts, record_saved_reviews
+from kw_webapp.models import (
+    COUNTED_REVIEW_FIELDS,
+    UserSpecific,
+    reviews_are_due_at_read_time,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +30,10 @@ def all_srs(user=None):
     :param user: Optional Param, the user to be updated. If left blank, will update all users.
     :return: None
     """
+    if reviews_are_due_at_read_time():
+        # Reviews become due on their own, there is nothing to flag.
+        return 0
+
     related_username = user.username if user else "all users"
     # logger.info(f"Beginning  SRS run for {related_username}")
     affected_count = 0
@@ -27,7 +43,8 @@ def all_srs(user=None):
     # Fetches all reviews with next_review_date greater than or equal to NOW, flips them all to needs_review=True
     if user and user.profile.on_vacation:
         logger.info(
-            f"Skipping SRS for user {user.username} as they are on vacation as of {user.profile.vacation_date}"
+            f"Skipping SRS for user {user.username} as they are on vacation "
+            f"as of {user.profile.vacation_date}"
         )
         return 0
 
@@ -44,8 +61,147 @@ def all_srs(user=None):
             needs_review=False,
         )
 
-    affected_count += review_set.update(needs_review=True)
+    affected_count += _flag_reviews_as_due(review_set)
     logger.info(
-        f"User {user.username if user else 'all users'} has {affected_count} new reviews."
+        f"User {user.username if user else 'all users'} has {affected_count} "
+        "new reviews."
+    )
+    return affected_count
+
+
+@shared_task
+def flag_due_reviews():
+    """
+    Frequent, incremental SRS run. Only the reviews which fell due since the
+    previous run are looked at, which the partial index on pending reviews
+    makes cheap no matter how large the review table is. If there is no record
+    of a previous run, this falls back to a full run.
+
+    :return: The number of reviews which were flagged as needing review.
+    """
+    if reviews_are_due_at_read_time():
+        return 0
+
+    window_end = timezone.now() + timedelta(minutes=1)
+    review_set = UserSpecific.objects.filter(
+        user__profile__on_vacation=False,
+        next_review_date__lte=window_end,
+        needs_review=False,
     )
+    previous_window_end = cache.get(SRS_DUE_WINDOW_CACHE_KEY)
+    if previous_window_end is not None:
+        review_set = review_set.filter(
+            next_review_date__gt=previous_window_end
+            - timedelta(minutes=SRS_DUE_WINDOW_OVERLAP_MINUTES)
+        )
+
+    affected_count = _flag_reviews_as_due(review_set)
+    cache.set(SRS_DUE_WINDOW_CACHE_KEY, window_end, None)
+    logger.info(f"Flagged {affected_count} reviews which fell due.")
+    return affected_count
+
+
+def _flag_reviews_as_due(review_set):
+    """
+    Flags the reviews in batches of SRS_FLAG_BATCH_SIZE. Flagged reviews drop
+    out of the review set, so each batch is simply the first rows still left in
+    it.
+    """
+    affected_count = 0
+    while True:
+        with transaction.atomic(), batched_review_counts() as counter_delta:
+            # Lock the rows being flipped while reading their counted state, so
+            # that the review counters follow what is actually overwritten.
+            # Reviews which are being answered right now are left for the next
+            # run.
+            flipped = list(
+                review_set.select_for_update(
+                    skip_locked=True, of=("self",)
+                ).values_list("id", "user_id", *COUNTED_REVIEW_FIELDS)[
+                    :SRS_FLAG_BATCH_SIZE
+                ]
+            )
+            if not flipped:
+                break
+            affected_count += UserSpecific.objects.filter(
+                id__in=[review_id for review_id, *_ in flipped]
+            ).update(needs_review=True)
+            for _, user_id, *counted_values in flipped:
+                before = dict(zip(COUNTED_REVIEW_FIELDS, counted_values))
+                counter_delta.track(
+                    user_id, before, dict(before, needs_review=True)
+                )
+        if len(flipped) < SRS_FLAG_BATCH_SIZE:
+            break
     return affected_count
+
+
+def apply_review_answers(user, answers):
+    """
+    Applies a batch of review answers for a user. Ownership of every review in
+    the batch is checked with a single query, the SRS transitions are
+    calculated in memory, and all modified reviews are written back with one
+    bulk update.
+
+    :param user: The user submitting the answers.
+    :param answers: A list of dicts containing `id`, `correct` and
+    `wrong_before`, in the order they were answered.
+    :return: A list of compact per-answer results, in the same order as
+    `answers`.
+    """
+    reviews = UserSpecific.objects.in_bulk(
+        {answer["id"] for answer in answers}
+    )
+    can_burn = user.profile.burn_reviews
+    now = timezone.now()
+
+    results = []
+    answered_reviews = {}
+    changed_fields = set()
+    for answer in answers:
+        review = reviews.get(answer["id"])
+        if review is None:
+            results.append({"id": answer["id"], "error": "not_found"})
+            continue
+        on_vacation = (
+            user.profile.on_vacation if review.user_id == user.id else None
+        )
+        if not review.can_be_managed_by(user) or not review.is_due(
+            now, on_vacation
+        ):
+            results.append({"id": answer["id"], "error": "forbidden"})
+            continue
+
+        if answer["correct"]:
+            changed_fields.update(
+                review.apply_correct_answer(
+                    not answer["wrong_before"], can_burn, now
+                )
+            )
+        else:
+            changed_fields.update(review.apply_incorrect_answer())
+        answered_reviews[review.id] = review
+        results.append(_build_answer_result(review, on_vacation))
+
+    if answered_reviews:
+        UserSpecific.objects.bulk_update(
+            answered_reviews.values(), sorted(changed_fields)
+        )
+        with batched_review_counts():
+            record_saved_reviews(answered_reviews.values())
+    logger.info(
+        f"User {user.username} submitted {len(answers)} answers, "
+        f"{len(answered_reviews)} reviews updated."
+    )
+    return results
+
+
+def _build_answer_result(review, on_vacation):
+    return {
+        "id": review.id,
+        "streak": review.streak,
+        "needs_review": review.is_due(on_vacation=on_vacation),
+        "next_review_date": review.next_review_date,
+        "burned": review.burned,
+        "critical": review.critical,
+    }
@@ -1,22 +1,57 @@
 from __future__ import absolute_import
 
 from collections import OrderedDict
+from contextlib import contextmanager
 
-from celery import shared_task
+from celery import chain, shared_task
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db.models import F, Count
+from django.core.cache import cache
+from django.db.models import F, Count, Q
 from django.db.models import Min
 from django.db.models.functions import TruncHour, TruncDate
 from wanikani_api.exceptions import InvalidWanikaniApiKeyException
 
+from api.sync.SyncCoordinator import SyncCoordinator
+from api.sync.SyncScheduler import SyncScheduler
 from api.sync.SyncerFactory import Syncer
-from kw_webapp.constants import KANIWANI_SRS_LEVELS, KwSrsLevel
+from kw_webapp.constants import (
+    CATALOGUE_VERSION_CACHE_KEY,
+    EXPECTED_LEVEL_UP_HOURS,
+    KANIWANI_SRS_LEVELS,
+    KwSrsLevel,
+    LEVEL_MAX,
+    LEVEL_MIN,
+    LEVEL_VOCABULARY_COUNTS_CACHE_KEY,
+    LOGIN_SYNC_CACHE_PREFIX,
+    LOGIN_SYNC_DEDUPLICATION_SECONDS,
+    ONBOARDING_COMPLETE,
+    ONBOARDING_FAILED,
+    ONBOARDING_QUEUED,
+    ONBOARDING_SYNC_MAX_RETRIES,
+    ONBOARDING_SYNC_RETRY_SECONDS,
+    ONBOARDING_SYNCING,
+    ONBOARDING_UNLOCKING,
+)
+from kw_webapp.counters import (
+    batched_review_counts,
+    get_review_counts,
+    repair_review_counter_drift,
+)
 from kw_webapp.wanikani import exceptions
-from kw_webapp.models import UserSpecific, Vocabulary, Profile, Level
+from kw_webapp.models import (
+    UserSpecific,
+    Vocabulary,
+    Profile,
+    Level,
+    Reading,
+    reviews_are_due_at_read_time,
+)
 from datetime import timedelta, datetime
 from django.utils import timezone
 
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -61,7 +96,8 @@ def get_vocab_by_meaning(meaning):
         v = Vocabulary.objects.get(meaning=meaning)
     except Vocabulary.DoesNotExist:
         logger.error(
-            f"While attempting to get vocabulary {meaning} we could not find it!"
+            f"While attempting to get vocabulary {meaning} we could not find "
+            "it!"
         )
         raise Vocabulary.DoesNotExist(f"Couldn't find meaning: {meaning}")
     else:
@@ -89,7 +125,8 @@ def associate_vocab_to_user(vocab, user):
         us = UserSpecific.objects.filter(vocabulary=vocab, user=user)
         for u in us:
             logger.error(
-                f"during {user.username}'s WK sync, we received multiple UserSpecific objects. Details: {u}"
+                f"during {user.username}'s WK sync, we received multiple "
+                f"UserSpecific objects. Details: {u}"
             )
         return None, None
 
@@ -108,11 +145,15 @@ def start_following_wanikani(user):
         user.profile.level = syncer.get_wanikani_level()
         user.profile.unlocked_levels.get_or_create(level=user.profile.level)
         user.profile.save()
+        # Nothing was applied while the user was not followed, so the cursors
+        # cannot be trusted.
+        syncer.reset_sync_cursors()
         syncer.sync_user_profile_with_wk
         syncer.unlock_vocab(user.profile.level)
     except exceptions.InvalidWaniKaniKey or InvalidWanikaniApiKeyException as e:
         logger.warning(
-            f"User {user.username} failed to toggle Follow Wanikani as they have an invalid API key"
+            f"User {user.username} failed to toggle Follow Wanikani as they "
+            "have an invalid API key"
         )
         user.profile.api_valid = False
         user.profile.save()
@@ -128,13 +169,69 @@ def lock_level_for_user(requested_level, user):
         user=user, vocabulary__readings__level=requested_level
     ).distinct()
     count = reviews.count()
-    reviews.delete()
+    with batched_review_counts():
+        reviews.delete()
     level = Level.objects.get(profile=user.profile, level=requested_level)
     user.profile.unlocked_levels.remove(level)
     level.delete()
     return count
 
 
+def get_level_vocabulary_counts():
+    """
+    Counts the vocabulary in every level with one grouped query. The result is
+    cached until the catalogue changes, see invalidate_level_vocabulary_counts.
+
+    :return: dict of level -> number of distinct vocabulary with a reading in
+    that level.
+    """
+    counts = cache.get(LEVEL_VOCABULARY_COUNTS_CACHE_KEY)
+    if counts is None:
+        counts = dict(
+            Reading.objects.filter(level__isnull=False)
+            .values("level")
+            .annotate(vocabulary_count=Count("vocabulary", distinct=True))
+            .values_list("level", "vocabulary_count")
+            .order_by()
+        )
+        cache.set(LEVEL_VOCABULARY_COUNTS_CACHE_KEY, counts, None)
+    return counts
+
+
+def invalidate_level_vocabulary_counts():
+    cache.delete(LEVEL_VOCABULARY_COUNTS_CACHE_KEY)
+
+
+def get_catalogue_version():
+    """
+    The version of the catalogue (vocabulary, readings, FAQs and announcements)
+    that cached responses are keyed on.
+    """
+    version = cache.get(CATALOGUE_VERSION_CACHE_KEY)
+    if version is None:
+        _start_catalogue_version()
+        version = cache.get(CATALOGUE_VERSION_CACHE_KEY)
+    return version
+
+
+def invalidate_catalogue():
+    """
+    Moves the catalogue on to a new version, so that every response cached from
+    the previous one stops being served.
+    """
+    invalidate_level_vocabulary_counts()
+    try:
+        cache.incr(CATALOGUE_VERSION_CACHE_KEY)
+    except ValueError:
+        _start_catalogue_version()
+
+
+def _start_catalogue_version():
+    # Start from the clock rather than from 1, so that a version evicted from
+    # the cache is never handed out again.
+    cache.add(CATALOGUE_VERSION_CACHE_KEY, int(time.time() * 1000), None)
+
+
 def unlock_all_possible_levels_for_user(user):
     """
 
@@ -149,10 +246,117 @@ def unlock_all_possible_levels_for_user(user):
 
 
 @shared_task
-def sync_with_wk(user_id, full=False):
+def sync_with_wk(user_id, full=False, resync=False):
+    """
+    Syncs a user with Wanikani, unless a sync is already in flight for them,
+    see SyncCoordinator.
+
+    :return: The syncer's result, or None if the sync was skipped or merged
+    into the one in flight.
+    """
     p = Profile.objects.get(user__id=user_id)
     syncer = Syncer.factory(p)
-    return syncer.sync_with_wk(full_sync=full)
+    result = SyncCoordinator(user_id).run(
+        syncer.sync_with_wk, full_sync=full, resync=resync
+    )
+    if result is not None:
+        profile_sync_succeeded, new_review_count, new_synonym_count = result
+        if profile_sync_succeeded:
+            Profile.objects.filter(user_id=user_id).update(
+                last_sync_found_changes=bool(
+                    new_review_count or new_synonym_count
+                )
+            )
+    return result
+
+
+def queue_login_sync(user):
+    """
+    Queues a sync for a user who just logged in, unless one was already queued
+    for them within the last LOGIN_SYNC_DEDUPLICATION_SECONDS, or they are
+    still being onboarded.
+
+    :return: True if a sync was queued.
+    """
+    if user.profile.onboarding_status not in (
+        ONBOARDING_COMPLETE,
+        ONBOARDING_FAILED,
+    ):
+        return False
+    if not cache.add(
+        f"{LOGIN_SYNC_CACHE_PREFIX}:{user.id}",
+        True,
+        LOGIN_SYNC_DEDUPLICATION_SECONDS,
+    ):
+        return False
+    sync_with_wk.delay(user.id, full=user.profile.follow_me)
+    return True
+
+
+def build_onboarding_chain(user_id):
+    return chain(
+        onboarding_sync.si(user_id),
+        onboarding_unlock_previous_level.si(user_id),
+    )
+
+
+def start_onboarding(user):
+    """
+    Queues the onboarding of a newly registered user: a sync with Wanikani,
+    then unlocking their previous level if that left them with no lessons.
+    Progress can be followed through Profile.onboarding_status.
+    """
+    _set_onboarding_status(user.id, ONBOARDING_QUEUED)
+    build_onboarding_chain(user.id).apply_async()
+
+
+@shared_task(bind=True, max_retries=ONBOARDING_SYNC_MAX_RETRIES)
+def onboarding_sync(self, user_id):
+    with _onboarding_step(user_id, ONBOARDING_SYNCING):
+        profile = Profile.objects.get(user__id=user_id)
+        result = sync_with_wk(user_id, full=profile.follow_me)
+        if result is None and self.request.retries >= self.max_retries:
+            raise RuntimeError(
+                f"The first sync of user {user_id} never got to run."
+            )
+    if result is None:
+        # The sync was merged into, or skipped for, one already in flight. The
+        # rest of the chain needs the first sync to have finished, so try again
+        # until one of ours actually runs.
+        raise self.retry(countdown=ONBOARDING_SYNC_RETRY_SECONDS)
+
+
+@shared_task
+def onboarding_unlock_previous_level(user_id):
+    with _onboarding_step(user_id, ONBOARDING_UNLOCKING):
+        user = User.objects.select_related("profile").get(id=user_id)
+        if not get_users_lessons(user).exists():
+            unlock_previous_level(user)
+    _set_onboarding_status(user_id, ONBOARDING_COMPLETE)
+
+
+def unlock_previous_level(user):
+    if user.profile.level == LEVEL_MIN:
+        return
+    previous_level = user.profile.level - 1
+    user.profile.unlocked_levels.get_or_create(level=previous_level)
+    Syncer.factory(user.profile).unlock_vocab(previous_level)
+
+
+@contextmanager
+def _onboarding_step(user_id, status):
+    _set_onboarding_status(user_id, status)
+    try:
+        yield
+    except Exception:
+        # The chain stops at the failed step, so this is the last status the
+        # user will get.
+        _set_onboarding_status(user_id, ONBOARDING_FAILED)
+        raise
+
+
+def _set_onboarding_status(user_id, status):
+    Profile.objects.filter(user_id=user_id).update(onboarding_status=status)
 
 
 def get_users_reviews(user):
@@ -178,6 +382,47 @@ def get_users_critical_reviews(user):
     )
 
 
+def get_due_review_filter(user, now=None):
+    """
+    Builds the filter for reviews which are due. In flag mode that is only the
+    needs_review flag set by SRS runs. When reviews are due at read time,
+    reviews whose next_review_date has passed are due too, unless the user is
+    on vacation.
+
+    :param user: The user whose reviews are being filtered.
+    :param now: The time to compare next_review_date against, defaults to the
+    current time.
+    :return: A Q object.
+    """
+    due = Q(needs_review=True)
+    if reviews_are_due_at_read_time() and not user.profile.on_vacation:
+        # Spelled out with needs_review=False, so that kw_review_upcoming_idx
+        # can serve this half.
+        due |= Q(
+            needs_review=False, next_review_date__lte=now or timezone.now()
+        )
+    return due
+
+
+def get_upcoming_review_filter(user, now=None):
+    """
+    Builds the filter for reviews which are not due yet, the opposite of
+    get_due_review_filter. It is spelled out rather than negated, so that
+    kw_review_upcoming_idx can serve it.
+
+    :param user: The user whose reviews are being filtered.
+    :param now: The time to compare next_review_date against, defaults to the
+    current time.
+    :return: A Q object.
+    """
+    upcoming = Q(needs_review=False)
+    if reviews_are_due_at_read_time() and not user.profile.on_vacation:
+        upcoming &= Q(next_review_date__gt=now or timezone.now()) | Q(
+            next_review_date__isnull=True
+        )
+    return upcoming
+
+
 def get_users_lessons(user):
     qs = UserSpecific.objects.filter(
         user=user,
@@ -191,15 +436,15 @@ def get_users_lessons(user):
     )
 
     if user.profile.order_reviews_by_level:
-        qs = qs.order_by("vocabulary__readings__level")
+        qs = qs.order_by("vocabulary__level", "id")
 
     return qs
 
 
 def get_users_current_reviews(user):
     queryset = UserSpecific.objects.filter(
+        get_due_review_filter(user),
         user=user,
-        needs_review=True,
         wanikani_srs_numeric__range=(
             user.profile.get_minimum_wk_srs_threshold_for_review(),
             user.profile.get_maximum_wk_srs_threshold_for_review(),
@@ -209,26 +454,22 @@ def get_users_current_reviews(user):
         streak__gte=KANIWANI_SRS_LEVELS[KwSrsLevel.APPRENTICE.name][0],
     )
     if user.profile.order_reviews_by_level:
-        queryset = queryset.order_by("vocabulary__readings__level")
+        queryset = queryset.order_by("vocabulary__level", "id")
     return queryset
 
 
 def get_users_future_reviews(user, time_limit=None):
-    queryset = (
-        UserSpecific.objects.filter(
-            user=user,
-            needs_review=False,
-            wanikani_srs_numeric__range=(
-                user.profile.get_minimum_wk_srs_threshold_for_review(),
-                user.profile.get_maximum_wk_srs_threshold_for_review(),
-            ),
-            hidden=False,
-            burned=False,
-            streak__gte=KANIWANI_SRS_LEVELS[KwSrsLevel.APPRENTICE.name][0],
-        )
-        .annotate(Min("next_review_date"))
-        .order_by("next_review_date")
-    )
+    queryset = UserSpecific.objects.filter(
+        get_upcoming_review_filter(user),
+        user=user,
+        wanikani_srs_numeric__range=(
+            user.profile.get_minimum_wk_srs_threshold_for_review(),
+            user.profile.get_maximum_wk_srs_threshold_for_review(),
+        ),
+        hidden=False,
+        burned=False,
+        streak__gte=KANIWANI_SRS_LEVELS[KwSrsLevel.APPRENTICE.name][0],
+    ).order_by("next_review_date")
 
     if isinstance(time_limit, timedelta):
         queryset = queryset.filter(
@@ -246,36 +487,175 @@ def get_all_users_reviews(user):
     )
 
 
+def get_sync_scheduler():
+    return SyncScheduler(
+        "all_users", max_in_flight=settings.SCHEDULED_SYNC_MAX_IN_FLIGHT
+    )
+
+
+def get_sync_schedule_backlog():
+    """
+    :return: The backlog of scheduled syncs, see SyncScheduler.backlog.
+    """
+    return get_sync_scheduler().backlog()
+
+
+def sync_priority(profile, now):
+    """
+    Users who visited recently, and who are likely to have levelled up on
+    Wanikani since they were last synced, are synced first. Users at the
+    maximum level can't level up.
+
+    :return: A sort key, lowest first.
+    """
+    hours_since_visit = (now - profile.last_visit).total_seconds() / 3600
+    if profile.level == LEVEL_MAX or profile.last_wanikani_sync_date is None:
+        level_up_likelihood = 0 if profile.level == LEVEL_MAX else 1
+    else:
+        hours_since_sync = (
+            now - profile.last_wanikani_sync_date
+        ).total_seconds() / 3600
+        level_up_likelihood = min(
+            1, hours_since_sync / EXPECTED_LEVEL_UP_HOURS
+        )
+    return hours_since_visit / (24 * 7) - level_up_likelihood
+
+
 @shared_task
 def sync_all_users_to_wk():
     """
-    calls sync_with_wk for all users, causing all users to have their newly unlocked vocabulary synchronized to KW.
+    Schedules a sync for every user who has used KW in the last week. Their
+    syncs are spread across the interval until the next schedule, highest
+    priority first, and handed out by dispatch_scheduled_syncs. Users whose
+    last sync found nothing, and who haven't visited since, are skipped this
+    time around.
 
-    :return: the number of users successfully synced to WK.
+    :return: the number of users scheduled to be synced.
     """
+    now = timezone.now()
     one_week_ago = past_time(24 * 7)
     logger.info("Beginning Bi-daily Sync for all user!")
-    users = User.objects.all().exclude(profile__isnull=True)
+    # Get only users who have recently used WK
+    profiles = Profile.objects.filter(last_visit__gte=one_week_ago)
+    # Get only users who have not lapsed their WK subscription, as we can't
+    # query those lapsed users anyhow
+    profiles = profiles.filter(has_lapsed_wanikani=False)
+    idle = Q(last_sync_found_changes=False) & Q(
+        last_visit__lt=F("last_wanikani_sync_date")
+    )
+    skipped_count = profiles.filter(idle).count()
+    profiles = profiles.exclude(idle).only(
+        "user_id", "level", "last_visit", "last_wanikani_sync_date"
+    )
+
+    ordered = sorted(profiles, key=lambda profile: sync_priority(profile, now))
+    get_sync_scheduler().schedule(
+        [profile.user_id for profile in ordered],
+        settings.SCHEDULED_SYNC_INTERVAL_HOURS * 3600,
+    )
     logger.info(
-        f"Original sync would have occurred for {users.count()} users."
+        f"Scheduled syncs for {len(ordered)} users, skipped {skipped_count} "
+        "whose last sync found nothing."
     )
-    # Get only users who have recently used WK
-    users = User.objects.filter(profile__last_visit__gte=one_week_ago)
-    # Get only users who have not lapsed their WK subscription, as we can't query those lapsed users anyhow
-    users = users.filter(profile__has_lapsed_wanikani=False)
+    return len(ordered)
+
+
+@shared_task
+def dispatch_scheduled_syncs():
+    """
+    Queues the scheduled syncs which are due, as far as the bound on syncs in
+    flight allows.
 
-    logger.info(f"Sync will occur for {users.count()} users.")
-    affected_count = 0
-    for user in users:
+    :return: the number of syncs queued.
+    """
+    user_ids = get_sync_scheduler().pop_due()
+    for user_id in user_ids:
+        scheduled_sync.apply_async(args=[user_id], queue="long_running_sync")
+    if user_ids:
         logger.info(
-            f"{user.username} --- {str(user.profile.last_visit)} --- {one_week_ago}"
+            f"Dispatched {len(user_ids)} scheduled syncs, backlog: "
+            f"{get_sync_schedule_backlog()}"
         )
-        sync_with_wk.apply_async(
-            args=[user.id, True], queue="long_running_sync"
+    return len(user_ids)
+
+
+@shared_task
+def scheduled_sync(user_id):
+    try:
+        return sync_with_wk(user_id, full=True)
+    finally:
+        get_sync_scheduler().finish(user_id)
+
+
+@shared_task
+def repair_review_counters():
+    """
+    Rebuilds any review counters which have drifted from the reviews they
+    count, see repair_review_counter_drift.
+
+    :return: the number of users whose counters were rebuilt.
+    """
+    repaired_count = repair_review_counter_drift()
+    if repaired_count:
+        logger.warning(
+            f"Rebuilt the drifted review counters of {repaired_count} users."
         )
-        affected_count += 1
-    logger.info(f"Bi-daily sync tasks kicked off for {affected_count} users")
-    return affected_count
+    return repaired_count
+
+
+def get_user_dashboard_stats(user):
+    """
+    Builds everything the dashboard shows about a user's reviews. The SRS level
+    breakdown and the current review and lesson counts are read from the user's
+    review counters. The upcoming review counts for the next hour and day and
+    the next review date depend on the time, so they are computed in one
+    conditional aggregation pass over get_users_reviews. When reviews are due
+    at read time, the counters can't know which reviews have fallen due, so the
+    current review count is aggregated in the same pass.
+
+    :param user: The user to build stats for.
+    :return: A dict containing `srs_counts` (an OrderedDict of lowercased
+    KwSrsLevel name -> count), `reviews_count`, `lessons_count`,
+    `reviews_within_hour_count`, `reviews_within_day_count` and
+    `next_review_at`.
+    """
+    now = timezone.now()
+    first_review_streak = KANIWANI_SRS_LEVELS[KwSrsLevel.APPRENTICE.name][0]
+    reviewable = Q(burned=False, streak__gte=first_review_streak)
+    due = get_due_review_filter(user, now)
+    upcoming = reviewable & get_upcoming_review_filter(user, now)
+
+    aggregates = dict(
+        reviews_within_hour_count=Count(
+            "id",
+            filter=upcoming
+            & Q(next_review_date__lte=now + timedelta(hours=1)),
+        ),
+        reviews_within_day_count=Count(
+            "id",
+            filter=upcoming
+            & Q(next_review_date__lte=now + timedelta(hours=24)),
+        ),
+        next_review_at=Min("next_review_date", filter=upcoming),
+    )
+    if reviews_are_due_at_read_time():
+        aggregates["reviews_count"] = Count("id", filter=reviewable & due)
+
+    # Only reviews which are due or upcoming are aggregated over, and when
+    # reviews are flagged as due, only the upcoming ones, which
+    # kw_review_upcoming_idx covers.
+    reviews = get_users_reviews(user).filter(
+        reviewable if reviews_are_due_at_read_time() else upcoming
+    )
+    review_counts = get_review_counts(user)
+    stats = reviews.aggregate(**aggregates)
+    stats.setdefault("reviews_count", review_counts["reviews"])
+    stats["lessons_count"] = review_counts["lessons"]
+    stats["srs_counts"] = OrderedDict(
+        (level.name.lower(), review_counts[level.name.lower()])
+        for level in KwSrsLevel
+    )
+    return stats
 
 
 def get_24_hour_time_span():
@@ -327,12 +707,16 @@ def reset_user(user, reset_to_level):
     # Set to current level.
     level = Syncer.factory(user.profile).get_wanikani_level()
     user.profile.level = level
+    # Reviews were deleted, so the next sync has to fetch everything again.
+    user.profile.assignments_updated_after = None
+    user.profile.study_materials_updated_after = None
     user.profile.save()
 
 
 def reset_levels(user, reset_to_level):
     logger.info(
-        f"{user.username} is having their levels cleared down to {reset_to_level}"
+        f"{user.username} is having their levels cleared down to "
+        f"{reset_to_level}"
     )
     user.profile.unlocked_levels.filter(level__gt=reset_to_level).delete()
     user.profile.save()
@@ -340,13 +724,15 @@ def reset_levels(user, reset_to_level):
 
 def reset_reviews(user, reset_to_level):
     logger.info(
-        f"{user.username} is having their reviews cleared cleared down to level {reset_to_level}"
+        f"{user.username} is having their reviews cleared cleared down to "
+        f"level {reset_to_level}"
     )
     reviews_to_delete = UserSpecific.objects.filter(user=user)
     reviews_to_delete = reviews_to_delete.filter(
         vocabulary__readings__level__gt=reset_to_level
     )
-    reviews_to_delete.delete()
+    with batched_review_counts():
+        reviews_to_delete.delete()
 
 
 def set_manual_reading_whitelists(*vocab):
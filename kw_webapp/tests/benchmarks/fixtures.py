@@ -0,0 +1,194 @@
+import os
+from datetime import timedelta
+
+from django.utils import timezone
+
+from kw_webapp import constants
+from kw_webapp.counters import rebuild_review_counters
+from kw_webapp.models import (
+    Announcement,
+    AnswerSynonym,
+    FrequentlyAskedQuestion,
+    Level,
+    MeaningSynonym,
+    PartOfSpeech,
+    Reading,
+    Report,
+    UserSpecific,
+    Vocabulary,
+)
+from kw_webapp.tasks import invalidate_catalogue
+from kw_webapp.tests.utils import create_profile, create_user
+
+BENCHMARK_USER_COUNT = 3
+BENCHMARK_VOCABULARY_PER_LEVEL = 100
+PARTS_OF_SPEECH = ["Noun", "Verb", "Adjective", "Adverb", "Expression"]
+
+
+def get_benchmark_scale():
+    """
+    The fixture volume can be shrunk or grown with the KW_BENCHMARK_SCALE
+    environment variable, e.g. 0.1 for a quick local run. Budgets are
+    calibrated against the default scale of 1.
+    """
+    return float(os.environ.get("KW_BENCHMARK_SCALE", 1))
+
+
+def seed_benchmark_data():
+    """
+    Seeds a realistic volume of data: every level filled with vocabulary, and
+    several users who have unlocked all of it, with review histories spread
+    over every SRS level.
+
+    :return: A dict containing the created `users`, a sample `vocabulary`, and
+    the ids of reviews which can be answered during the benchmark
+    (`due_review_ids`).
+    """
+    vocabulary_per_level = max(
+        1, int(BENCHMARK_VOCABULARY_PER_LEVEL * get_benchmark_scale())
+    )
+    now = timezone.now()
+
+    parts_of_speech = PartOfSpeech.objects.bulk_create(
+        [PartOfSpeech(part=part) for part in PARTS_OF_SPEECH]
+    )
+    vocabulary = Vocabulary.objects.bulk_create(
+        [
+            Vocabulary(
+                meaning=f"meaning {level}-{index}",
+                wk_subject_id=level * 10000 + index,
+                level=level,
+            )
+            for level in range(constants.LEVEL_MIN, constants.LEVEL_MAX + 1)
+            for index in range(vocabulary_per_level)
+        ]
+    )
+    readings = Reading.objects.bulk_create(
+        [
+            Reading(
+                vocabulary=vocab,
+                character=f"字{vocab.wk_subject_id}",
+                kana=f"じ{vocab.wk_subject_id}",
+                level=vocab.level,
+                sentence_en="An example sentence.",
+                sentence_ja="例文です。",
+                common=True,
+            )
+            for vocab in vocabulary
+        ]
+    )
+    Reading.parts_of_speech.through.objects.bulk_create(
+        [
+            Reading.parts_of_speech.through(
+                reading_id=reading.id,
+                partofspeech_id=parts_of_speech[
+                    index % len(parts_of_speech)
+                ].id,
+            )
+            for index, reading in enumerate(readings)
+        ]
+    )
+
+    users = []
+    for user_index in range(BENCHMARK_USER_COUNT):
+        user = create_user(f"benchmark{user_index}")
+        profile = create_profile(user, "any_key", constants.LEVEL_MAX)
+        profile.unlocked_levels.add(
+            *Level.objects.bulk_create(
+                [
+                    Level(level=level)
+                    for level in range(
+                        constants.LEVEL_MIN, constants.LEVEL_MAX
+                    )
+                ]
+            )
+        )
+        users.append(user)
+
+    # Users' reviews are interleaved, as they would be when unlocked over time,
+    # rather than stored in one block each.
+    UserSpecific.objects.bulk_create(
+        [
+            _build_review(user, vocab, index, now)
+            for index, vocab in enumerate(vocabulary)
+            for user in users
+        ]
+    )
+
+    for user_index, user in enumerate(users):
+        reviews = list(UserSpecific.objects.filter(user=user).order_by("id"))
+        MeaningSynonym.objects.bulk_create(
+            [
+                MeaningSynonym(review=review, text=f"synonym {review.id}")
+                for review in reviews[::10]
+            ]
+        )
+        AnswerSynonym.objects.bulk_create(
+            [
+                AnswerSynonym(
+                    review=review,
+                    kana=f"かな{review.id}",
+                    character=f"字{review.id}",
+                )
+                for review in reviews[5::10]
+            ]
+        )
+        Report.objects.bulk_create(
+            [
+                Report(created_by=user, reading=reading, reason="Typo")
+                for reading in readings[user_index::500]
+            ]
+        )
+        rebuild_review_counters(user)
+
+    FrequentlyAskedQuestion.objects.bulk_create(
+        [
+            FrequentlyAskedQuestion(
+                question=f"Question {index}?", answer="Yes."
+            )
+            for index in range(20)
+        ]
+    )
+    Announcement.objects.bulk_create(
+        [
+            Announcement(
+                title=f"Announcement {index}", body="Body", creator=users[0]
+            )
+            for index in range(20)
+        ]
+    )
+    # The catalogue was bulk created, so its caches were not invalidated by
+    # signals.
+    invalidate_catalogue()
+
+    due_review_ids = list(
+        UserSpecific.objects.filter(
+            user=users[0], needs_review=True, hidden=False, streak__gte=1
+        )
+        .order_by("id")
+        .values_list("id", flat=True)[:60]
+    )
+    return {
+        "users": users,
+        "vocabulary": vocabulary[0],
+        "due_review_ids": due_review_ids,
+    }
+
+
+def _build_review(user, vocab, index, now):
+    streak = index % 10
+    incorrect = index % 7
+    return UserSpecific(
+        user=user,
+        vocabulary=vocab,
+        streak=streak,
+        wanikani_srs_numeric=streak,
+        correct=index % 13 + streak,
+        incorrect=incorrect,
+        needs_review=index % 3 == 0,
+        burned=streak == 9,
+        hidden=index % 50 == 49,
+        critical=incorrect >= constants.MINIMUM_ATTEMPT_COUNT_FOR_CRITICALITY,
+        last_studied=now - timedelta(hours=index % 72),
+        next_review_date=now + timedelta(hours=index % 48 - 12),
+    )
@@ -0,0 +1,142 @@
+import json
+import os
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.test import TestCase, override_settings, tag
+from django.utils import timezone
+
+from kw_webapp.constants import REVIEW_DUE_MODE_READ_TIME
+from kw_webapp.models import UserSpecific
+from kw_webapp.tasks import (
+    get_users_current_reviews,
+    get_users_future_reviews,
+    get_users_lessons,
+)
+from kw_webapp.tests.benchmarks.fixtures import (
+    get_benchmark_scale,
+    seed_benchmark_data,
+)
+
+# The indexes added for the review queue predicates, which the "before" plans
+# are taken without.
+REVIEW_QUEUE_INDEXES = [
+    "kw_review_pending_due_idx",
+    "kw_review_current_idx",
+    "kw_review_lesson_idx",
+    "kw_review_upcoming_idx",
+]
+
+
+def explain(queryset):
+    """
+    :return: The JSON plan of EXPLAIN ANALYZE for the queryset.
+    """
+    # QuerySet.explain() returns the plan as text, so run EXPLAIN directly to
+    # get at the parsed JSON.
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}", params)
+        return cursor.fetchone()[0][0]
+
+
+def used_indexes(plan):
+    names = set()
+    nodes = [plan["Plan"]]
+    while nodes:
+        node = nodes.pop()
+        if "Index Name" in node:
+            names.add(node["Index Name"])
+        nodes.extend(node.get("Plans", []))
+    return names
+
+
+def summarize(plan):
+    return OrderedDict(
+        execution_ms=plan["Execution Time"],
+        total_cost=plan["Plan"]["Total Cost"],
+        indexes=sorted(used_indexes(plan)),
+    )
+
+
+@tag("benchmark")
+class TestReviewQueueIndexPlans(TestCase):
+    """
+    Compares the query plans of the review queue queries with and without the
+    review queue indexes, each of which must be used by at least one of them.
+    Plans and timings are written as JSON to the path in
+    KW_BENCHMARK_PLAN_REPORT, if it is set.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        data = seed_benchmark_data()
+        cls.user = data["users"][0]
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {UserSpecific._meta.db_table}")
+
+    def _queries(self):
+        # The same filter as a full all_srs run.
+        srs_review_set = UserSpecific.objects.filter(
+            user__profile__on_vacation=False,
+            next_review_date__lte=timezone.now() + timedelta(minutes=1),
+            needs_review=False,
+        )
+        # Reviews due at read time are found through the same indexes.
+        with override_settings(REVIEW_DUE_MODE=REVIEW_DUE_MODE_READ_TIME):
+            read_time_current_reviews = get_users_current_reviews(self.user)
+            read_time_future_reviews = get_users_future_reviews(self.user)
+        return [
+            ("current-reviews", get_users_current_reviews(self.user)),
+            ("lessons", get_users_lessons(self.user)),
+            ("future-reviews", get_users_future_reviews(self.user)),
+            ("all-srs", srs_review_set),
+            ("read-time-current-reviews", read_time_current_reviews),
+            ("read-time-future-reviews", read_time_future_reviews),
+        ]
+
+    def _plans_without_review_queue_indexes(self):
+        plans = {}
+        with transaction.atomic():
+            sid = transaction.savepoint()
+            with connection.cursor() as cursor:
+                for index in REVIEW_QUEUE_INDEXES:
+                    cursor.execute(f"DROP INDEX {index}")
+            for name, queryset in self._queries():
+                plans[name] = explain(queryset)
+            transaction.savepoint_rollback(sid)
+        return plans
+
+    def test_review_queue_queries_use_the_review_queue_indexes(self):
+        before = self._plans_without_review_queue_indexes()
+        after = {name: explain(queryset) for name, queryset in self._queries()}
+
+        report = OrderedDict()
+        for name, _ in self._queries():
+            report[name] = OrderedDict(
+                before=summarize(before[name]), after=summarize(after[name])
+            )
+            with self.subTest(query=name):
+                self.assertTrue(
+                    used_indexes(after[name]) & set(REVIEW_QUEUE_INDEXES),
+                    f"{name} did not use a review queue index: {report[name]}",
+                )
+                self.assertLessEqual(
+                    after[name]["Plan"]["Total Cost"],
+                    before[name]["Plan"]["Total Cost"],
+                )
+
+        # Every index slows down the writes of each answer, so each has to earn
+        # its place.
+        used = set().union(*(used_indexes(plan) for plan in after.values()))
+        self.assertSetEqual(set(REVIEW_QUEUE_INDEXES) - used, set())
+
+        report_path = os.environ.get("KW_BENCHMARK_PLAN_REPORT")
+        if report_path:
+            with open(report_path, "w") as f:
+                json.dump(
+                    {"scale": get_benchmark_scale(), "queries": report},
+                    f,
+                    indent=2,
+                )
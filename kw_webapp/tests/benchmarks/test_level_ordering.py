@@ -0,0 +1,101 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from statistics import median
+
+from django.db import connection
+from django.test import TestCase, tag
+
+from kw_webapp.models import Reading, UserSpecific
+from kw_webapp.tasks import get_users_current_reviews, get_users_lessons
+from kw_webapp.tests.benchmarks.fixtures import (
+    get_benchmark_scale,
+    seed_benchmark_data,
+)
+from kw_webapp.tests.benchmarks.test_index_plans import explain
+
+TIMED_RUNS = 5
+
+
+def fetch_latency(queryset):
+    """
+    :return: The median number of milliseconds it takes to fetch every row of
+    the queryset.
+    """
+    timings = []
+    for _ in range(TIMED_RUNS):
+        start = time.perf_counter()
+        list(queryset.all())
+        timings.append((time.perf_counter() - start) * 1000)
+    return round(median(timings), 3)
+
+
+@tag("benchmark")
+class TestLevelOrderedQueues(TestCase):
+    """
+    Compares fetching the lesson and review queues of a level 60 user who
+    orders them by level, when ordered by the vocabulary's own level against
+    ordering through its readings. Timings and plans are written as JSON to the
+    path in KW_BENCHMARK_LEVEL_ORDER_REPORT, if it is set.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        data = seed_benchmark_data()
+        cls.user = data["users"][0]
+        cls.user.profile.order_reviews_by_level = True
+        cls.user.profile.save()
+        # Plenty of vocabulary has more than one reading.
+        Reading.objects.bulk_create(
+            [
+                Reading(
+                    vocabulary_id=reading.vocabulary_id,
+                    character=reading.character,
+                    kana=f"{reading.kana}2",
+                    level=reading.level,
+                )
+                for reading in Reading.objects.all()[::4]
+            ]
+        )
+        with connection.cursor() as cursor:
+            for model in (UserSpecific, Reading):
+                cursor.execute(f"ANALYZE {model._meta.db_table}")
+
+    def _queues(self):
+        return [
+            ("lessons", get_users_lessons(self.user)),
+            ("current-reviews", get_users_current_reviews(self.user)),
+        ]
+
+    def test_level_ordered_queues_do_not_join_through_readings(self):
+        report = OrderedDict()
+        for name, queryset in self._queues():
+            through_readings = queryset.order_by("vocabulary__readings__level")
+            ids = list(queryset.values_list("id", flat=True))
+            report[name] = OrderedDict(
+                rows=len(ids),
+                rows_through_readings=len(through_readings.values_list("id")),
+                ms=fetch_latency(queryset),
+                ms_through_readings=fetch_latency(through_readings),
+                total_cost=explain(queryset)["Plan"]["Total Cost"],
+                total_cost_through_readings=explain(through_readings)["Plan"][
+                    "Total Cost"
+                ],
+            )
+            with self.subTest(queue=name):
+                self.assertEqual(len(ids), len(set(ids)))
+                self.assertNotIn(Reading._meta.db_table, str(queryset.query))
+                self.assertLessEqual(
+                    report[name]["total_cost"],
+                    report[name]["total_cost_through_readings"],
+                )
+
+        report_path = os.environ.get("KW_BENCHMARK_LEVEL_ORDER_REPORT")
+        if report_path:
+            with open(report_path, "w") as f:
+                json.dump(
+                    {"scale": get_benchmark_scale(), "queues": report},
+                    f,
+                    indent=2,
+                )
@@ -0,0 +1,159 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from copy import deepcopy
+
+import responses
+from django.db import connection
+from django.test import TestCase, tag
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from api.sync.WanikaniUserSyncerV2 import WanikaniUserSyncerV2
+from kw_webapp import constants
+from kw_webapp.counters import find_review_counter_drift
+from kw_webapp.models import UserSpecific, Vocabulary
+from kw_webapp.tasks import unlock_all_possible_levels_for_user
+from kw_webapp.tests import sample_api_responses_v2
+from kw_webapp.tests.benchmarks.fixtures import (
+    BENCHMARK_VOCABULARY_PER_LEVEL,
+    get_benchmark_scale,
+)
+from kw_webapp.tests.utils import (
+    build_assignments_url,
+    create_profile,
+    create_user,
+)
+
+# Unlocking is set-based, so its queries must not grow with the number of
+# levels or vocabulary.
+UNLOCK_QUERY_BUDGET = 10
+
+
+def build_assignments_response(vocabulary):
+    """
+    A single page of assignments for the vocabulary, of which every tenth has
+    not been started yet.
+    """
+    response = deepcopy(sample_api_responses_v2.no_assignments)
+    template = sample_api_responses_v2.single_assignment["data"][0]
+    for index, vocab in enumerate(vocabulary):
+        assignment = deepcopy(template)
+        assignment["id"] = index
+        assignment["data"]["subject_id"] = vocab.wk_subject_id
+        if index % 10 == 9:
+            assignment["data"]["started_at"] = None
+        response["data"].append(assignment)
+    response["total_count"] = len(vocabulary)
+    return response
+
+
+@tag("benchmark")
+class TestLevelUnlock(TestCase):
+    """
+    Unlocks all 60 levels for a new level 60 user, who already has the reviews
+    of their first levels. Timings and query counts are written as JSON to the
+    path in KW_BENCHMARK_LEVEL_UNLOCK_REPORT, if it is set.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        vocabulary_per_level = max(
+            1, int(BENCHMARK_VOCABULARY_PER_LEVEL * get_benchmark_scale())
+        )
+        cls.vocabulary = Vocabulary.objects.bulk_create(
+            [
+                Vocabulary(
+                    meaning=f"meaning {level}-{index}",
+                    wk_subject_id=level * 10000 + index,
+                    level=level,
+                )
+                for level in range(
+                    constants.LEVEL_MIN, constants.LEVEL_MAX + 1
+                )
+                for index in range(vocabulary_per_level)
+            ]
+        )
+        cls.user = create_user("unlocker")
+        create_profile(cls.user, "any_key", constants.LEVEL_MAX)
+        cls.existing_vocabulary = [
+            vocab for vocab in cls.vocabulary if vocab.level <= 3
+        ]
+        UserSpecific.objects.bulk_create(
+            [
+                UserSpecific(user=cls.user, vocabulary=vocab)
+                for vocab in cls.existing_vocabulary
+            ]
+        )
+
+    @responses.activate
+    def test_unlocking_every_level_takes_a_constant_number_of_queries(self):
+        responses.add(
+            responses.GET,
+            build_assignments_url(),
+            json=build_assignments_response(self.vocabulary),
+            status=200,
+            content_type="application/json",
+        )
+
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            (
+                levels,
+                unlocked_now,
+                unlocked_total,
+                locked,
+            ) = unlock_all_possible_levels_for_user(self.user)
+        elapsed_ms = round((time.perf_counter() - start) * 1000, 3)
+
+        started = [
+            vocab
+            for index, vocab in enumerate(self.vocabulary)
+            if index % 10 != 9
+        ]
+        started_existing = set(started) & set(self.existing_vocabulary)
+        self.assertEqual(len(levels), constants.LEVEL_MAX)
+        self.assertEqual(unlocked_total, len(started))
+        self.assertEqual(unlocked_now, len(started) - len(started_existing))
+        self.assertEqual(locked, len(self.vocabulary) - len(started))
+        self.assertLessEqual(len(queries), UNLOCK_QUERY_BUDGET)
+
+        reviews = UserSpecific.objects.filter(user=self.user)
+        self.assertEqual(
+            reviews.count(), len(self.existing_vocabulary) + unlocked_now
+        )
+        new_reviews = reviews.exclude(vocabulary__in=self.existing_vocabulary)
+        self.assertFalse(new_reviews.filter(needs_review=False).exists())
+        self.assertFalse(
+            new_reviews.filter(next_review_date__gt=timezone.now()).exists()
+        )
+        self.assertEqual(find_review_counter_drift(self.user), {})
+
+        # Unlocking again finds nothing to create, and nothing out of date.
+        with CaptureQueriesContext(connection) as repeat_queries:
+            _, unlocked_again, _, _ = unlock_all_possible_levels_for_user(
+                self.user
+            )
+        self.assertEqual(unlocked_again, 0)
+
+        report_path = os.environ.get("KW_BENCHMARK_LEVEL_UNLOCK_REPORT")
+        if report_path:
+            with open(report_path, "w") as f:
+                json.dump(
+                    {
+                        "scale": get_benchmark_scale(),
+                        "unlock": OrderedDict(
+                            levels=len(levels),
+                            assignments=len(self.vocabulary),
+                            unlocked_now=unlocked_now,
+                            unlocked_total=unlocked_total,
+                            locked=locked,
+                            ms=elapsed_ms,
+                            queries=len(queries),
+                            repeat_queries=len(repeat_queries),
+                        ),
+                    },
+                    f,
+                    indent=2,
+                )
@@ -0,0 +1,101 @@
+import json
+import os
+from collections import OrderedDict
+
+from django.db import connection
+from django.test import TestCase, tag
+
+from api.filters import filter_user_meaning_contains, whole_word_regex
+from kw_webapp.models import MeaningSynonym, UserSpecific, Vocabulary
+from kw_webapp.tests.benchmarks.fixtures import (
+    get_benchmark_scale,
+    seed_benchmark_data,
+)
+from kw_webapp.tests.benchmarks.test_index_plans import explain, summarize
+
+MEANING_SEARCH_INDEXES = {
+    "kw_vocab_meaning_search_idx",
+    "kw_synonym_text_search_idx",
+}
+
+
+@tag("benchmark")
+class TestMeaningSearchPlans(TestCase):
+    """
+    Compares searching vocabulary by meaning and by the user's meaning synonyms
+    through the full text search indexes, against the word boundary regexes
+    used before. Plans and timings are written as JSON to the path in
+    KW_BENCHMARK_MEANING_SEARCH_REPORT, if it is set.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        data = seed_benchmark_data()
+        cls.user = data["users"][0]
+        vocabulary = list(Vocabulary.objects.order_by("id")[::500])
+        for vocab in vocabulary:
+            vocab.meaning = f"radioactive bat, {vocab.meaning}"
+        Vocabulary.objects.bulk_update(vocabulary, ["meaning"])
+        review = (
+            UserSpecific.objects.filter(user=cls.user).order_by("id").last()
+        )
+        MeaningSynonym.objects.create(
+            review=review, text="glowing radioactive bat"
+        )
+        cls.synonym_vocabulary_id = review.vocabulary_id
+        cls.expected_ids = {vocab.id for vocab in vocabulary} | {
+            review.vocabulary_id
+        }
+        with connection.cursor() as cursor:
+            for model in (Vocabulary, MeaningSynonym):
+                cursor.execute(f"ANALYZE {model._meta.db_table}")
+
+    def _regex_search(self, value):
+        synonyms_vocab_ids = UserSpecific.objects.filter(
+            user=self.user,
+            meaning_synonyms__text__iregex=whole_word_regex(value),
+        ).values_list("vocabulary", flat=True)
+        return Vocabulary.objects.filter(
+            meaning__iregex=whole_word_regex(value)
+        ) | Vocabulary.objects.filter(id__in=list(synonyms_vocab_ids))
+
+    def test_meaning_search_is_served_by_the_search_indexes(self):
+        searched = filter_user_meaning_contains(
+            "radioactive bat", self.user.id
+        )
+        regex_searched = self._regex_search("radioactive bat")
+
+        self.assertEqual({vocab.id for vocab in searched}, self.expected_ids)
+        self.assertEqual(
+            {vocab.id for vocab in regex_searched}, self.expected_ids
+        )
+        # The vocabulary only found through the user's synonym ranks last.
+        self.assertEqual(list(searched)[-1].id, self.synonym_vocabulary_id)
+
+        plan = explain(searched)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT indexname FROM pg_indexes WHERE indexname = ANY(%s)",
+                [sorted(MEANING_SEARCH_INDEXES)],
+            )
+            self.assertEqual(
+                {row[0] for row in cursor.fetchall()}, MEANING_SEARCH_INDEXES
+            )
+        self.assertIn(
+            "kw_vocab_meaning_search_idx", summarize(plan)["indexes"]
+        )
+
+        report_path = os.environ.get("KW_BENCHMARK_MEANING_SEARCH_REPORT")
+        if report_path:
+            with open(report_path, "w") as f:
+                json.dump(
+                    {
+                        "scale": get_benchmark_scale(),
+                        "search": OrderedDict(
+                            full_text=summarize(plan),
+                            regex=summarize(explain(regex_searched)),
+                        ),
+                    },
+                    f,
+                    indent=2,
+                )
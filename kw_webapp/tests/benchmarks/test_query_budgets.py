@@ -0,0 +1,264 @@
+import json
+import os
+import time
+from collections import OrderedDict
+
+from django.db import connection
+from django.test import tag
+from django.test.utils import CaptureQueriesContext
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from kw_webapp.models import Report
+from kw_webapp.tests.benchmarks.fixtures import (
+    get_benchmark_scale,
+    seed_benchmark_data,
+)
+
+DEFAULT_BUDGETS_PATH = os.path.join(os.path.dirname(__file__), "budgets.json")
+
+
+def load_budgets():
+    """
+    Budgets are read from budgets.json next to this file, or from the path in
+    KW_BENCHMARK_BUDGETS. Each endpoint maps to a dict with a `queries` limit,
+    and optionally a `seconds` limit.
+    """
+    with open(
+        os.environ.get("KW_BENCHMARK_BUDGETS", DEFAULT_BUDGETS_PATH)
+    ) as f:
+        return json.load(f)
+
+
+def write_report(results):
+    """
+    Writes the measurements as JSON to the path in KW_BENCHMARK_REPORT, if it
+    is set, so that runs can be diffed between commits.
+    """
+    report_path = os.environ.get("KW_BENCHMARK_REPORT")
+    if not report_path:
+        return
+    with open(report_path, "w") as f:
+        json.dump(
+            {"scale": get_benchmark_scale(), "endpoints": results},
+            f,
+            indent=2,
+            sort_keys=True,
+        )
+
+
+@tag("benchmark")
+class TestQueryBudgets(APITestCase):
+    """
+    Exercises every router endpoint against a realistic volume of data, and
+    fails if any of them exceeds its query budget.
+
+    Not exercised, since they call out to Wanikani or send email: level unlock,
+    user sync, user reset and contact.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        data = seed_benchmark_data()
+        cls.user = data["users"][0]
+        cls.user.is_staff = True
+        cls.user.save()
+        cls.vocabulary = data["vocabulary"]
+        cls.reading = cls.vocabulary.readings.first()
+        cls.due_review_ids = data["due_review_ids"]
+        cls.report = Report.objects.filter(created_by=cls.user).first()
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.user)
+
+    def _endpoints(self):
+        """
+        :return: A list of (name, method, url, payload). Read-only endpoints
+        come first, then the ones which modify data, with locking a level last
+        as it removes reviews.
+        """
+        due = self.due_review_ids
+        return [
+            ("review-list", "get", reverse("api:review-list"), None),
+            (
+                "review-detail",
+                "get",
+                reverse("api:review-detail", args=(due[-1],)),
+                None,
+            ),
+            ("review-lesson", "get", reverse("api:review-lesson"), None),
+            ("review-current", "get", reverse("api:review-current"), None),
+            ("review-critical", "get", reverse("api:review-critical"), None),
+            ("review-counts", "get", reverse("api:review-counts"), None),
+            ("profile-list", "get", reverse("api:profile-list"), None),
+            (
+                "profile-detail",
+                "get",
+                reverse("api:profile-detail", args=(self.user.profile.id,)),
+                None,
+            ),
+            ("vocabulary-list", "get", reverse("api:vocabulary-list"), None),
+            (
+                "vocabulary-list-hyperlinked",
+                "get",
+                reverse("api:vocabulary-list") + "?hyperlink=true",
+                None,
+            ),
+            (
+                "vocabulary-list-by-level",
+                "get",
+                reverse("api:vocabulary-list") + "?level=5",
+                None,
+            ),
+            (
+                "vocabulary-list-meaning-contains",
+                "get",
+                reverse("api:vocabulary-list") + "?meaning_contains=meaning",
+                None,
+            ),
+            (
+                "vocabulary-detail",
+                "get",
+                reverse("api:vocabulary-detail", args=(self.vocabulary.id,)),
+                None,
+            ),
+            ("report-list", "get", reverse("api:report-list"), None),
+            (
+                "report-detail",
+                "get",
+                reverse("api:report-detail", args=(self.report.id,)),
+                None,
+            ),
+            ("report-counts", "get", reverse("api:report-counts"), None),
+            ("reading-list", "get", reverse("api:reading-list"), None),
+            (
+                "reading-detail",
+                "get",
+                reverse("api:reading-detail", args=(self.reading.id,)),
+                None,
+            ),
+            ("level-list", "get", reverse("api:level-list"), None),
+            (
+                "level-detail",
+                "get",
+                reverse("api:level-detail", args=(5,)),
+                None,
+            ),
+            (
+                "reading-synonym-list",
+                "get",
+                reverse("api:reading-synonym-list"),
+                None,
+            ),
+            (
+                "meaning-synonym-list",
+                "get",
+                reverse("api:meaning-synonym-list"),
+                None,
+            ),
+            ("faq-list", "get", reverse("api:faq-list"), None),
+            (
+                "announcement-list",
+                "get",
+                reverse("api:announcement-list"),
+                None,
+            ),
+            ("user-list", "get", reverse("api:user-list"), None),
+            ("user-me", "get", reverse("api:user-me"), None),
+            (
+                "review-correct",
+                "post",
+                reverse("api:review-correct", args=(due[0],)),
+                {"wrong_before": False},
+            ),
+            (
+                "review-incorrect",
+                "post",
+                reverse("api:review-incorrect", args=(due[1],)),
+                None,
+            ),
+            (
+                "review-answers",
+                "post",
+                reverse("api:review-answers"),
+                [
+                    {"id": review_id, "correct": True, "wrong_before": False}
+                    for review_id in due[2:52]
+                ],
+            ),
+            (
+                "review-hide",
+                "post",
+                reverse("api:review-hide", args=(due[52],)),
+                None,
+            ),
+            (
+                "review-unhide",
+                "post",
+                reverse("api:review-unhide", args=(due[52],)),
+                None,
+            ),
+            (
+                "review-reset",
+                "post",
+                reverse("api:review-reset", args=(due[53],)),
+                None,
+            ),
+            (
+                "meaning-synonym-create",
+                "post",
+                reverse("api:meaning-synonym-list"),
+                {"review": due[54], "text": "benchmark synonym"},
+            ),
+            (
+                "report-create",
+                "post",
+                reverse("api:report-list"),
+                {"reading": self.reading.id, "reason": "Benchmark"},
+            ),
+            ("user-srs", "post", reverse("api:user-srs"), None),
+            ("level-lock", "post", reverse("api:level-lock", args=(1,)), None),
+        ]
+
+    def _measure(self, method, url, payload):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = getattr(self.client, method)(
+                url, payload, format="json"
+            )
+            seconds = time.perf_counter() - start
+        return OrderedDict(
+            status=response.status_code,
+            queries=len(queries),
+            seconds=round(seconds, 4),
+            bytes=len(response.content),
+        )
+
+    def test_endpoints_stay_within_their_budgets(self):
+        budgets = load_budgets()
+        results = OrderedDict()
+        try:
+            for name, method, url, payload in self._endpoints():
+                with self.subTest(endpoint=name):
+                    result = results[name] = self._measure(
+                        method, url, payload
+                    )
+                    self.assertLess(result["status"], 400)
+
+                    budget = budgets.get(name)
+                    self.assertIsNotNone(
+                        budget,
+                        f"There is no budget for {name} in budgets.json",
+                    )
+                    self.assertLessEqual(
+                        result["queries"],
+                        budget["queries"],
+                        f"{name} ran {result['queries']} queries, over its "
+                        f"budget of {budget['queries']}",
+                    )
+                    if "seconds" in budget:
+                        self.assertLessEqual(
+                            result["seconds"], budget["seconds"]
+                        )
+        finally:
+            write_report(results)
@@ -12,6 +12,7 @@ from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
 
 from kw_webapp import constants
+from kw_webapp.counters import get_review_counts
 from kw_webapp.models import MeaningSynonym, UserSpecific, Profile, Tag
 from kw_webapp.tests import sample_api_responses_v2
 from kw_webapp.tests.utils import (
@@ -454,3 +455,41 @@ class TestModels(APITestCase):
 
         self.assertEqual(self.review.streak, enlightened_level)
         self.assertFalse(self.review.burned)
+
+    def test_answering_correctly_issues_a_single_update(self):
+        get_review_counts(self.user)
+        # One UPDATE for the review, one for its review counter bucket.
+        with self.assertNumQueries(2):
+            self.review.answered_correctly(first_try=True, can_burn=True)
+
+        self.review.refresh_from_db()
+        self.assertEqual(self.review.streak, 2)
+        self.assertFalse(self.review.needs_review)
+        self.assertEqual(self.review.next_review_date.minute, 0)
+
+    def test_answering_incorrectly_issues_a_single_update(self):
+        with self.assertNumQueries(1):
+            self.review.answered_incorrectly()
+
+        self.review.refresh_from_db()
+        self.assertEqual(self.review.incorrect, 1)
+
+    def test_criticality_is_persisted_when_answered_incorrectly(self):
+        self.review.correct = 1
+        self.review.incorrect = 2
+        self.review.save()
+
+        self.review.answered_incorrectly()
+        self.review.refresh_from_db()
+
+        self.assertTrue(self.review.critical)
+
+    def test_applying_an_answer_only_reports_the_fields_it_writes(self):
+        self.review.streak = 3
+        self.review.save()
+
+        changed_fields = self.review.apply_incorrect_answer()
+
+        self.assertCountEqual(
+            changed_fields, ["incorrect", "streak", "critical"]
+        )
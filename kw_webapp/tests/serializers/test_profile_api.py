@@ -1,3 +1,4 @@
+import uuid
 from datetime import timedelta, time
 from time import sleep
 
@@ -6,6 +7,7 @@ from django.utils import timezone
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
 
+from api.serializers import RegistrationSerializer
 from kw_webapp import constants
 from kw_webapp.models import Announcement, Vocabulary
 from kw_webapp.tasks import get_vocab_by_kanji, sync_with_wk
@@ -294,7 +296,10 @@ class TestProfileApi(APITestCase):
 
         response = self.client.put(
             reverse("api:profile-detail", args=(self.user.profile.id,)),
-            data=self.skip_nones(self.user.profile.__dict__),
+            data=dict(
+                self.skip_nones(self.user.profile.__dict__),
+                api_key_v2=invalid_api_key,
+            ),
         )
         self.assertEqual(response.status_code, 400)
 
@@ -323,6 +328,49 @@ class TestProfileApi(APITestCase):
 
         self.assertTrue(response.data["api_valid"])
 
+    @responses.activate
+    def test_api_key_is_only_checked_with_wanikani_when_it_changes(self):
+        self.client.force_login(self.user)
+        mock_user_response_v2()
+        url = reverse("api:profile-detail", args=(self.user.profile.id,))
+
+        self.client.patch(
+            url, data={"api_key_v2": self.user.profile.api_key_v2}
+        )
+        self.assertEqual(len(responses.calls), 0)
+
+        # A second profile switching to the same key is served from the
+        # validation cache.
+        new_api_key = str(uuid.uuid4())
+        self.client.patch(url, data={"api_key_v2": new_api_key})
+        self.client.force_login(self.admin)
+        self.client.patch(
+            reverse("api:profile-detail", args=(self.admin.profile.id,)),
+            data={"api_key_v2": new_api_key},
+        )
+        self.assertEqual(len(responses.calls), 1)
+        self.admin.profile.refresh_from_db()
+        self.assertEqual(self.admin.profile.api_key_v2, new_api_key)
+
+    @responses.activate
+    def test_registration_seeds_profile_from_the_validated_wanikani_user(self):
+        mock_user_response_v2()
+        serializer = RegistrationSerializer(
+            data={
+                "username": "seedme",
+                "password": "password",
+                "api_key_v2": str(uuid.uuid4()),
+                "email": "seed@email.com",
+            }
+        )
+        self.assertTrue(serializer.is_valid())
+
+        user = serializer.save()
+
+        self.assertEqual(user.profile.level, 12)
+        self.assertEqual(user.profile.join_date.year, 2013)
+        self.assertEqual(len(responses.calls), 1)
+
     def test_searching_based_on_reading_returns_distinct_responses(self):
         reading_to_search = "eyylmao"
         v = create_vocab("vocabulary with 2 readings.")
@@ -0,0 +1,165 @@
+from io import StringIO
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from kw_webapp.counters import (
+    find_review_counter_drift,
+    get_review_counts,
+    rebuild_review_counters,
+)
+from kw_webapp.models import ReviewCounter, UserSpecific
+from kw_webapp.srs import all_srs, apply_review_answers
+from kw_webapp.tasks import (
+    get_users_current_reviews,
+    get_users_lessons,
+    lock_level_for_user,
+    repair_review_counters,
+)
+from kw_webapp.tests.utils import (
+    create_lesson,
+    create_profile,
+    create_reading,
+    create_review,
+    create_user,
+    create_vocab,
+)
+
+
+class TestReviewCounters(TestCase):
+    def setUp(self):
+        self.user = create_user("Tadgh")
+        create_profile(self.user, "any_key", 5)
+        self.vocabulary = create_vocab("radioactive bat")
+        self.reading = create_reading(self.vocabulary, "ねこ", "猫", 5)
+        self.review = create_review(self.vocabulary, self.user)
+        self.lesson = create_lesson(create_vocab("lesson"), self.user)
+
+    def assertCountsMatchQueries(self):
+        counts = get_review_counts(self.user)
+        self.assertEqual(
+            counts["reviews"], get_users_current_reviews(self.user).count()
+        )
+        self.assertEqual(
+            counts["lessons"], get_users_lessons(self.user).count()
+        )
+        self.assertEqual(find_review_counter_drift(self.user), {})
+        return counts
+
+    def test_counters_are_built_on_first_read(self):
+        self.assertFalse(ReviewCounter.objects.filter(user=self.user).exists())
+
+        counts = self.assertCountsMatchQueries()
+
+        self.assertEqual(counts["reviews"], 1)
+        self.assertEqual(counts["lessons"], 1)
+        self.assertEqual(counts["apprentice"], 1)
+        self.assertEqual(counts["untrained"], 1)
+
+    def test_answering_a_review_updates_counters(self):
+        get_review_counts(self.user)
+
+        self.review.answered_correctly(first_try=True, can_burn=True)
+
+        counts = self.assertCountsMatchQueries()
+        self.assertEqual(counts["reviews"], 0)
+        self.assertEqual(counts["apprentice"], 1)
+
+    def test_batch_answers_update_counters(self):
+        get_review_counts(self.user)
+
+        apply_review_answers(
+            self.user,
+            [
+                {
+                    "id": self.review.id,
+                    "correct": False,
+                    "wrong_before": False,
+                },
+                {"id": self.review.id, "correct": True, "wrong_before": True},
+            ],
+        )
+
+        counts = self.assertCountsMatchQueries()
+        self.assertEqual(counts["reviews"], 0)
+
+    def test_hiding_a_review_updates_counters(self):
+        get_review_counts(self.user)
+
+        self.review.hidden = True
+        self.review.save()
+
+        counts = self.assertCountsMatchQueries()
+        self.assertEqual(counts["reviews"], 0)
+        self.assertEqual(counts["apprentice"], 0)
+
+    def test_locking_a_level_updates_counters(self):
+        get_review_counts(self.user)
+
+        lock_level_for_user(5, self.user)
+
+        counts = self.assertCountsMatchQueries()
+        self.assertEqual(counts["reviews"], 0)
+        self.assertEqual(counts["lessons"], 1)
+
+    def test_srs_run_updates_counters(self):
+        self.review.needs_review = False
+        self.review.next_review_date = timezone.now() - timedelta(hours=1)
+        self.review.save()
+        self.assertEqual(get_review_counts(self.user)["reviews"], 0)
+
+        all_srs()
+
+        counts = self.assertCountsMatchQueries()
+        self.assertEqual(counts["reviews"], 1)
+
+    def test_counters_respect_wanikani_srs_review_range(self):
+        self.review.wanikani_srs_numeric = 9
+        self.review.save()
+        self.user.profile.maximum_wk_srs_level_to_review = "GURU"
+        self.user.profile.save()
+
+        counts = self.assertCountsMatchQueries()
+
+        self.assertEqual(counts["reviews"], 0)
+
+    def test_drift_is_detected_and_repaired(self):
+        get_review_counts(self.user)
+        # Writes through update() bypass the counters entirely.
+        UserSpecific.objects.filter(id=self.review.id).update(critical=True)
+
+        self.assertEqual(
+            find_review_counter_drift(self.user),
+            {0: {"critical": (0, 1)}},
+        )
+
+        out = StringIO()
+        call_command("verify_review_counters", "--repair", stdout=out)
+
+        self.assertIn("1 user(s) with drifted counters.", out.getvalue())
+        self.assertEqual(find_review_counter_drift(self.user), {})
+        self.assertEqual(get_review_counts(self.user)["critical"], 1)
+
+    def test_racing_saves_of_a_review_are_repaired_by_the_periodic_task(self):
+        get_review_counts(self.user)
+        first_tab = UserSpecific.objects.get(id=self.review.id)
+        second_tab = UserSpecific.objects.get(id=self.review.id)
+        # Both tabs count the review as leaving the review queue.
+        for review in (first_tab, second_tab):
+            review.needs_review = False
+            review.save()
+        self.assertNotEqual(find_review_counter_drift(self.user), {})
+
+        self.assertEqual(repair_review_counters(), 1)
+
+        self.assertEqual(find_review_counter_drift(self.user), {})
+        self.assertEqual(repair_review_counters(), 0)
+
+    def test_rebuilding_counters_creates_a_row_per_wanikani_srs_level(self):
+        rebuild_review_counters(self.user)
+
+        self.assertEqual(
+            ReviewCounter.objects.filter(user=self.user).count(), 10
+        )
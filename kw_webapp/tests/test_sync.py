@@ -3,12 +3,17 @@ from copy import deepcopy
 
 import responses
 import time
+from unittest import mock
 from django.test import TestCase
 from django.utils import timezone
+from wanikani_api.models import Assignment, StudyMaterial
+from wanikani_api.models import Vocabulary as WkVocabulary
 
+from api.sync.CatalogueImporter import CatalogueImporter
 from api.sync.SyncerFactory import Syncer
 from api.sync.WanikaniUserSyncerV2 import WanikaniUserSyncerV2
 from kw_webapp import constants
+from kw_webapp.counters import find_review_counter_drift, get_review_counts
 from kw_webapp.models import Vocabulary, UserSpecific
 from kw_webapp.srs import all_srs
 from kw_webapp.tasks import (
@@ -17,8 +22,11 @@ from kw_webapp.tasks import (
     get_users_future_reviews,
     sync_all_users_to_wk,
     sync_with_wk,
-    get_users_current_reviews, get_users_lessons,
+    get_users_current_reviews,
+    get_users_lessons,
+    start_following_wanikani,
 )
+from kw_webapp.tests import sample_api_responses_v2
 from kw_webapp.tests.utils import (
     create_review,
     create_vocab,
@@ -237,7 +245,137 @@ class TestSync(TestCase):
         assert reviews.count() == 1
 
     @responses.activate
-    def test_users_not_following_wanikani_still_get_vocab_unlocked_when_they_unlock_a_level(self):
+    def test_full_sync_only_fetches_records_updated_since_the_last_sync(self):
+        mock_user_response_v2()
+        mock_assignments_with_one_assignment()
+        mock_study_materials()
+        mock_subjects_v2()
+
+        syncer = WanikaniUserSyncerV2(self.user.profile)
+        syncer.sync_with_wk(full_sync=True)
+
+        self.user.profile.refresh_from_db()
+        self.assertEqual(
+            self.user.profile.assignments_updated_after.isoformat(),
+            "2018-09-09T23:25:30.518490+00:00",
+        )
+        self.assertEqual(
+            self.user.profile.study_materials_updated_after.isoformat(),
+            "2017-06-01T19:01:36.573350+00:00",
+        )
+        first_sync_urls = [call.request.url for call in responses.calls]
+        self.assertFalse(
+            any("updated_after" in url for url in first_sync_urls)
+        )
+
+        responses.calls.reset()
+        syncer.sync_with_wk(full_sync=True)
+
+        urls = [call.request.url for call in responses.calls]
+        self.assertTrue(
+            any(
+                "/assignments" in url
+                and "updated_after=2018-09-09T23:25:30.518490" in url
+                for url in urls
+            )
+        )
+        self.assertTrue(
+            any(
+                "/study_materials" in url
+                and "updated_after=2017-06-01T19:01:36.573350" in url
+                for url in urls
+            )
+        )
+
+        responses.calls.reset()
+        syncer.sync_with_wk(full_sync=True, resync=True)
+
+        urls = [call.request.url for call in responses.calls]
+        self.assertFalse(any("updated_after" in url for url in urls))
+        self.user.profile.refresh_from_db()
+        self.assertIsNotNone(self.user.profile.assignments_updated_after)
+
+    @responses.activate
+    def test_relocking_and_unlocking_a_level_restores_study_materials(self):
+        mock_assignments_with_one_assignment()
+        mock_study_materials()
+        syncer = WanikaniUserSyncerV2(self.user.profile)
+        syncer.sync_study_materials()
+        self.assertIsNotNone(self.user.profile.study_materials_updated_after)
+
+        UserSpecific.objects.filter(user=self.user).delete()
+        syncer.unlock_vocab([1])
+        self.user.profile.refresh_from_db()
+        self.assertIsNone(self.user.profile.study_materials_updated_after)
+
+        responses.calls.reset()
+        syncer.sync_study_materials()
+        self.assertFalse(
+            any(
+                "updated_after" in call.request.url for call in responses.calls
+            )
+        )
+        review = UserSpecific.objects.get(user=self.user)
+        self.assertIn("young lady", review.synonyms_list())
+
+    @responses.activate
+    def test_assignment_cursor_only_advances_past_applied_assignments(self):
+        mock_assignments_with_one_assignment()
+        syncer = WanikaniUserSyncerV2(self.user.profile)
+
+        self.user.profile.follow_me = False
+        syncer.sync_unlocked_vocab()
+        self.assertIsNone(self.user.profile.assignments_updated_after)
+
+        # The subject is missing from the catalogue.
+        self.user.profile.follow_me = True
+        self.v.wk_subject_id = 2
+        self.v.save()
+        syncer.sync_unlocked_vocab()
+        self.assertIsNone(self.user.profile.assignments_updated_after)
+
+        self.v.wk_subject_id = 1
+        self.v.save()
+        syncer.sync_unlocked_vocab()
+        self.assertIsNotNone(self.user.profile.assignments_updated_after)
+
+    @responses.activate
+    def test_following_wanikani_again_resets_sync_cursors(self):
+        mock_user_response_v2()
+        mock_assignments_with_one_assignment()
+        self.user.profile.assignments_updated_after = timezone.now()
+        self.user.profile.study_materials_updated_after = timezone.now()
+        self.user.profile.save()
+
+        start_following_wanikani(self.user)
+
+        self.user.profile.refresh_from_db()
+        self.assertIsNone(self.user.profile.assignments_updated_after)
+        self.assertIsNone(self.user.profile.study_materials_updated_after)
+
+    @responses.activate
+    def test_catalogue_sync_which_adds_subjects_resets_assignment_cursors(
+        self,
+    ):
+        mock_subjects_v2()
+        self.user.profile.assignments_updated_after = timezone.now()
+        self.user.profile.save()
+        syncer = WanikaniUserSyncerV2(self.user.profile)
+
+        syncer.sync_top_level_vocabulary()
+        self.user.profile.refresh_from_db()
+        self.assertIsNotNone(self.user.profile.assignments_updated_after)
+
+        self.v.wk_subject_id = 2
+        self.v.save()
+        syncer.sync_top_level_vocabulary()
+        self.user.profile.refresh_from_db()
+        self.assertIsNone(self.user.profile.assignments_updated_after)
+
+    @responses.activate
+    def test_users_not_following_wanikani_still_get_vocab_unlocked_when_they_unlock_a_level(
+        self,
+    ):
         mock_user_response_v2()
         mock_assignments_with_one_assignment()
         mock_study_materials()
@@ -329,9 +467,207 @@ class TestSync(TestCase):
         assert "ねこ" not in stored_reading_kanas
         assert "one - but in japanese" in stored_reading_kanas
 
+    def _build_subject(self, subject_id, readings, parts_of_speech):
+        subject_json = deepcopy(sample_api_responses_v2.subjects_v2["data"][0])
+        subject_json["id"] = subject_id
+        subject_json["data"]["readings"] = [
+            {"primary": False, "reading": reading, "accepted_answer": True}
+            for reading in readings
+        ]
+        subject_json["data"]["parts_of_speech"] = parts_of_speech
+        return WkVocabulary(subject_json, client=None)
+
+    def test_catalogue_import_applies_the_diff_in_bulk(self):
+        self.v.parts_of_speech.create(part="noun")
+        subjects = [
+            self._build_subject(1, ["いち", "ねこ"], ["numeral"]),
+            self._build_subject(2, ["に"], ["numeral", "noun"]),
+        ]
+
+        with self.assertNumQueries(17):
+            changes = CatalogueImporter().import_subjects(subjects)
+
+        self.assertEqual(changes["created"]["vocabulary"], 1)
+        self.assertEqual(changes["updated"]["vocabulary"], 1)
+        # The old reading's character no longer matches, so it is replaced.
+        self.assertEqual(changes["deleted"]["readings"], 1)
+        self.assertEqual(changes["created"]["readings"], 3)
+        self.assertEqual(changes["deleted"]["parts_of_speech"], 1)
+        self.assertEqual(changes["created"]["parts_of_speech"], 3)
+
+        self.v.refresh_from_db()
+        self.assertEqual(self.v.meaning, "One")
+        self.assertEqual(self.v.level, 1)
+        self.assertListEqual(
+            sorted(self.v.readings.values_list("kana", "character")),
+            [("いち", "一"), ("ねこ", "一")],
+        )
+        self.assertListEqual(
+            list(self.v.parts_of_speech.values_list("part", flat=True)),
+            ["numeral"],
+        )
+        new_vocabulary = Vocabulary.objects.get(wk_subject_id=2)
+        self.assertListEqual(
+            sorted(
+                new_vocabulary.parts_of_speech.values_list("part", flat=True)
+            ),
+            ["noun", "numeral"],
+        )
+
+        # Nothing is out of date any more.
+        changes = CatalogueImporter().import_subjects(subjects)
+        self.assertEqual(
+            sum(sum(counts.values()) for counts in changes.values()), 0
+        )
+
     def test_syncer_factory(self):
         # now for v2
         self.user.profile.api_key_v2 = "no longer empty!"
         self.user.profile.save()
         syncer = Syncer.factory(self.user.profile)
         assert isinstance(syncer, WanikaniUserSyncerV2)
+
+    def _build_assignment(self, subject_id, srs_stage, started=True):
+        assignment_json = deepcopy(
+            sample_api_responses_v2.single_assignment["data"][0]
+        )
+        assignment_json["data"]["subject_id"] = subject_id
+        assignment_json["data"]["srs_stage"] = srs_stage
+        if not started:
+            assignment_json["data"]["started_at"] = None
+        return Assignment(assignment_json, client=None)
+
+    def test_bulk_reconciliation_creates_missing_and_updates_out_of_date_reviews(
+        self,
+    ):
+        new_vocabulary = [create_vocab(f"new {i}") for i in range(5)]
+        for i, vocabulary in enumerate(new_vocabulary):
+            vocabulary.wk_subject_id = 100 + i
+            vocabulary.save()
+        assignments = [self._build_assignment(1, 7)]
+        assignments += [
+            self._build_assignment(vocabulary.wk_subject_id, 2)
+            for vocabulary in new_vocabulary
+        ]
+        assignments += [
+            self._build_assignment(999, 1),
+            self._build_assignment(1000, 0, started=False),
+        ]
+        syncer = WanikaniUserSyncerV2(self.user.profile)
+        get_review_counts(self.user)
+
+        # The savepoint and lock on the profile, subjects, existing reviews,
+        # one bulk insert and the ids it created, one bulk update, plus one
+        # UPDATE for each of the three review counter buckets which changed.
+        with self.assertNumQueries(11):
+            (
+                new_review_count,
+                unlocked_count,
+                locked_count,
+            ) = syncer.bulk_reconcile_assignments(assignments)
+
+        self.assertEqual(
+            (new_review_count, unlocked_count, locked_count), (5, 6, 1)
+        )
+        self.review.refresh_from_db()
+        self.assertEqual(self.review.wanikani_srs_numeric, 7)
+        new_review = UserSpecific.objects.get(vocabulary=new_vocabulary[0])
+        self.assertEqual(new_review.wanikani_srs_numeric, 2)
+        self.assertTrue(new_review.needs_review)
+
+        self.assertEqual(find_review_counter_drift(self.user), {})
+
+        # Nothing is out of date anymore, so nothing is written.
+        with self.assertNumQueries(5):
+            self.assertEqual(
+                syncer.bulk_reconcile_assignments(assignments), (0, 6, 1)
+            )
+
+    def test_bulk_reconciliation_leaves_reviews_created_in_the_meantime(self):
+        vocabulary = create_vocab("new")
+        vocabulary.wk_subject_id = 100
+        vocabulary.save()
+        syncer = WanikaniUserSyncerV2(self.user.profile)
+        apply_assignment = UserSpecific.apply_assignment
+
+        def create_review_elsewhere(review, assignment):
+            # e.g. an admin adds the review after the syncer found it missing.
+            if not UserSpecific.objects.filter(
+                user=self.user, vocabulary=vocabulary
+            ).exists():
+                create_review(vocabulary, self.user)
+            apply_assignment(review, assignment)
+
+        with mock.patch.object(
+            UserSpecific, "apply_assignment", create_review_elsewhere
+        ):
+            syncer.bulk_reconcile_assignments(
+                [self._build_assignment(vocabulary.wk_subject_id, 2)]
+            )
+
+        self.assertEqual(
+            UserSpecific.objects.filter(
+                user=self.user, vocabulary=vocabulary
+            ).count(),
+            1,
+        )
+
+    def _build_study_material(self, subject_id, meaning_synonyms, updated_at):
+        study_material_json = deepcopy(
+            sample_api_responses_v2.single_study_material["data"][0]
+        )
+        study_material_json["data"]["subject_id"] = subject_id
+        study_material_json["data"]["meaning_synonyms"] = meaning_synonyms
+        study_material_json["data_updated_at"] = updated_at
+        return StudyMaterial(study_material_json, client=None)
+
+    def test_bulk_study_material_sync_only_changes_modified_synonyms(self):
+        syncer = WanikaniUserSyncerV2(self.user.profile)
+        updated_count = syncer.bulk_reconcile_study_materials(
+            [
+                self._build_study_material(
+                    1,
+                    ["young girl", "young lady"],
+                    "2018-01-01T00:00:00.000000Z",
+                ),
+                self._build_study_material(
+                    12345, ["no local review"], "2018-01-01T00:00:00.000000Z"
+                ),
+            ]
+        )
+        self.assertEqual(updated_count, 1)
+        kept_synonym = self.review.meaning_synonyms.get(text="young girl")
+
+        updated_count = syncer.bulk_reconcile_study_materials(
+            [
+                self._build_study_material(
+                    1, ["young girl", "maiden"], "2019-01-01T00:00:00.000000Z"
+                )
+            ]
+        )
+
+        self.assertEqual(updated_count, 1)
+        self.assertListEqual(
+            sorted(
+                self.review.meaning_synonyms.values_list("text", flat=True)
+            ),
+            ["maiden", "young girl"],
+        )
+        self.assertTrue(
+            self.review.meaning_synonyms.filter(id=kept_synonym.id).exists()
+        )
+        self.review.refresh_from_db()
+        self.assertEqual(self.review.meaning_note, "Sample meaning note")
+
+        # Already up to date, so nothing changes.
+        self.assertEqual(
+            syncer.bulk_reconcile_study_materials(
+                [
+                    self._build_study_material(
+                        1, [], "2019-01-01T00:00:00.000000Z"
+                    )
+                ]
+            ),
+            0,
+        )
+        self.assertEqual(self.review.meaning_synonyms.count(), 2)
@@ -0,0 +1,92 @@
+import uuid
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from api.sync.SyncCoordinator import SyncCoordinator, get_sync_metrics
+from api.sync.WanikaniClient import get_redis
+
+
+class TestSyncCoordinator(SimpleTestCase):
+    def setUp(self):
+        # A fresh user id per test, so that no lock or pending request is left
+        # over.
+        self.coordinator = SyncCoordinator(f"test-{uuid.uuid4()}")
+        self.runs = []
+
+    def _sync_requesting(self, *requests):
+        """
+        :return: A sync which, the first time it runs, makes the given
+        (full_sync, resync) requests while in flight.
+        """
+        self.request_results = []
+
+        def sync(full_sync, resync):
+            self.runs.append((full_sync, resync))
+            if len(self.runs) == 1:
+                for full, re in requests:
+                    self.request_results.append(
+                        self.coordinator.run(sync, full_sync=full, resync=re)
+                    )
+            return len(self.runs)
+
+        return sync
+
+    def test_full_sync_requested_in_flight_runs_once_the_recent_sync_is_done(
+        self,
+    ):
+        before = get_sync_metrics()
+
+        result = self.coordinator.run(self._sync_requesting((True, False)))
+
+        self.assertListEqual(self.runs, [(False, False), (True, False)])
+        self.assertListEqual(self.request_results, [None])
+        self.assertEqual(result, 2)
+        self.assertEqual(get_sync_metrics()["merged"], before["merged"] + 1)
+
+    def test_request_covered_by_the_sync_in_flight_is_skipped(self):
+        before = get_sync_metrics()
+
+        self.coordinator.run(
+            self._sync_requesting((False, False)), full_sync=True
+        )
+
+        self.assertListEqual(self.runs, [(True, False)])
+        self.assertEqual(get_sync_metrics()["skipped"], before["skipped"] + 1)
+
+    def test_requests_in_flight_coalesce_into_one_follow_up(self):
+        self.coordinator.run(
+            self._sync_requesting((False, True), (True, False), (True, False))
+        )
+
+        self.assertListEqual(self.runs, [(False, False), (True, True)])
+
+    def test_request_left_after_the_holder_released_the_lock_is_run(self):
+        connection = get_redis()
+        holder_lock = connection.lock(self.coordinator.lock_key, timeout=60)
+        self.assertTrue(holder_lock.acquire(blocking=False))
+        connection.hset(self.coordinator.running_key, "full_sync", 0)
+        hand_over = self.coordinator._hand_over
+
+        def hand_over_after_the_holder_finished(*args):
+            # The holder finishes between our failed attempt at the lock and
+            # leaving the request.
+            connection.delete(self.coordinator.running_key)
+            holder_lock.release()
+            return hand_over(*args)
+
+        with mock.patch.object(
+            self.coordinator,
+            "_hand_over",
+            side_effect=hand_over_after_the_holder_finished,
+        ):
+            result = self.coordinator.run(
+                lambda full_sync, resync: self.runs.append((full_sync, resync))
+                or "synced",
+                full_sync=True,
+            )
+
+        self.assertEqual(result, "synced")
+        self.assertListEqual(self.runs, [(True, False)])
+        self.assertFalse(connection.exists(self.coordinator.pending_key))
+        self.assertFalse(connection.exists(self.coordinator.lock_key))
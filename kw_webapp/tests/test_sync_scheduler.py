@@ -0,0 +1,38 @@
+import uuid
+
+from django.test import SimpleTestCase
+
+from api.sync.SyncScheduler import SyncScheduler
+from api.sync.WanikaniClient import get_redis
+
+
+class TestSyncScheduler(SimpleTestCase):
+    def setUp(self):
+        self.scheduler = SyncScheduler(f"test-{uuid.uuid4()}", max_in_flight=2)
+        self.addCleanup(
+            get_redis().delete,
+            self.scheduler.schedule_key,
+            self.scheduler.in_flight_key,
+        )
+
+    def test_syncs_are_spread_across_the_interval(self):
+        self.scheduler.schedule([3, 1, 2, 4], interval_seconds=400, now=1000)
+
+        self.assertListEqual(self.scheduler.pop_due(now=1000), [3])
+        self.scheduler.finish(3)
+        self.assertListEqual(self.scheduler.pop_due(now=1099), [])
+        self.assertListEqual(self.scheduler.pop_due(now=1200), [1, 2])
+        self.assertDictEqual(
+            self.scheduler.backlog(now=1200),
+            {"scheduled": 1, "overdue": 0, "in_flight": 2},
+        )
+
+    def test_syncs_in_flight_are_bounded(self):
+        self.scheduler.schedule([1, 2, 3], interval_seconds=3, now=1000)
+
+        self.assertListEqual(self.scheduler.pop_due(now=1010), [1, 2])
+        self.assertListEqual(self.scheduler.pop_due(now=1010), [])
+        self.assertEqual(self.scheduler.backlog(now=1010)["overdue"], 1)
+
+        self.scheduler.finish(1)
+        self.assertListEqual(self.scheduler.pop_due(now=1010), [3])
@@ -3,19 +3,29 @@ from copy import deepcopy
 
 import responses
 import time
-from django.test import TestCase
+from datetime import timedelta
+from threading import Event, Thread
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 from api.sync.SyncerFactory import Syncer
+from api.sync.WanikaniClient import get_redis
 from api.sync.WanikaniUserSyncerV2 import WanikaniUserSyncerV2
 from kw_webapp import constants
+from kw_webapp.counters import find_review_counter_drift, get_review_counts
 from kw_webapp.models import (
     Vocabulary,
     UserSpecific,
     MeaningSynonym,
     AnswerSynonym,
+    Profile,
 )
-from kw_webapp.srs import all_srs
+from kw_webapp.srs import all_srs, flag_due_reviews
 from kw_webapp.tasks import (
     past_time,
     associate_vocab_to_user,
@@ -30,6 +40,8 @@ from kw_webapp.tasks import (
     get_vocab_by_kanji,
     get_level_pages,
     sync_with_wk,
+    get_user_dashboard_stats,
+    get_sync_scheduler,
 )
 from kw_webapp.tests import sample_api_responses_v2
 from kw_webapp.tests.utils import (
@@ -38,6 +50,7 @@ from kw_webapp.tests.utils import (
     create_user,
     create_profile,
     create_reading,
+    create_lesson,
 )
 from kw_webapp.utils import generate_user_stats
 
@@ -68,6 +81,30 @@ class TestTasks(TestCase):
         review = UserSpecific.objects.get(pk=self.review.id)
         self.assertTrue(review.needs_review)
 
+    def test_srs_flags_reviews_in_fixed_size_batches(self):
+        reviews = [self.review] + [
+            create_review(create_vocab(f"due {index}"), self.user)
+            for index in range(4)
+        ]
+        UserSpecific.objects.filter(
+            id__in=[review.id for review in reviews]
+        ).update(needs_review=False, next_review_date=past_time(1))
+        get_review_counts(self.user)
+
+        with mock.patch(
+            "kw_webapp.srs.SRS_FLAG_BATCH_SIZE", 2
+        ), CaptureQueriesContext(connection) as queries:
+            affected_count = all_srs()
+
+        self.assertEqual(affected_count, 5)
+        updates = [
+            query["sql"]
+            for query in queries.captured_queries
+            if query["sql"].startswith('UPDATE "kw_webapp_userspecific"')
+        ]
+        self.assertEqual(len(updates), 3)
+        self.assertEqual(find_review_counter_drift(self.user), {})
+
     def test_associate_vocab_to_user_successfully_creates_review(self):
         new_vocab = create_vocab("dishwasher")
 
@@ -125,6 +162,31 @@ class TestTasks(TestCase):
         reviews_affected = all_srs()
         self.assertEqual(reviews_affected, 0)
 
+    def test_flagging_due_reviews_only_looks_at_the_latest_window(self):
+        cache.delete(constants.SRS_DUE_WINDOW_CACHE_KEY)
+        self.review.needs_review = False
+        self.review.next_review_date = past_time(24)
+        self.review.save()
+
+        # Without a previous window, everything due is flagged.
+        self.assertEqual(flag_due_reviews(), 1)
+        self.review.refresh_from_db()
+        self.assertTrue(self.review.needs_review)
+
+        # Fell due long before the previous window, so it is left to the full
+        # all_srs sweep.
+        self.review.needs_review = False
+        self.review.save()
+        recently_due = create_review(create_vocab("recently due"), self.user)
+        recently_due.needs_review = False
+        recently_due.next_review_date = timezone.now()
+        recently_due.save()
+
+        self.assertEqual(flag_due_reviews(), 1)
+        recently_due.refresh_from_db()
+        self.assertTrue(recently_due.needs_review)
+        self.assertEqual(all_srs(), 1)
+
     def test_returning_review_count_that_is_time_delimited_functions_correctly(
         self
     ):
@@ -182,6 +244,41 @@ class TestTasks(TestCase):
         affected_count = sync_all_users_to_wk()
         self.assertEqual(affected_count, 1)
 
+    def test_update_all_users_skips_idle_users_and_schedules_by_priority(self):
+        now = timezone.now()
+        idle_user = create_user("idle")
+        create_profile(idle_user, "any_key", 5)
+        recent_user = create_user("recent")
+        create_profile(recent_user, "any_key", 5)
+        Profile.objects.filter(user=self.user).update(
+            last_visit=now - timedelta(days=3),
+            last_wanikani_sync_date=now - timedelta(hours=1),
+        )
+        Profile.objects.filter(user=recent_user).update(
+            last_visit=now - timedelta(hours=1),
+            last_wanikani_sync_date=now - timedelta(days=5),
+        )
+        # Found nothing last time, and hasn't been back since.
+        Profile.objects.filter(user=idle_user).update(
+            last_visit=now - timedelta(days=2),
+            last_wanikani_sync_date=now - timedelta(days=1),
+            last_sync_found_changes=False,
+        )
+
+        affected_count = sync_all_users_to_wk()
+
+        self.assertEqual(affected_count, 2)
+        scheduler = get_sync_scheduler()
+        self.assertListEqual(
+            [
+                int(user_id)
+                for user_id in get_redis().zrange(
+                    scheduler.schedule_key, 0, -1
+                )
+            ],
+            [recent_user.id, self.user.id],
+        )
+
     @responses.activate
     def test_when_reading_level_changes_on_wanikani_we_catch_that_change_and_comply(
         self
@@ -225,4 +322,85 @@ class TestTasks(TestCase):
         self.user.refresh_from_db()
         self.user.profile.refresh_from_db()
         self.assertEqual(get_users_lessons(self.user).count(), 0)
-        self.assertEqual(self.user.profile.level, 5)
\ No newline at end of file
+        self.assertEqual(self.user.profile.level, 5)
+
+    def test_dashboard_stats_match_the_individual_review_queries(self):
+        future_review = create_review(create_vocab("future"), self.user)
+        future_review.needs_review = False
+        future_review.streak = 5
+        future_review.next_review_date = timezone.now() + timedelta(minutes=30)
+        future_review.save()
+        create_lesson(create_vocab("lesson"), self.user)
+        get_review_counts(self.user)
+
+        # One read of the review counters, and one aggregation for the upcoming
+        # reviews.
+        with self.assertNumQueries(2):
+            stats = get_user_dashboard_stats(self.user)
+
+        self.assertEqual(
+            stats["reviews_count"],
+            get_users_current_reviews(self.user).count(),
+        )
+        self.assertEqual(
+            stats["lessons_count"], get_users_lessons(self.user).count()
+        )
+        self.assertEqual(stats["reviews_within_hour_count"], 1)
+        self.assertEqual(stats["reviews_within_day_count"], 1)
+        self.assertEqual(
+            stats["next_review_at"], future_review.next_review_date
+        )
+        self.assertEqual(
+            list(stats["srs_counts"].items()),
+            [
+                ("untrained", 1),
+                ("apprentice", 1),
+                ("guru", 1),
+                ("master", 0),
+                ("enlightened", 0),
+                ("burned", 0),
+            ],
+        )
+
+
+class TestFlaggingDueReviewsConcurrently(TransactionTestCase):
+    def setUp(self):
+        self.user = create_user("Tadgh")
+        create_profile(self.user, "any_key", 5)
+        self.reviews = [
+            create_review(create_vocab(f"due {index}"), self.user)
+            for index in range(3)
+        ]
+        UserSpecific.objects.filter(
+            id__in=[review.id for review in self.reviews]
+        ).update(needs_review=False, next_review_date=past_time(1))
+        get_review_counts(self.user)
+
+    def test_srs_skips_reviews_which_are_being_answered(self):
+        answered_review = self.reviews[0]
+        locked = Event()
+        flagged = Event()
+
+        def answer_review():
+            with transaction.atomic():
+                review = UserSpecific.objects.select_for_update().get(
+                    id=answered_review.id
+                )
+                locked.set()
+                flagged.wait(10)
+                review.streak += 1
+                review.next_review_date = timezone.now() + timedelta(hours=4)
+                review.save()
+            connection.close()
+
+        answering = Thread(target=answer_review)
+        answering.start()
+        locked.wait(10)
+        affected_count = all_srs()
+        flagged.set()
+        answering.join()
+
+        self.assertEqual(affected_count, 2)
+        answered_review.refresh_from_db()
+        self.assertFalse(answered_review.needs_review)
+        self.assertEqual(find_review_counter_drift(self.user), {})
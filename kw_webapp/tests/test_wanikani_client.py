@@ -0,0 +1,140 @@
+import json
+import threading
+import time
+import uuid
+from copy import deepcopy
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from django.test import SimpleTestCase, override_settings
+from wanikani_api.exceptions import InvalidWanikaniApiKeyException
+
+from api.sync.WanikaniClient import (
+    ConcurrencyLimit,
+    RateLimitedClient,
+    TokenBucket,
+    get_redis,
+)
+from kw_webapp.tests import sample_api_responses_v2
+
+
+class StubWanikaniServer:
+    """
+    A local HTTP server which answers each request with the next scripted
+    (status, headers, body) response, and records the paths it was asked for.
+    """
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.paths = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.paths.append(self.path)
+                status, headers, body = stub.responses.pop(0)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(json.dumps(body).encode())
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(("127.0.0.1", 0), Handler)
+        self.root = f"http://127.0.0.1:{self.server.server_port}/"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@override_settings(WANIKANI_BACKOFF_SECONDS=0.01)
+class TestRateLimitedClient(SimpleTestCase):
+    def setUp(self):
+        # A fresh key per test, so that its bucket starts full.
+        self.api_key = str(uuid.uuid4())
+
+    def test_throttled_and_failed_requests_are_retried(self):
+        with StubWanikaniServer(
+            [
+                (429, {"RateLimit-Reset": str(int(time.time()))}, {}),
+                (503, {}, {}),
+                (200, {}, sample_api_responses_v2.user_profile),
+            ]
+        ) as stub:
+            client = RateLimitedClient(self.api_key, api_root=stub.root)
+            user = client.user_information()
+
+        self.assertEqual(user.username, "Tadgh11")
+        self.assertListEqual(stub.paths, ["/user"] * 3)
+
+    def test_collections_are_paged_through_the_same_client(self):
+        first_page = deepcopy(sample_api_responses_v2.single_assignment)
+        second_page = deepcopy(sample_api_responses_v2.single_assignment)
+        with StubWanikaniServer([]) as stub:
+            first_page["pages"][
+                "next_url"
+            ] = f"{stub.root}assignments?page_after_id=1"
+            stub.responses = [(200, {}, first_page), (200, {}, second_page)]
+            client = RateLimitedClient(self.api_key, api_root=stub.root)
+            assignments = list(
+                client.assignments(subject_types="vocabulary", fetch_all=True)
+            )
+
+        self.assertEqual(len(assignments), 2)
+        self.assertListEqual(
+            stub.paths,
+            [
+                "/assignments?subject_types=vocabulary",
+                "/assignments?page_after_id=1",
+            ],
+        )
+
+    def test_invalid_keys_are_not_retried(self):
+        with StubWanikaniServer([(401, {}, {})]) as stub:
+            client = RateLimitedClient(self.api_key, api_root=stub.root)
+            with self.assertRaises(InvalidWanikaniApiKeyException):
+                client.user_information()
+
+        self.assertEqual(len(stub.paths), 1)
+
+    def test_token_bucket_makes_callers_wait_once_empty(self):
+        bucket = TokenBucket(f"test:{self.api_key}", capacity=2, rate=1)
+        self.addCleanup(get_redis().delete, bucket.key)
+
+        self.assertEqual(bucket.try_acquire(), 0)
+        self.assertEqual(bucket.try_acquire(), 0)
+        wait = bucket.try_acquire()
+
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 1)
+
+    def test_concurrency_limit_is_shared_through_redis(self):
+        limit = ConcurrencyLimit(
+            f"test:{self.api_key}", limit=1, lease_seconds=60
+        )
+        # A second instance stands in for another worker process.
+        other_worker = ConcurrencyLimit(
+            f"test:{self.api_key}", limit=1, lease_seconds=60
+        )
+        self.addCleanup(get_redis().delete, limit.key)
+
+        self.assertTrue(limit.try_acquire("first"))
+        self.assertFalse(other_worker.try_acquire("second"))
+        limit.release("first")
+        self.assertTrue(other_worker.try_acquire("second"))
+
+    def test_concurrency_limit_drops_leases_of_dead_holders(self):
+        limit = ConcurrencyLimit(
+            f"test:{self.api_key}", limit=1, lease_seconds=60
+        )
+        self.addCleanup(get_redis().delete, limit.key)
+        get_redis().zadd(limit.key, {"dead": time.time() - 61})
+
+        self.assertTrue(limit.try_acquire("alive"))
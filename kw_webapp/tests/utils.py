@@ -13,6 +13,7 @@ from kw_webapp.models import (
 )
 
 from requests.exceptions import ConnectionError
+from kw_webapp.tasks import invalidate_catalogue
 from kw_webapp.tests import sample_api_responses_v2
 
 
@@ -197,3 +198,7 @@ def setupTestFixture(self):
     }
     self.reading.save()
     self.review = create_review(self.vocabulary, self.user)
+    # The catalogue caches are only invalidated once a change commits, which
+    # never happens inside a test case's transaction, so start every test on
+    # a fresh catalogue version.
+    invalidate_catalogue()
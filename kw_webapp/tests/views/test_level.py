@@ -3,10 +3,14 @@ from unittest import mock
 
 import responses
 from rest_framework.reverse import reverse
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase
 
 from kw_webapp.models import Level
-from kw_webapp.tests.utils import setupTestFixture
+from kw_webapp.tests.utils import (
+    setupTestFixture,
+    create_reading,
+    create_vocab,
+)
 from kw_webapp.utils import one_time_orphaned_level_clear
 
 
@@ -96,3 +100,37 @@ class TestLevel(APITestCase):
         # No more orphaned levels!
         level_count = Level.objects.filter(profile=None).count()
         self.assertEqual(level_count, 0)
+
+    def test_level_list_takes_a_constant_number_of_queries(self):
+        self.client.force_login(user=self.user)
+        self.client.get(reverse("api:level-list"))
+
+        # Session, user, profile and unlocked levels. Vocabulary counts are
+        # cached.
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse("api:level-list"))
+
+        level_five = response.data[4]
+        self.assertEqual(level_five["level"], 5)
+        self.assertTrue(level_five["unlocked"])
+        self.assertEqual(level_five["vocabulary_count"], 1)
+
+
+class TestLevelCatalogueInvalidation(APITransactionTestCase):
+    """
+    The level catalogue is only invalidated once a change is committed, which
+    the test case transaction would never do.
+    """
+
+    def setUp(self):
+        setupTestFixture(self)
+
+    def test_level_vocabulary_counts_are_refreshed_when_readings_change(self):
+        self.client.force_login(user=self.user)
+        response = self.client.get(reverse("api:level-detail", args=(6,)))
+        self.assertEqual(response.data["vocabulary_count"], 0)
+
+        create_reading(create_vocab("new"), "あたらしい", "新しい", 6)
+
+        response = self.client.get(reverse("api:level-detail", args=(6,)))
+        self.assertEqual(response.data["vocabulary_count"], 1)
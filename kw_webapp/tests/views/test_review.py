@@ -1,10 +1,21 @@
+import base64
+import json
+from datetime import timedelta
+
+from django.test import override_settings
 from django.utils import timezone
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
 
-from kw_webapp.constants import WkSrsLevel, WANIKANI_SRS_LEVELS
+from kw_webapp.constants import (
+    REVIEW_DUE_MODE_READ_TIME,
+    WkSrsLevel,
+    WANIKANI_SRS_LEVELS,
+)
+from kw_webapp.models import UserSpecific
 from kw_webapp.tests.utils import (
     create_lesson,
+    create_reading,
     create_vocab,
     create_review,
     setupTestFixture,
@@ -63,6 +74,67 @@ class TestReview(APITestCase):
         self.assertEqual(response.data["reviews_count"], 1)
         self.assertEqual(response.data["lessons_count"], 1)
 
+    @override_settings(REVIEW_DUE_MODE=REVIEW_DUE_MODE_READ_TIME)
+    def test_reviews_are_due_at_read_time_without_an_srs_run(self):
+        self.client.force_login(self.user)
+        self.review.needs_review = False
+        self.review.next_review_date = timezone.now() - timedelta(minutes=5)
+        self.review.save()
+
+        response = self.client.get(reverse("api:review-counts"))
+        self.assertEqual(response.data["reviews_count"], 1)
+        response = self.client.get(reverse("api:review-current"))
+        self.assertEqual(response.data["count"], 1)
+        response = self.client.get(
+            reverse("api:review-detail", args=(self.review.id,))
+        )
+        self.assertTrue(response.data["needs_review"])
+
+        response = self.client.post(
+            reverse("api:review-correct", args=(self.review.id,)),
+            data={"wrong_before": "false"},
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse("api:review-counts"))
+        self.assertEqual(response.data["reviews_count"], 0)
+
+        # Reviews stay put while the user is on vacation.
+        self.review.refresh_from_db()
+        self.review.next_review_date = timezone.now() - timedelta(minutes=5)
+        self.review.save()
+        self.user.profile.on_vacation = True
+        self.user.profile.save()
+        response = self.client.get(reverse("api:review-current"))
+        self.assertEqual(response.data["count"], 0)
+        response = self.client.get(
+            reverse("api:review-detail", args=(self.review.id,))
+        )
+        self.assertFalse(response.data["needs_review"])
+        response = self.client.post(
+            reverse("api:review-correct", args=(self.review.id,)),
+            data={"wrong_before": "false"},
+        )
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post(
+            reverse("api:review-answers"),
+            data=[{"id": self.review.id, "correct": True}],
+            format="json",
+        )
+        self.assertEqual(response.data[0]["error"], "forbidden")
+
+    def test_current_reviews_can_be_streamed(self):
+        self.client.force_login(self.user)
+        create_review(create_vocab("another review"), self.user)
+
+        response = self.client.get(
+            reverse("api:review-current") + "?stream=true"
+        )
+
+        self.assertEqual(response["Content-Type"], "application/json")
+        reviews = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(len(reviews), 2)
+        self.assertIn(self.review.id, [review["id"] for review in reviews])
+
     def test_nonexistent_user_specific_id_raises_error_in_record_answer(self):
         self.client.force_login(user=self.user)
         non_existent_review_id = 9999
@@ -214,17 +286,26 @@ class TestReview(APITestCase):
     def test_setting_reviews_to_order_by_level_works(self):
         self.client.force_login(self.user)
 
-        level_4_review = create_review(create_vocab("level4"), self.user)
+        level_4_vocab = create_vocab("level4")
+        level_4_vocab.level = 4
+        level_4_vocab.save()
+        level_4_review = create_review(level_4_vocab, self.user)
         level_4_review.vocabulary.readings.create(
             level=4, character="level4", kana="level4"
         )
 
-        level_5_review = create_review(create_vocab("level5"), self.user)
+        level_5_vocab = create_vocab("level5")
+        level_5_vocab.level = 5
+        level_5_vocab.save()
+        level_5_review = create_review(level_5_vocab, self.user)
         level_5_review.vocabulary.readings.create(
             level=5, character="level5", kana="level5"
         )
 
-        level_3_review = create_review(create_vocab("level3"), self.user)
+        level_3_vocab = create_vocab("level3")
+        level_3_vocab.level = 3
+        level_3_vocab.save()
+        level_3_review = create_review(level_3_vocab, self.user)
         level_3_review.vocabulary.readings.create(
             level=3, character="level3", kana="level3"
         )
@@ -273,3 +354,145 @@ class TestReview(APITestCase):
         data = response.data
         self.assertEqual(data["count"], 1)
         # Ensure that any reviews that are apprentice on WK are not shown.
+
+    def test_batch_answers_apply_each_transition(self):
+        self.client.force_login(self.user)
+        lesson = create_lesson(create_vocab("lesson"), self.user)
+
+        response = self.client.post(
+            reverse("api:review-answers"),
+            data=[
+                {"id": self.review.id, "correct": True, "wrong_before": False},
+                {"id": lesson.id, "correct": False},
+            ],
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]["id"], self.review.id)
+        self.assertEqual(response.data[0]["streak"], 2)
+        self.assertFalse(response.data[0]["needs_review"])
+        self.review.refresh_from_db()
+        lesson.refresh_from_db()
+        self.assertEqual(self.review.streak, 2)
+        self.assertEqual(self.review.correct, 1)
+        self.assertEqual(lesson.incorrect, 1)
+        self.assertTrue(lesson.needs_review)
+
+    def test_batch_answers_for_the_same_review_are_applied_in_order(self):
+        self.client.force_login(self.user)
+        self.review.streak = 3
+        self.review.save()
+
+        response = self.client.post(
+            reverse("api:review-answers"),
+            data=[
+                {"id": self.review.id, "correct": False},
+                {"id": self.review.id, "correct": True, "wrong_before": True},
+            ],
+            format="json",
+        )
+
+        self.assertEqual(response.data[0]["streak"], 2)
+        self.assertEqual(response.data[1]["streak"], 2)
+        self.review.refresh_from_db()
+        self.assertEqual(self.review.incorrect, 1)
+        self.assertEqual(self.review.correct, 0)
+        self.assertFalse(self.review.needs_review)
+
+    def test_batch_answers_report_per_item_errors(self):
+        other_review = create_review(create_vocab("not mine"), self.admin)
+        self.admin.is_superuser = False
+        self.admin.save()
+        self.client.force_login(self.user)
+
+        response = self.client.post(
+            reverse("api:review-answers"),
+            data=[
+                {"id": other_review.id, "correct": True},
+                {"id": 9999, "correct": True},
+                {"id": self.review.id, "correct": True},
+            ],
+            format="json",
+        )
+
+        self.assertEqual(response.data[0]["error"], "forbidden")
+        self.assertEqual(response.data[1]["error"], "not_found")
+        self.assertEqual(response.data[2]["streak"], 2)
+        other_review.refresh_from_db()
+        self.assertEqual(other_review.streak, 1)
+
+    def test_batch_answers_reject_malformed_submissions(self):
+        self.client.force_login(self.user)
+
+        response = self.client.post(
+            reverse("api:review-answers"),
+            data=[{"correct": True}],
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_keyset_pages_walk_every_review_in_id_order(self):
+        self.client.force_login(self.user)
+        self.user.profile.order_reviews_by_level = True
+        self.user.profile.save()
+        self.review.vocabulary.level = 5
+        self.review.vocabulary.save()
+        for level in [3, 5, 4, 3]:
+            vocab = create_vocab(f"level{level}")
+            vocab.level = level
+            vocab.save()
+            create_review(vocab, self.user)
+
+        url = reverse("api:review-list") + "?pagination=keyset&limit=2"
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertNotIn("count", response.data)
+            seen.extend(review["id"] for review in response.data["results"])
+            url = response.data["next"]
+
+        # Even though the user orders their reviews by level, which no index
+        # could seek through.
+        expected = UserSpecific.objects.filter(user=self.user).order_by("id")
+        self.assertListEqual(seen, [review.id for review in expected])
+
+    def test_keyset_pagination_rejects_malformed_cursors(self):
+        self.client.force_login(self.user)
+
+        response = self.client.get(
+            reverse("api:review-list") + "?cursor=garbage"
+        )
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_keyset_pagination_rejects_cursors_of_the_wrong_types(self):
+        self.client.force_login(self.user)
+
+        for key in ("x", None, True, [1], 1.5):
+            cursor = base64.urlsafe_b64encode(
+                json.dumps(key).encode()
+            ).decode()
+            response = self.client.get(
+                reverse("api:review-list") + f"?cursor={cursor}"
+            )
+            with self.subTest(key=key):
+                self.assertEqual(response.status_code, 404)
+
+    def test_ordering_by_level_does_not_repeat_reviews_with_several_readings(
+        self,
+    ):
+        self.client.force_login(self.user)
+        self.user.profile.order_reviews_by_level = True
+        self.user.profile.save()
+        create_reading(self.vocabulary, "びょう", "猫", 5)
+        self.review.needs_review = True
+        self.review.save()
+
+        response = self.client.get(reverse("api:review-current"))
+
+        self.assertListEqual(
+            [review["id"] for review in response.data["results"]],
+            [self.review.id],
+        )
@@ -1,9 +1,14 @@
+from unittest import mock
+
 import responses
+from django.core.cache import cache
 from django.utils import timezone
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
 import KW.settings as settings
+from kw_webapp import constants
 from kw_webapp.models import Profile
+from kw_webapp.tasks import build_onboarding_chain, onboarding_sync
 from kw_webapp.tests.utils import (
     create_review_for_specific_time,
     setupTestFixture,
@@ -104,7 +109,63 @@ class TestUser(APITestCase):
         )
 
         user_profile = Profile.objects.get(user__username=fake_username)
+        assert user_profile.onboarding_status == constants.ONBOARDING_QUEUED
+
+        # Run the onboarding which was queued, in process.
+        build_onboarding_chain(user_profile.user_id).apply()
+
+        user_profile.refresh_from_db()
         assert len(user_profile.unlocked_levels_list()) == 2
+        assert user_profile.onboarding_status == constants.ONBOARDING_COMPLETE
+
+    def test_onboarding_sync_is_retried_until_the_sync_actually_runs(self):
+        # The first attempt is merged into a sync already in flight, so only
+        # the retry gets a result.
+        with mock.patch(
+            "kw_webapp.tasks.sync_with_wk", side_effect=[None, (True, 0, 0)]
+        ) as sync:
+            onboarding_sync.apply(args=(self.user.id,))
+
+        assert sync.call_count == 2
+        self.user.profile.refresh_from_db()
+        assert (
+            self.user.profile.onboarding_status == constants.ONBOARDING_SYNCING
+        )
+
+    def test_onboarding_fails_if_the_sync_never_gets_to_run(self):
+        # Retries run nested in process, so keep them few.
+        with mock.patch.object(onboarding_sync, "max_retries", 2), mock.patch(
+            "kw_webapp.tasks.sync_with_wk", return_value=None
+        ) as sync:
+            onboarding_sync.apply(args=(self.user.id,))
+
+        assert sync.call_count == 3
+        self.user.profile.refresh_from_db()
+        assert (
+            self.user.profile.onboarding_status == constants.ONBOARDING_FAILED
+        )
+
+    def test_onboarding_status_endpoint_reports_progress(self):
+        self.client.force_login(self.user)
+        Profile.objects.filter(user=self.user).update(
+            onboarding_status=constants.ONBOARDING_SYNCING
+        )
+
+        response = self.client.get(reverse("api:user-onboarding"))
+
+        assert response.data == {"status": constants.ONBOARDING_SYNCING}
+
+    def test_repeated_logins_only_queue_one_sync(self):
+        cache.delete(f"{constants.LOGIN_SYNC_CACHE_PREFIX}:{self.user.id}")
+
+        with mock.patch("kw_webapp.tasks.sync_with_wk.delay") as delay:
+            self.client.force_login(self.user)
+            self.client.logout()
+            self.client.force_login(self.user)
+
+        delay.assert_called_once_with(
+            self.user.id, full=self.user.profile.follow_me
+        )
 
     def test_login_works_with_email_or_username(self):
         response = self.client.post(
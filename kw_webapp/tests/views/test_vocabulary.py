@@ -1,5 +1,13 @@
+import json
+from threading import Thread
+
+from django.db import connection, transaction
 from rest_framework.reverse import reverse
-from rest_framework.test import APITestCase
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
+
+from api.responses import StreamingListResponse
+from api.serializers import ReadingSerializer
+from kw_webapp.models import Reading
 
 from kw_webapp.constants import WkSrsLevel
 from kw_webapp.tests.utils import (
@@ -48,6 +56,21 @@ class TestVocabulary(APITestCase):
         assert data["results"][0]["is_reviewable"] is False
         assert data["results"][1]["is_reviewable"] is True
 
+    def test_vocabulary_list_query_count_does_not_grow_with_page_size(self):
+        self.client.force_login(self.user)
+        for meaning in ["one", "two", "three"]:
+            vocabulary = create_vocab(meaning)
+            create_reading(vocabulary, meaning, meaning, 5)
+            create_review(vocabulary, self.user)
+
+        with self.assertNumQueries(7):
+            response = self.client.get(reverse("api:vocabulary-list"))
+
+        self.assertEqual(len(response.data["results"]), 4)
+        for vocabulary in response.data["results"]:
+            self.assertIsNotNone(vocabulary["review"])
+            self.assertTrue(vocabulary["is_reviewable"])
+
     def test_meaning_contains_checks_for_word_boundaries(self):
         self.client.force_login(self.user)
         create_vocab("frog")
@@ -71,6 +94,35 @@ class TestVocabulary(APITestCase):
         assert len(data["results"]) == 1
         assert vocab_with_synonym.id == data["results"][0].get("id")
 
+    def test_meaning_contains_ranks_meaning_matches_before_synonym_matches(
+        self,
+    ):
+        self.client.force_login(self.user)
+        vocab_with_synonym = create_vocab_with_meaning_synonym(
+            "bioluminescent", "shiny animal", self.user
+        )
+        shiny = create_vocab("shiny")
+
+        response = self.client.get(
+            reverse("api:vocabulary-list") + "?meaning_contains=shiny"
+        )
+
+        assert [vocab["id"] for vocab in response.data["results"]] == [
+            shiny.id,
+            vocab_with_synonym.id,
+        ]
+
+    def test_meaning_contains_matches_whole_phrases(self):
+        self.client.force_login(self.user)
+        create_vocab("not down, up")
+        create_vocab("down the line")
+
+        response = self.client.get(
+            reverse("api:vocabulary-list") + "?meaning_contains=Down%20the"
+        )
+
+        assert len(response.data["results"]) == 1
+
     def test_meaning_contains_doesnt_check_another_user_synonyms(self):
         create_vocab_with_meaning_synonym("bioluminescent", "shiny animal", self.user)
 
@@ -110,3 +162,113 @@ class TestVocabulary(APITestCase):
         self.assertTrue(
             data["readings"][0]["furigana_sentence_ja"] is not None
         )
+
+    def test_streamed_vocabulary_matches_the_paginated_list(self):
+        self.client.force_login(self.user)
+        for index in range(4):
+            create_reading(
+                create_vocab(f"streamed {index}"), f"か{index}", f"火{index}", 5
+            )
+
+        paginated = self.client.get(reverse("api:vocabulary-list"))
+        streamed = self.client.get(
+            reverse("api:vocabulary-list") + "?stream=true"
+        )
+
+        self.assertTrue(streamed.streaming)
+        self.assertEqual(
+            json.loads(b"".join(streamed.streaming_content)),
+            json.loads(json.dumps(paginated.data["results"])),
+        )
+
+    def test_streaming_splits_the_queryset_into_chunks(self):
+        for index in range(4):
+            create_reading(
+                create_vocab(f"chunked {index}"), f"か{index}", f"火{index}", 5
+            )
+        queryset = Reading.objects.order_by("id").prefetch_related(
+            "parts_of_speech"
+        )
+
+        # 5 readings in chunks of 2: one server-side cursor for the readings,
+        # and a parts of speech query per chunk.
+        with self.assertNumQueries(4):
+            response = StreamingListResponse(
+                queryset, ReadingSerializer, chunk_size=2
+            )
+            items = json.loads(b"".join(response.streaming_content))
+
+        self.assertListEqual(
+            [item["id"] for item in items],
+            list(queryset.values_list("id", flat=True)),
+        )
+
+    def test_cached_vocabulary_keeps_review_fields_per_user(self):
+        url = reverse("api:vocabulary-detail", args=(self.vocabulary.id,))
+        self.client.force_authenticate(user=self.user)
+        users_response = self.client.get(url)
+
+        self.client.force_authenticate(user=self.admin)
+        admins_response = self.client.get(url)
+
+        self.assertEqual(users_response.data["review"], self.review.id)
+        self.assertIsNone(admins_response.data["review"])
+        self.assertFalse(admins_response.data["is_reviewable"])
+        self.assertEqual(
+            users_response.data["meaning"], admins_response.data["meaning"]
+        )
+        self.assertNotEqual(users_response["ETag"], admins_response["ETag"])
+
+
+class TestCatalogueCacheInvalidation(APITransactionTestCase):
+    """
+    The catalogue version only moves on once a change is committed, which the
+    test case transaction would never do.
+    """
+
+    def setUp(self):
+        setupTestFixture(self)
+
+    def test_cached_reading_is_served_without_queries_until_it_changes(self):
+        self.client.force_authenticate(user=self.user)
+        url = reverse("api:reading-detail", args=(self.reading.id,))
+        etag = self.client.get(url)["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.reading.kana = "いぬ"
+        self.reading.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["kana"], "いぬ")
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_read_during_an_uncommitted_change_is_not_cached_under_the_new_version(
+        self,
+    ):
+        url = reverse("api:vocabulary-detail", args=(self.vocabulary.id,))
+        self.client.force_authenticate(user=self.user)
+        stale_responses = []
+
+        def read_from_another_request():
+            client = APIClient()
+            client.force_authenticate(user=self.user)
+            stale_responses.append(client.get(url))
+            connection.close()
+
+        with transaction.atomic():
+            self.vocabulary.meaning = "glowing bat"
+            self.vocabulary.save()
+            # Another connection still sees the committed rows, and caches
+            # them.
+            reader = Thread(target=read_from_another_request)
+            reader.start()
+            reader.join()
+
+        self.assertEqual(stale_responses[0].data["meaning"], "radioactive bat")
+        response = self.client.get(url)
+        self.assertEqual(response.data["meaning"], "glowing bat")
+        self.assertNotEqual(response["ETag"], stale_responses[0]["ETag"])
@@ -6,6 +6,7 @@ from django.utils import timezone
 from rest_framework.authtoken.models import Token
 
 from kw_webapp import constants
+from kw_webapp.counters import invalidate_review_counters
 from kw_webapp.models import (
     UserSpecific,
     Profile,
@@ -35,11 +36,13 @@ def reset_reviews_for_user(user):
     reviews = UserSpecific.objects.filter(user=user)
     reviews.update(needs_review=False)
     reviews.update(last_studied=timezone.now())
+    invalidate_review_counters(user.id)
 
 
 def flag_all_reviews_for_user(user, needed):
     reviews = UserSpecific.objects.filter(user=user)
     reviews.update(needs_review=needed)
+    invalidate_review_counters(user.id)
 
 
 def reset_unlocked_levels_for_user(user):